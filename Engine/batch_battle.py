@@ -0,0 +1,671 @@
+"""Batched battle engine, resolves one turn for N battle arrays at once using NumPy.
+
+Every row of the batch is a full battle array (12*POK_LEN + FIELD_LEN), the same layout that
+Battle uses, so a GameState can be tiled into a batch and played out without the Python cost
+of going through Battle turn by turn.
+
+Actions are integer codes per row (the action codes of Models.helper):
+    0..3 -> use move 0..3 of the active Pokemon
+    4..9 -> switch to party slot (code - 4)
+"""
+import numpy as np
+from Utils.loader import TYPE_CHART_ARRAY
+from Utils.cache import PerBattle
+from Models.idx_const import Pok, Move, Sec, Flags, Field, POK_LEN, MOVE_STRIDE, OFFSET_MOVE
+from Models.helper import (
+    Status, VolStatus, MoveCategory, Target, Types, BattlePhase, AbilityActivation, SWITCH_OFFSET, N_ACTIONS
+)
+from DataBase.AbilitiesDB import AbilityNames
+
+FOE_TARGETS = np.array([
+    Target.NORMAL,
+    Target.ADJACENT_FOE,
+    Target.ALL_ADJACENT_FOES,
+    Target.ANY,
+    Target.FOE_SIDE,
+    Target.RANDOM_NORMAL,
+    Target.SCRIPTED
+])
+
+SELF_TARGETS = np.array([
+    Target.ADJACENT_ALLY,
+    Target.ADJACENT_ALLY_OR_SELF,
+    Target.ALLIES,
+    Target.ALLY_SIDE,
+    Target.SELF
+])
+
+# Same sets as lookups by target, the targets are small integers
+IS_FOE_TARGET = np.zeros(len(vars(Target)), dtype=bool)
+IS_FOE_TARGET[FOE_TARGETS] = True
+IS_SELF_TARGET = np.zeros(len(vars(Target)), dtype=bool)
+IS_SELF_TARGET[SELF_TARGETS] = True
+
+STAGES = (
+    (Move.BOOST_ATK, Sec.BOOST_ATK, Pok.ATTACK_STAT_STAGE),
+    (Move.BOOST_DEF, Sec.BOOST_DEF, Pok.DEFENSE_STAT_STAGE),
+    (Move.BOOST_SPATK, Sec.BOOST_SPATK, Pok.SPECIAL_ATTACK_STAT_STAGE),
+    (Move.BOOST_SPDEF, Sec.BOOST_SPDEF, Pok.SPECIAL_DEFENSE_STAT_STAGE),
+    (Move.BOOST_SPEED, Sec.BOOST_SPEED, Pok.SPEED_STAT_STAGE),
+    (Move.BOOST_ACC, Sec.BOOST_ACC, Pok.ACCURACY_STAT_STAGE),
+    (Move.BOOST_EV, Sec.BOOST_EV, Pok.EVASION_STAT_STAGE),
+)
+
+HP_COLS = np.arange(12) * POK_LEN + Pok.CURRENT_HP
+
+
+def stage_multiplier(stages, acc=False):
+    """Vectorized stage_to_multiplier"""
+    mult = 3 if acc else 2
+    stages = np.asarray(stages, dtype=np.float64)
+    return np.where(stages >= 0, (mult + stages) / mult, mult / (mult - np.minimum(stages, 0)))
+
+
+def type_effectiveness(atk_type, def_type1, def_type2):
+    """Vectorized get_type_effectiveness"""
+    atk = atk_type.astype(np.intp)
+    eff = TYPE_CHART_ARRAY[atk, def_type1.astype(np.intp)].astype(np.float64)
+    eff2 = np.where(def_type2 != 0, TYPE_CHART_ARRAY[atk, def_type2.astype(np.intp)], 1)
+    return eff, eff2
+
+
+def ability_multiplier(batch, rows, att, mv):
+    """Vectorized damaging_ability, the power multiplier of on damage abilities"""
+    ability = batch[rows, att + Pok.AB_ID]
+    move_type = batch[rows, mv + Move.TYPE]
+    on_damage = batch[rows, att + Pok.AB_WHEN] == AbilityActivation.ON_DAMAGE
+    max_hp = batch[rows, att + Pok.MAX_HP]
+    pinch = batch[rows, att + Pok.CURRENT_HP] / np.where(max_hp > 0, max_hp, 1) <= 1 / 3
+    starter = (
+        ((ability == AbilityNames.BLAZE) & (move_type == Types.FIRE))
+        | ((ability == AbilityNames.TORRENT) & (move_type == Types.WATER))
+        | ((ability == AbilityNames.OVERGROW) & (move_type == Types.GRASS))
+    )
+    iron_fist = (ability == AbilityNames.IRON_FIST) & (batch[rows, mv + Flags.PUNCH] != 0)
+    mult = np.where(pinch & starter, 1.5, np.where(iron_fist, 1.199951172, 1))
+    return np.where(on_damage, mult, 1)
+
+
+def batch_damage(batch, rows, att, dfn, mv, crit, roll):
+    """Vectorized calculate_damage, every argument is per row, att/dfn/mv are column offsets
+    of the attacker, defender and move blocks.
+    Returns:
+        damage and effectiveness arrays"""
+    category = batch[rows, mv + Move.CATEGORY]
+    phys = category == MoveCategory.PHYSICAL
+    raw_attack = np.where(phys, batch[rows, att + Pok.ATTACK], batch[rows, att + Pok.SPECIAL_ATTACK])
+    raw_defense = np.where(phys, batch[rows, dfn + Pok.DEFENSE], batch[rows, dfn + Pok.SPECIAL_DEFENSE])
+    atk_stage = np.where(
+        phys, batch[rows, att + Pok.ATTACK_STAT_STAGE], batch[rows, att + Pok.SPECIAL_ATTACK_STAT_STAGE]
+    )
+    def_stage = np.where(
+        phys, batch[rows, dfn + Pok.DEFENSE_STAT_STAGE], batch[rows, dfn + Pok.SPECIAL_DEFENSE_STAT_STAGE]
+    )
+    atk_stage = np.where(crit, np.maximum(atk_stage, 0), atk_stage)
+    def_stage = np.where(crit, np.minimum(def_stage, 0), def_stage)
+
+    attack = np.floor(raw_attack * stage_multiplier(atk_stage))
+    defense = np.floor(raw_defense * stage_multiplier(def_stage))
+    # Empty slots have 0 defense, keep them from dividing by zero, they are masked below
+    defense = np.where(defense > 0, defense, 1)
+
+    power = batch[rows, mv + Move.POWER] * ability_multiplier(batch, rows, att, mv)
+    damage = np.floor((((2 * batch[rows, att + Pok.LEVEL] / 5) + 2) * power * (attack / defense)) / 50)
+
+    # Burn
+    damage = np.where(phys & (batch[rows, att + Pok.STATUS] == Status.BURN), np.floor(0.5 * damage), damage)
+    damage += 2
+    # Crit
+    damage = np.where(crit, damage * 2, damage)
+    # Roll
+    damage = np.floor(roll * damage)
+    # STAB
+    move_type = batch[rows, mv + Move.TYPE]
+    stab = (move_type == batch[rows, att + Pok.TYPE1]) | (move_type == batch[rows, att + Pok.TYPE2])
+    damage = np.where(stab, np.floor(1.5 * damage), damage)
+    # Effectiveness
+    eff, eff2 = type_effectiveness(move_type, batch[rows, dfn + Pok.TYPE1], batch[rows, dfn + Pok.TYPE2])
+    damage = np.where(eff != 1, np.floor(eff * damage), damage)
+    damage = np.where(eff2 != 1, np.floor(eff2 * damage), damage)
+
+    damaging = (category == MoveCategory.PHYSICAL) | (category == MoveCategory.SPECIAL)
+    return np.where(damaging, damage, 0), np.where(damaging, eff * eff2, 0)
+
+
+class DamageTables():
+    """
+    Every DamageMatrix table between the two parties of a battle (my slot on an opponent slot and the other way
+    around) flattened in one array, so the damage of any (row, attacker, move, defender, crit, roll) is one gather.
+    Built from the static data of one battle array, so every row of a batch using it has to be that battle.
+    Slots without a Pokemon and status moves point at a block of zeros, like batch_damage gives them
+    """
+    def __init__(self, dmg_matrix, battle_array):
+        values = [np.zeros(13 * 13 * 2 * 16, dtype=np.float32)]  # Zeros, shaped like a block without burn or pinch
+        size = len(values[0])
+        n_blocks = 12 * 4 * 6
+        self.offset = np.zeros(n_blocks, dtype=np.intp)
+        self.burn = np.ones(n_blocks, dtype=np.intp)  # Length of the burn axis, 1 or 2
+        self.pinch = np.ones(n_blocks, dtype=np.intp)  # Length of the pinch axis, 1 or 2
+        self.atk_field = np.full(n_blocks, Pok.ATTACK_STAT_STAGE, dtype=np.intp)
+        self.def_field = np.full(n_blocks, Pok.DEFENSE_STAT_STAGE, dtype=np.intp)
+        for att_slot in range(12):
+            attacker = battle_array[att_slot * POK_LEN:(att_slot + 1) * POK_LEN]
+            for def_slot in range(6, 12) if att_slot < 6 else range(6):
+                defender = battle_array[def_slot * POK_LEN:(def_slot + 1) * POK_LEN]
+                if not attacker[Pok.ID] or not defender[Pok.ID]:
+                    continue
+                for move_idx in range(4):
+                    table, _, atk_field, def_field, has_burn, has_pinch = dmg_matrix.block(
+                        att_slot, move_idx, def_slot, attacker, defender
+                    )
+                    if table is None:
+                        continue
+                    blk = self.block_index(att_slot, move_idx, def_slot)
+                    self.offset[blk] = size
+                    self.burn[blk] = 2 if has_burn else 1
+                    self.pinch[blk] = 2 if has_pinch else 1
+                    self.atk_field[blk] = atk_field
+                    self.def_field[blk] = def_field
+                    values.append(table.ravel())
+                    size += table.size
+        self.values = np.concatenate(values)
+
+    @staticmethod
+    def block_index(att_slot, move_idx, def_slot):
+        """Index of the (attacker slot, move, defender slot) table, works on arrays"""
+        return (att_slot * 4 + move_idx) * 6 + def_slot % 6
+
+    def index(self, batch, rows, att_slot, move_idx, def_slot, crit):
+        """
+        Flat index of roll 0 of every lookup (the 16 rolls follow it) and where it's inside the table, every
+        argument being per lookup. The stages aren't clamped by the engine, out of the table falls back to
+        batch_damage
+        """
+        blk = self.block_index(att_slot, move_idx, def_slot)
+        att = att_slot * POK_LEN
+        atk_stage = batch[rows, att + self.atk_field[blk]].astype(np.intp)
+        def_stage = batch[rows, def_slot * POK_LEN + self.def_field[blk]].astype(np.intp)
+        inside = (np.abs(atk_stage) <= 6) & (np.abs(def_stage) <= 6)
+        burn = (self.burn[blk] == 2) & (batch[rows, att + Pok.STATUS] == Status.BURN)
+        max_hp = batch[rows, att + Pok.MAX_HP]
+        pinch = (self.pinch[blk] == 2) & (batch[rows, att + Pok.CURRENT_HP] / np.where(max_hp > 0, max_hp, 1) <= 1 / 3)
+        cell = ((np.clip(atk_stage, -6, 6) + 6) * 13 + np.clip(def_stage, -6, 6) + 6) * 2 + crit
+        cell = (cell * self.burn[blk] + burn) * self.pinch[blk] + pinch
+        return self.offset[blk] + cell * 16, inside
+
+    def damage(self, batch, rows, att_slot, move_idx, def_slot, crit=False, roll=15):
+        """Same numbers as batch_damage (roll being the index of DAMAGE_ROLLS, 15 is 1.0), every argument per row"""
+        start, inside = self.index(batch, rows, att_slot, move_idx, def_slot, crit)
+        damage = self.values[start + roll].astype(np.float64)
+        if not inside.all():
+            out = ~inside
+            att = (att_slot * POK_LEN)[out]
+            damage[out], _ = batch_damage(
+                batch, rows[out], att, (def_slot * POK_LEN)[out], att + OFFSET_MOVE + move_idx[out] * MOVE_STRIDE,
+                np.broadcast_to(crit, out.shape)[out], (np.broadcast_to(roll, out.shape)[out] + 85) / 100
+            )
+        return damage
+
+    def rolls(self, batch, rows, att_slot, move_idx, def_slot):
+        """(lookups, 16) no crit damage of every roll, in DAMAGE_ROLLS order"""
+        start, inside = self.index(batch, rows, att_slot, move_idx, def_slot, 0)
+        damage = self.values[start[:, None] + np.arange(16)].astype(np.float64)
+        if not inside.all():
+            out = ~inside
+            for roll in range(16):
+                damage[out, roll] = self.damage(
+                    batch, rows[out], att_slot[out], move_idx[out], def_slot[out], False, roll
+                )
+        return damage
+
+
+# Damage tables of each battle, dropped with its damage matrix
+_TABLES = PerBattle(DamageTables)
+
+
+def damage_tables(dmg_matrix, battle_array) -> DamageTables:
+    """DamageTables of the battle of dmg_matrix, built once"""
+    return _TABLES.get(dmg_matrix, dmg_matrix, battle_array)
+
+
+class BatchBattle():
+    """
+    Same flow as Battle.turn_sim, but for every row of the batch at once.
+    tables are the DamageTables of the battle when every row is that battle (see damage_tables), the damage numbers
+    are then gathered from them instead of computed
+    """
+    def __init__(self, batch, rng=None, tables=None):
+        self.batch = batch
+        self.n = batch.shape[0]
+        self.rows = np.arange(self.n)
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.tables = tables
+
+    def damage(self, rows, att_slot, move_idx, def_slot, crit=False, roll=15):
+        """Damage per lookup (batch_damage), slots and move per lookup and roll the index of DAMAGE_ROLLS"""
+        if self.tables is not None:
+            return self.tables.damage(self.batch, rows, att_slot, move_idx, def_slot, crit, roll)
+        att = att_slot * POK_LEN
+        damage, _ = batch_damage(
+            self.batch, rows, att, def_slot * POK_LEN, att + OFFSET_MOVE + move_idx * MOVE_STRIDE, crit,
+            (np.asarray(roll) + 85) / 100
+        )
+        return damage
+
+    def my_active(self):
+        """Index 0..5 of my active pokemon per row"""
+        return self.batch[:, Field.MY_POK].astype(np.intp)
+
+    def opp_active(self):
+        """Index 0..5 of the opponent active pokemon per row"""
+        return self.batch[:, Field.OPP_POK].astype(np.intp)
+
+    def alive(self):
+        """(N, 12) boolean of which pokemon are still standing"""
+        return self.batch[:, HP_COLS] > 0
+
+    def is_terminal(self):
+        """Rows where one side has no pokemon left"""
+        alive = self.alive()
+        return ~alive[:, :6].any(axis=1) | ~alive[:, 6:].any(axis=1)
+
+    def legal_mask(self, opponent=False):
+        """(N, N_ACTIONS) boolean mask with the same rules as Models.helper.legal_mask"""
+        offset = 6 if opponent else 0
+        active = self.opp_active() if opponent else self.my_active()
+        base = (active + offset) * POK_LEN
+        mask = np.zeros((self.n, N_ACTIONS), dtype=bool)
+        for i in range(4):
+            mask[:, i] = self.batch[self.rows, base + OFFSET_MOVE + i * MOVE_STRIDE] != 0
+        mask[:, SWITCH_OFFSET:] = self.alive()[:, offset:offset + 6]
+        mask[self.rows, SWITCH_OFFSET + active] = False
+        death = self.batch[:, Field.PHASE] == BattlePhase.DEATH_END_OF_TURN
+        mask[death, :SWITCH_OFFSET] = False
+        return mask
+
+    def random_actions(self, mask):
+        """Pick one legal action uniformly per row, -1 if the row has none"""
+        count = mask.sum(axis=1)
+        k = np.floor(self.rng.random(self.n) * count)
+        pick = np.argmax(mask.cumsum(axis=1) > k[:, None], axis=1)
+        return np.where(count > 0, pick, -1)
+
+    def damage_rolls(self, rows, att_slot, move_idx, def_slot):
+        """(lookups, 16) no crit damage of every roll (DAMAGE_ROLLS order), arguments per lookup"""
+        if self.tables is not None:
+            return self.tables.rolls(self.batch, rows, att_slot, move_idx, def_slot)
+        return np.stack([self.damage(rows, att_slot, move_idx, def_slot, False, roll) for roll in range(16)], axis=1)
+
+    def pref_actions(self, rows, mask, opp_moves):
+        """
+        Vectorized rollout_pref (SearchEngine.mcts_eval) for the given rows, mask being their legal actions and
+        opp_moves the move the opponent picked: a move that knocks the opponent out before it can answer gets +100
+        (times its chance over the rolls), a move with a secondary effect +10, and a switch +50 times the chance
+        the faster opponent knocks my active out
+        """
+        b = self.batch
+        k = len(rows)
+        my_slot = b[rows, Field.MY_POK].astype(np.intp)
+        opp_slot = b[rows, Field.OPP_POK].astype(np.intp) + 6
+        my_base = my_slot * POK_LEN
+        opp_base = opp_slot * POK_LEN
+        o_rolls = self.damage_rolls(rows, opp_slot, opp_moves, my_slot)
+        o_ko = (o_rolls >= b[rows, my_base + Pok.CURRENT_HP][:, None]).mean(axis=1)
+        rolls = self.damage_rolls(
+            np.repeat(rows, 4), np.repeat(my_slot, 4), np.tile(np.arange(4), k), np.repeat(opp_slot, 4)
+        ).reshape(k, 4, 16)
+        ko = (rolls >= b[rows, opp_base + Pok.CURRENT_HP][:, None, None]).mean(axis=2)
+
+        my_speed = b[rows, my_base + Pok.SPEED]
+        opp_speed = b[rows, opp_base + Pok.SPEED]
+        moves = my_base[:, None] + OFFSET_MOVE + np.arange(4) * MOVE_STRIDE
+        exists = b[rows[:, None], moves + Move.ID] != 0
+        weights = np.ones((k, N_ACTIONS))
+        weights[:, :4] += exists * 100 * ko * np.where(my_speed > opp_speed, 1, 1 - o_ko)[:, None]
+        weights[:, :4] += exists * 10 * (b[rows[:, None], moves + Sec.CHANCE] != 0)
+        weights[:, SWITCH_OFFSET:] += (50 * o_ko * (opp_speed >= my_speed))[:, None]
+
+        cumulative = np.cumsum(weights * mask, axis=1)
+        pick = self.rng.random(k) * cumulative[:, -1]
+        return np.argmax(cumulative > pick[:, None], axis=1)
+
+    def move_damages(self, att_slot, def_slot, roll=15):
+        """(N, 4) no crit damage of every move of att_slot on def_slot (per row), roll 15 (1.0) by default"""
+        lookups = np.repeat(self.rows, 4)
+        damage = self.damage(
+            lookups, np.repeat(att_slot, 4), np.tile(np.arange(4), self.n), np.repeat(def_slot, 4), False,
+            np.repeat(np.broadcast_to(roll, self.n), 4)
+        )
+        return damage.reshape(self.n, 4)
+
+    def greedy_opp_actions(self):
+        """The parts of the TrainerAI scoring that decide most turns, vectorized.
+        A move that kills gets +4 (+6 with priority), damaging moves that don't reach the max
+        damage get -1 and moves lowering the user stats get the expert flag penalties,
+        ties are broken at random."""
+        b = self.batch
+        rows = self.rows[:, None]
+        my_base = self.my_active() * POK_LEN
+        opp_slot = self.opp_active() + 6
+        opp_base = opp_slot * POK_LEN
+        roll = self.rng.integers(85, 101, self.n) - 85
+        dmg = self.move_damages(opp_slot, my_base // POK_LEN, roll)
+        moves = OFFSET_MOVE + opp_base[:, None] + np.arange(4) * MOVE_STRIDE
+        exists = b[rows, moves + Move.ID] != 0
+        category = b[rows, moves + Move.CATEGORY]
+        damaging = (category == MoveCategory.PHYSICAL) | (category == MoveCategory.SPECIAL)
+
+        # evaluate_attack_flag and the max damage penalty of choose_move
+        kill = dmg >= b[self.rows, my_base + Pok.CURRENT_HP][:, None]
+        priority = b[rows, moves + Move.PRIORITY] >= 1
+        score = np.where(kill & damaging, np.where(priority, 6, 4), 0).astype(np.float64)
+        max_dmg = np.where(exists, dmg, 0).max(axis=1, keepdims=True)
+        score -= damaging & (dmg < max_dmg) & ~kill
+
+        # expert_flag, stat lowering moves
+        hp_ai = np.floor(b[self.rows, opp_base + Pok.CURRENT_HP] / b[self.rows, opp_base + Pok.MAX_HP] * 100)[:, None]
+        hp_u = np.floor(b[self.rows, my_base + Pok.CURRENT_HP] / b[self.rows, my_base + Pok.MAX_HP] * 100)[:, None]
+        lowers = (category == MoveCategory.STATUS) & IS_FOE_TARGET[b[rows, moves + Move.TARGET].astype(np.intp)]
+        atk = b[rows, moves + Move.BOOST_ATK]
+        spatk = b[rows, moves + Move.BOOST_SPATK]
+        lowers_atk = lowers & ((atk != 0) | (spatk != 0))
+        u_atk = b[self.rows, my_base + Pok.ATTACK_STAT_STAGE][:, None]
+        u_spatk = b[self.rows, my_base + Pok.SPECIAL_ATTACK_STAT_STAGE][:, None]
+        score -= lowers_atk & (((atk < 0) & (u_atk != 0)) | ((spatk != 0) & (u_spatk != 0)))
+        score -= lowers_atk & (hp_ai <= 90)
+        score -= 2 * (lowers_atk & (hp_u <= 70))
+        adjust = self.rng.integers(0, 256, (self.n, 4)) < 206
+        score -= 2 * (lowers_atk & adjust & (((atk != 0) & (u_atk <= -3)) | ((spatk != 0) & (u_spatk <= -3))))
+        lowers_def = lowers & ~lowers_atk & (
+            (b[rows, moves + Move.BOOST_DEF] != 0) | (b[rows, moves + Move.BOOST_SPDEF] != 0)
+        )
+        adjust = self.rng.integers(0, 256, (self.n, 4)) < 206
+        score -= 2 * (lowers_def & adjust & (hp_ai < 70))
+        score -= 2 * (lowers_def & (hp_u < 70))
+
+        # Random tie break
+        score += self.rng.random((self.n, 4)) * 0.5
+        score[~exists] = -np.inf
+        return np.argmax(score, axis=1)
+
+    def sub_after_death(self, rows):
+        """Vectorized TrainerAI.sub_after_death for the given rows,
+        returns the opponent party index to send out"""
+        batch = self.batch
+        n = len(rows)
+        r = rows[:, None]
+        my_slot = batch[rows, Field.MY_POK].astype(np.intp)
+        my_base = (my_slot * POK_LEN)[:, None]
+        u_t1 = batch[r, my_base + Pok.TYPE1]
+        u_t2 = batch[r, my_base + Pok.TYPE2]
+        alive = batch[r, HP_COLS[6:]] > 0
+
+        # Phase 1, (rows, 6) of the candidates with a super effective move and their type score
+        base = (6 + np.arange(6)) * POK_LEN
+        mv_type = batch[r[:, :, None], (base[:, None] + OFFSET_MOVE + np.arange(4) * MOVE_STRIDE)[None] + Move.TYPE]
+        eff, eff2 = type_effectiveness(mv_type, u_t1[:, :, None], u_t2[:, :, None])
+        has_se = ((mv_type != 0) & (eff * eff2 > 1)).any(axis=2)
+        t1 = batch[r, base + Pok.TYPE1]
+        t2 = np.where(batch[r, base + Pok.TYPE2] != 0, batch[r, base + Pok.TYPE2], t1)
+        eff, eff2 = type_effectiveness(t1, u_t1, u_t2)
+        total = eff * eff2
+        eff, eff2 = type_effectiveness(t2, u_t1, u_t2)
+        total += eff * eff2
+        type_score = np.where(total == 8, 1.75, total)
+
+        # Phase 2, the max damage of each candidate over the 24 candidate/move pairs at once
+        pairs = np.arange(24)
+        dmg = self.damage(
+            np.repeat(rows, 24), np.tile(6 + pairs // 4, n), np.tile(pairs % 4, n), np.repeat(my_slot, 24)
+        ).reshape(n, 6, 4)
+        dmg = np.where(dmg > 255, dmg - 255, dmg)
+        max_dmg = dmg.max(axis=2)
+
+        phase1 = alive & has_se
+        use_phase1 = phase1.any(axis=1)
+        # argmax returns the first max, which is the lower party index tie break
+        pick1 = np.argmax(np.where(phase1, type_score, -np.inf), axis=1)
+        pick2 = np.argmax(np.where(alive, max_dmg, -np.inf), axis=1)
+        return np.where(use_phase1, pick1, pick2)
+
+    def _reset_switch_out(self, rows, base):
+        """Vectorized reset_switch_out"""
+        for stage in range(Pok.ATTACK_STAT_STAGE, Pok.EVASION_STAT_STAGE + 1):
+            self.batch[rows, base + stage] = 0
+        self.batch[rows, base + Pok.VOL_STATUS] = 0
+        self.batch[rows, base + Pok.TURNS] = 0
+        self.batch[rows, base + Pok.BADLY_POISON] = 1
+
+    def _apply_status(self, rows, dfn, status):
+        """Vectorized apply_status"""
+        if not len(rows):
+            return
+        b = self.batch
+        current = b[rows, dfn + Pok.STATUS]
+        sleep = status == Status.SLEEP
+        put = np.where(sleep, current != Status.SLEEP, current == 0)
+        rows, dfn, status, sleep = rows[put], dfn[put], status[put], sleep[put]
+        b[rows, dfn + Pok.STATUS] = status
+        toxic = status == Status.TOXIC
+        b[rows[toxic], dfn[toxic] + Pok.BADLY_POISON] = 1
+        b[rows[sleep], dfn[sleep] + Pok.SLEEP_COUNTER] = self.rng.integers(1, 5, sleep.sum())
+
+    def _boost(self, rows, pok, mv, sec=False):
+        """Add the stage boosts of the move (or of its secondary effect) to pok"""
+        if not len(rows):
+            return
+        b = self.batch
+        for move_col, sec_col, stage in STAGES:
+            b[rows, pok + stage] += b[rows, mv + (sec_col if sec else move_col)]
+
+    def _use_move(self, acting, att, dfn, mv, flinched):
+        """One attacker of every row uses its move, the same checks as Battle.action(search=True).
+        Returns:
+            rows where the move made the target flinch"""
+        b = self.batch
+        n = self.n
+        rows = self.rows
+        rng = self.rng
+        go = acting & (b[rows, att + Pok.CURRENT_HP] > 0)
+
+        # Sleep
+        status = b[rows, att + Pok.STATUS]
+        asleep = go & (status == Status.SLEEP)
+        still_asleep = asleep & (b[rows, att + Pok.SLEEP_COUNTER] > 0)
+        b[rows[still_asleep], att[still_asleep] + Pok.SLEEP_COUNTER] -= 1
+        woke = asleep & ~still_asleep
+        b[rows[woke], att[woke] + Pok.STATUS] = 0
+        go &= ~still_asleep
+
+        # Paralysis
+        para = go & (b[rows, att + Pok.STATUS] == Status.PARALYSIS) & (rng.integers(1, 5, n) <= 1)
+        go &= ~para
+
+        # Freeze
+        frozen = go & (b[rows, att + Pok.STATUS] == Status.FREEZE)
+        thawed = frozen & (rng.integers(1, 6, n) <= 1)
+        b[rows[thawed], att[thawed] + Pok.STATUS] = 0
+        go &= ~(frozen & ~thawed)
+
+        # Flinch
+        go &= ~flinched
+
+        # Confusion
+        confused = go & ((b[rows, att + Pok.VOL_STATUS].astype(np.int64) & VolStatus.CONFUSION) != 0)
+        go &= ~(confused & (rng.integers(1, 3, n) == 1))
+
+        # Target already fainted
+        go &= b[rows, dfn + Pok.CURRENT_HP] > 0
+
+        # Hit or miss
+        move_type = b[rows, mv + Move.TYPE]
+        eff, eff2 = type_effectiveness(move_type, b[rows, dfn + Pok.TYPE1], b[rows, dfn + Pok.TYPE2])
+        accuracy = b[rows, mv + Move.ACCURACY]
+        acc_stage = b[rows, att + Pok.ACCURACY_STAT_STAGE] - b[rows, dfn + Pok.EVASION_STAT_STAGE]
+        hit_roll = rng.integers(1, 101, n)
+        hit = (accuracy == -1) | (hit_roll <= accuracy * stage_multiplier(acc_stage, acc=True))
+        hit = go & (eff * eff2 != 0) & hit
+
+        category = b[rows, mv + Move.CATEGORY]
+        damaging = hit & ((category == MoveCategory.PHYSICAL) | (category == MoveCategory.SPECIAL))
+        status_move = hit & (category == MoveCategory.STATUS)
+
+        # Physical and special moves
+        crit = rng.integers(1, 17, n) == 1
+        roll = rng.integers(85, 101, n) - 85
+        damage = self.damage(rows, att // POK_LEN, (mv - att - OFFSET_MOVE) // MOVE_STRIDE, dfn // POK_LEN, crit, roll)
+        hp = b[rows, dfn + Pok.CURRENT_HP]
+        r = rows[damaging]
+        b[r, dfn[damaging] + Pok.CURRENT_HP] = np.maximum(hp[damaging] - damage[damaging], 0)
+
+        # Secondary effects
+        chance = b[rows, mv + Sec.CHANCE]
+        sec_roll = np.where(chance < 100, rng.integers(1, 101, n), 0)
+        sec = damaging & (chance != 0) & (sec_roll <= chance)
+        target = b[rows, mv + Move.TARGET]
+        foe = IS_FOE_TARGET[target.astype(np.intp)]
+        own = IS_SELF_TARGET[target.astype(np.intp)]
+        sec_status = sec & foe & (b[rows, mv + Sec.STATUS] != 0)
+        self._apply_status(rows[sec_status], dfn[sec_status], b[rows[sec_status], mv[sec_status] + Sec.STATUS])
+        sec_boost = sec & own
+        self._boost(rows[sec_boost], att[sec_boost], mv[sec_boost], sec=True)
+        drain = sec_boost & (b[rows, mv + Move.DRAIN] != 0)
+        if drain.any():
+            d = rows[drain]
+            a = att[drain]
+            drain_hp = np.maximum(np.floor(damage[drain] * b[d, mv[drain] + Move.DRAIN]), 1)
+            drain_hp = np.minimum(drain_hp, b[d, a + Pok.MAX_HP] - b[d, a + Pok.CURRENT_HP])
+            b[d, a + Pok.CURRENT_HP] += np.maximum(drain_hp, 0)
+
+        # Flinch
+        flinch_roll = rng.integers(1, 101, n)
+        flinch = damaging & (
+            (b[rows, mv + Sec.VOL_STATUS].astype(np.int64) & VolStatus.FLINCH) != 0
+        ) & (flinch_roll <= chance)
+
+        # Thaw, a fire move used while the attacker is frozen thaws the target
+        thaw = damaging & (b[rows, att + Pok.STATUS] == Status.FREEZE) & (move_type == Types.FIRE)
+        b[rows[thaw], dfn[thaw] + Pok.STATUS] = 0
+
+        # Status moves
+        boost_self = status_move & own
+        self._boost(rows[boost_self], att[boost_self], mv[boost_self])
+        boost_foe = status_move & foe
+        self._boost(rows[boost_foe], dfn[boost_foe], mv[boost_foe])
+        inflict = boost_foe & (b[rows, mv + Move.STATUS] != 0)
+        self._apply_status(rows[inflict], dfn[inflict], b[rows[inflict], mv[inflict] + Move.STATUS])
+
+        return flinch
+
+    def _after_turn_status(self, rows, pok):
+        """Vectorized after_turn_status, burn and poison damage"""
+        b = self.batch
+        status = b[rows, pok + Pok.STATUS]
+        hurt = (b[rows, pok + Pok.CURRENT_HP] >= 0) & ((status == Status.BURN) | (status == Status.POISON))
+        rows, pok = rows[hurt], pok[hurt]
+        badly = b[rows, pok + Pok.BADLY_POISON]
+        max_hp = b[rows, pok + Pok.MAX_HP]
+        dmg = np.where(badly >= 1, np.floor(max_hp * badly * (1 / 16)), np.floor(max_hp / 8))
+        b[rows[badly >= 1], pok[badly >= 1] + Pok.BADLY_POISON] += 1
+        b[rows, pok + Pok.CURRENT_HP] = np.maximum(b[rows, pok + Pok.CURRENT_HP] - dmg, 0)
+
+    def _next_turn(self, rows):
+        """Turn counters, the same as the end of Battle.turn_sim"""
+        b = self.batch
+        b[rows, Field.TURN] += 1
+        b[rows, (b[rows, Field.OPP_POK].astype(np.intp) + 6) * POK_LEN + Pok.TURNS] += 1
+        b[rows, b[rows, Field.MY_POK].astype(np.intp) * POK_LEN + Pok.TURNS] += 1
+
+    def turn(self, my_actions, opp_actions, live=None):
+        """Resolve one turn for every row where live is True.
+        Rows in the death phase only take my switch, like GameState.step"""
+        b = self.batch
+        rows = self.rows
+        live = ~self.is_terminal() if live is None else live
+        live = live & (my_actions >= 0)
+
+        # Death phase, only my replacement comes in
+        death = live & (b[:, Field.PHASE] == BattlePhase.DEATH_END_OF_TURN)
+        if death.any():
+            d = rows[death]
+            b[d, Field.MY_POK] = my_actions[death] - SWITCH_OFFSET
+            self._next_turn(d)
+            b[d, Field.PHASE] = BattlePhase.TURN_START
+        live &= ~death
+
+        # Switches happen before any move
+        my_switch = live & (my_actions >= SWITCH_OFFSET)
+        opp_switch = live & (opp_actions >= SWITCH_OFFSET)
+        for switch, field, offset, actions in (
+            (my_switch, Field.MY_POK, 0, my_actions),
+            (opp_switch, Field.OPP_POK, 6, opp_actions)
+        ):
+            if switch.any():
+                s = rows[switch]
+                self._reset_switch_out(s, (b[s, field].astype(np.intp) + offset) * POK_LEN)
+                b[s, field] = actions[switch] - SWITCH_OFFSET
+
+        # Move order
+        my_base = self.my_active() * POK_LEN
+        opp_base = (self.opp_active() + 6) * POK_LEN
+        my_mv = my_base + OFFSET_MOVE + np.clip(my_actions, 0, 3) * MOVE_STRIDE
+        opp_mv = opp_base + OFFSET_MOVE + np.clip(opp_actions, 0, 3) * MOVE_STRIDE
+
+        my_speed = b[rows, my_base + Pok.SPEED] * stage_multiplier(b[rows, my_base + Pok.SPEED_STAT_STAGE])
+        my_speed *= np.where(b[rows, my_base + Pok.STATUS] == Status.PARALYSIS, 0.25, 1)
+        opp_speed = b[rows, opp_base + Pok.SPEED] * stage_multiplier(b[rows, opp_base + Pok.SPEED_STAT_STAGE])
+        opp_speed *= np.where(b[rows, opp_base + Pok.STATUS] == Status.PARALYSIS, 0.25, 1)
+        my_pri = b[rows, my_mv + Move.PRIORITY]
+        opp_pri = b[rows, opp_mv + Move.PRIORITY]
+        tie = self.rng.integers(1, 3, self.n) == 1
+        by_speed = np.where(my_speed == opp_speed, tie, my_speed > opp_speed)
+        by_priority = ((my_pri != 0) | (opp_pri != 0)) & (my_pri != opp_pri)
+        me_first = np.where(by_priority, my_pri > opp_pri, by_speed)
+
+        my_acts = live & ~my_switch
+        opp_acts = live & ~opp_switch
+        first_acts = np.where(me_first, my_acts, opp_acts)
+        second_acts = np.where(me_first, opp_acts, my_acts)
+        first_att = np.where(me_first, my_base, opp_base)
+        first_mv = np.where(me_first, my_mv, opp_mv)
+        second_att = np.where(me_first, opp_base, my_base)
+        second_mv = np.where(me_first, opp_mv, my_mv)
+
+        flinch = self._use_move(first_acts, first_att, second_att, first_mv, np.zeros(self.n, dtype=bool))
+        # Flinch only counts when both used a move
+        self._use_move(second_acts, second_att, first_att, second_mv, flinch & first_acts)
+
+        # End of turn
+        l = rows[live]
+        self._after_turn_status(l, my_base[live])
+        self._after_turn_status(l, opp_base[live])
+
+        opp_dead = live & (b[rows, opp_base + Pok.CURRENT_HP] <= 0) & self.alive()[:, 6:].any(axis=1)
+        if opp_dead.any():
+            b[rows[opp_dead], Field.OPP_POK] = self.sub_after_death(rows[opp_dead])
+        self._next_turn(l)
+
+        my_dead = live & (b[rows, my_base + Pok.CURRENT_HP] <= 0)
+        b[rows[my_dead], Field.PHASE] = BattlePhase.DEATH_END_OF_TURN
+
+    def run(self, max_depth=100, heuristic_prob=0.0):
+        """
+        Playouts against the greedy opponent until every row is over or max_depth. My side plays at random, or like
+        mixed_rollout with heuristic_prob: that share of the rows outside the death phase picks with pref_actions
+        """
+        for _ in range(max_depth):
+            live = ~self.is_terminal()
+            if not live.any():
+                break
+            mask = self.legal_mask()
+            my_actions = self.random_actions(mask)
+            opp_actions = self.greedy_opp_actions()
+            if heuristic_prob:
+                pref = live & (self.batch[:, Field.PHASE] != BattlePhase.DEATH_END_OF_TURN) & (
+                    self.rng.random(self.n) < heuristic_prob
+                )
+                pref &= mask.any(axis=1)
+                if pref.any():
+                    my_actions[pref] = self.pref_actions(self.rows[pref], mask[pref], opp_actions[pref])
+            self.turn(my_actions, opp_actions, live)
+        return self.batch
@@ -0,0 +1,134 @@
+"""Typed battle events, the engine emits them to a sink and the sink decides how (or if) they are shown.
+The search uses NULL_SINK so no text is ever built, the CLI uses ConsoleSink and a front end can
+collect them with ListSink and render them with render_event"""
+from types import SimpleNamespace
+from typing import NamedTuple
+from DataBase.PkDB import PokIdToName
+from DataBase.MoveDB import MoveIdToName
+
+
+Event = SimpleNamespace(
+    SEND_OUT = 0,
+    SWITCH_OUT = 1,
+    SWITCH_IN = 2,
+    MOVE_USED = 3,
+    FAILED = 4,
+    MISSED = 5,
+    NO_EFFECT = 6,
+    CRIT = 7,
+    DAMAGE = 8,
+    EFFECTIVENESS = 9,
+    FAINT = 10,
+    HP_LEFT = 11,
+    ASLEEP = 12,
+    WOKE_UP = 13,
+    FULLY_PARALYSED = 14,
+    FROZEN = 15,
+    THAWED = 16,
+    FLINCHED = 17,
+    WIN = 18,
+    LOSE = 19
+)
+
+# Side of the Pokemon the event is about
+MY_SIDE = 0
+OPP_SIDE = 1
+
+
+class BattleEvent(NamedTuple):
+    """One thing that happened in battle, ids are the raw ids of the battle array"""
+    kind: int
+    side: int = MY_SIDE
+    pok_id: int = 0
+    move_id: int = 0
+    target_id: int = 0
+    value: float = 0
+
+
+def _name(pok_id):
+    return PokIdToName[pok_id].capitalize()
+
+
+def render_event(event: BattleEvent) -> str:
+    """Text of an event, the same the CLI shows"""
+    kind = event.kind
+    name = _name(event.pok_id) if event.pok_id else ''
+    opp = event.side == OPP_SIDE
+    if kind == Event.SEND_OUT:
+        return f"The opponent sent out {name}!" if opp else f"You sent out {name}!"
+    if kind == Event.SWITCH_OUT:
+        return f"Opponent has switched {name} out." if opp else f"You switched {name} out."
+    if kind == Event.SWITCH_IN:
+        return f"Opponent has switched {name} in." if opp else f"You switched {name} in."
+    if kind == Event.MOVE_USED:
+        text = f"{'Opponent ' if opp else ''}{name} used {MoveIdToName[event.move_id].capitalize()}"
+        if event.target_id:
+            text += f" on {_name(event.target_id)}"
+        return text + "!"
+    if kind == Event.FAILED:
+        return "But it failed."
+    if kind == Event.MISSED:
+        return "But it missed."
+    if kind == Event.NO_EFFECT:
+        return "But it had no effect."
+    if kind == Event.CRIT:
+        return "\033[91mIt's a critical hit! \033[0m"
+    if kind == Event.DAMAGE:
+        return f"It dealt {int(event.value)} damage."
+    if kind == Event.EFFECTIVENESS:
+        if event.value >= 2:
+            return "\033[92mIt's super effective! \033[0m"
+        return "\033[94mIt's not very effective... \033[0m"
+    if kind == Event.FAINT:
+        return f"\033[91m{name} has fainted! \033[0m"
+    if kind == Event.HP_LEFT:
+        return f"{name} has {int(event.value)} HP left."
+    if kind == Event.ASLEEP:
+        return f"{name} is fast asleep!"
+    if kind == Event.WOKE_UP:
+        return f"{name} has woken up!"
+    if kind == Event.FULLY_PARALYSED:
+        return f"{name} is fully paralysed!"
+    if kind == Event.FROZEN:
+        return f"{name} is frozen solid!"
+    if kind == Event.THAWED:
+        return f"{name} has thawed out!"
+    if kind == Event.FLINCHED:
+        return f"{name} flinched and couldn't move!"
+    if kind == Event.WIN:
+        return "You Won!"
+    if kind == Event.LOSE:
+        return "You Lost!"
+    raise ValueError(f"Unknown battle event {kind}")
+
+
+class NullSink:
+    """Drops every event, the engine checks enabled so it doesn't even build them"""
+    enabled = False
+
+    def emit(self, event: BattleEvent):
+        """Nothing to do"""
+
+
+class ListSink:
+    """Keeps the events, so they can be rendered later (front end, tests)"""
+    enabled = True
+
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event: BattleEvent):
+        """Store the event"""
+        self.events.append(event)
+
+
+class ConsoleSink:
+    """Prints the events, for the interactive battle"""
+    enabled = True
+
+    def emit(self, event: BattleEvent):
+        """Print the event text"""
+        print(render_event(event))
+
+
+NULL_SINK = NullSink()
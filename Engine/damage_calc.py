@@ -1,14 +1,22 @@
 """Damage calculations"""
-import random
+import threading
 import numpy as np
 from Utils.helper import stage_to_multiplier, get_type_effectiveness
-from Models.idx_const import Pok, Move, Flags
+from Utils.rng import get_rng
+from Models.idx_const import Pok, Move, Flags, OFFSET_MOVE, MOVE_STRIDE
 from Models.helper import MoveCategory, Status, Types, AbilityActivation
 from Models.pokemon import Pokemon
 from Models.move import Move as Move_
 from DataBase.AbilitiesDB import AbilityNames
 
 
+# Every roll the game can pick, 85..100 / 100, all with the same chance
+DAMAGE_ROLLS = np.arange(85, 101) / 100
+CRIT_CHANCE = 1 / 16
+# Row 0 no crit, row 1 crit, broadcasts against DAMAGE_ROLLS into a (2, 16) table
+CRIT_AXIS = np.array([[False], [True]])
+
+
 def damaging_ability(attacker, defender, move) -> float:  # pylint: disable=W0613
     """Calculate what the ability does in relation to damage
     Returns:
@@ -41,7 +49,7 @@ def damaging_ability(attacker, defender, move) -> float:  # pylint: disable=W061
 
 
 def multipliers(
-        move: np.float32, attacker: np.float32, defender: np.float32, crit: bool, roll_mult: int, damage
+        move: np.float32, attacker: np.float32, defender: np.float32, crit: bool, roll_mult: int, damage, rng=None
 ):
     """Calc Multiplers for bas formula damage"""
 
@@ -64,6 +72,8 @@ def multipliers(
     # Crit
     if crit is True:
         damage *= 2
+    elif isinstance(crit, np.ndarray):
+        damage = np.where(crit, damage * 2, damage)
 
     # TODO: Item
 
@@ -71,7 +81,7 @@ def multipliers(
 
     # Roll Multiplier
     if roll_mult is None:
-        roll_mult = random.randint(85, 100) / 100
+        roll_mult = get_rng(rng).randint(85, 100) / 100
     damage = np.floor(roll_mult * damage)
 
     # STAB
@@ -102,7 +112,9 @@ def multipliers(
     return damage, effectiveness*effectiveness2
 
 
-def calculate_damage(attacker: Pokemon, defender: Pokemon, move: Move_, crit: bool=False, roll_multiplier: float=None):
+def calculate_damage(
+        attacker: Pokemon, defender: Pokemon, move: Move_, crit: bool=False, roll_multiplier: float=None, rng=None
+):
     """Calculate damage based on current stats of the attacker and the defender, giving back the damage and its effectiveness"""
     if move[Move.CATEGORY] == MoveCategory.STATUS or move[Move.CATEGORY] == 0:
         # Status moves don't deal damage(Trainer AI will fall here)
@@ -121,6 +133,9 @@ def calculate_damage(attacker: Pokemon, defender: Pokemon, move: Move_, crit: bo
     if crit is True:
         def_stage = min(def_stage, 0)
         atk_stage = max(atk_stage, 0)
+    elif isinstance(crit, np.ndarray):
+        def_stage = np.where(crit, min(def_stage, 0), def_stage)
+        atk_stage = np.where(crit, max(atk_stage, 0), atk_stage)
 
     # apply stage multipliers
     attack = np.floor(raw_attack * stage_to_multiplier(atk_stage))
@@ -132,12 +147,153 @@ def calculate_damage(attacker: Pokemon, defender: Pokemon, move: Move_, crit: bo
         power *= damaging_ability(attacker, defender, move)
 
     # Base damage formula
-    damage = np.floor((((2 * attacker[Pok.LEVEL] / 5) + 2) * move[Move.POWER] * (attack / defense)) / 50)
+    damage = np.floor((((2 * attacker[Pok.LEVEL] / 5) + 2) * power * (attack / defense)) / 50)
 
-    damage, effectiveness = multipliers(move, attacker, defender, crit, roll_multiplier, damage)
+    damage, effectiveness = multipliers(move, attacker, defender, crit, roll_multiplier, damage, rng)
     return damage, effectiveness
 
 
+def damage_distribution(attacker, defender, move):
+    """Every damage roll of the move, without and with crit, in one vectorized pass
+    Returns:
+        damage: (2, 16) array, row 0 no crit and row 1 crit, columns are DAMAGE_ROLLS\n
+        probability: (2, 16) array with the chance of each damage entry\n
+        effectiveness of the move"""
+    probability = np.outer([1 - CRIT_CHANCE, CRIT_CHANCE], np.full(len(DAMAGE_ROLLS), 1 / len(DAMAGE_ROLLS)))
+    damage, effectiveness = calculate_damage(attacker, defender, move, CRIT_AXIS, DAMAGE_ROLLS)
+    # Status moves give back a plain 0
+    damage = np.broadcast_to(damage, probability.shape)
+    return damage, probability, effectiveness
+
+
+def ko_chance(attacker, defender, move) -> float:
+    """Chance that one use of the move (if it hits) knocks the defender out"""
+    damage, probability, _ = damage_distribution(attacker, defender, move)
+    return float(probability[damage >= defender[Pok.CURRENT_HP]].sum())
+
+
+class DamageMatrix:
+    """Per battle cache of every damage number between the 12 party slots.
+
+    The static part (level, stats, types, moves, ability) never changes during a battle, so for each
+    (attacker slot, move slot, defender slot) a table indexed by
+    (atk stage, def stage, crit, burn, pinch, roll) is built on first use, with the same floor chain as
+    calculate_damage. Lookups then read the live stage, burn and HP of the Pokemon arrays.
+    Slots are 0..5 for my party and 6..11 for the opponent party.
+    """
+    STAGES = np.arange(-6, 7)
+
+    def __init__(self):
+        self._blocks = {}
+        self._lock = threading.Lock()  # The threads of threaded_mcts share it, a table is built by one of them
+
+    def block(self, att_slot, move_idx, def_slot, attacker, defender, move=None):
+        """Get (or build) the table of one attacker/move/defender, status moves give None"""
+        key = (att_slot, move_idx, def_slot)
+        block = self._blocks.get(key)
+        if block is None and key not in self._blocks:
+            with self._lock:
+                if key in self._blocks:
+                    return self._blocks[key]
+                if move is None:
+                    start = OFFSET_MOVE + move_idx * MOVE_STRIDE
+                    move = attacker[start:start + MOVE_STRIDE]
+                block = self._build(attacker, defender, move)
+                self._blocks[key] = block
+        return block
+
+    def _build(self, attacker, defender, move):
+        """Every damage number of the move, vectorized over the live modifiers"""
+        if move[Move.CATEGORY] not in (MoveCategory.PHYSICAL, MoveCategory.SPECIAL):
+            return (None, 0, 0, 0, False, False)
+        physical = move[Move.CATEGORY] == MoveCategory.PHYSICAL
+        if physical:
+            raw_attack, raw_defense = attacker[Pok.ATTACK], defender[Pok.DEFENSE]
+            atk_field, def_field = Pok.ATTACK_STAT_STAGE, Pok.DEFENSE_STAT_STAGE
+        else:
+            raw_attack, raw_defense = attacker[Pok.SPECIAL_ATTACK], defender[Pok.SPECIAL_DEFENSE]
+            atk_field, def_field = Pok.SPECIAL_ATTACK_STAT_STAGE, Pok.SPECIAL_DEFENSE_STAT_STAGE
+
+        # Axes: atk stage, def stage, crit, burn, pinch, roll
+        atk_stage = self.STAGES.reshape(13, 1, 1, 1, 1, 1)
+        def_stage = self.STAGES.reshape(1, 13, 1, 1, 1, 1)
+        crit = np.array([False, True]).reshape(1, 1, 2, 1, 1, 1)
+        atk_stage = np.where(crit, np.maximum(atk_stage, 0), atk_stage)
+        def_stage = np.where(crit, np.minimum(def_stage, 0), def_stage)
+        attack = np.floor(raw_attack * stage_to_multiplier(atk_stage))
+        defense = np.floor(raw_defense * stage_to_multiplier(def_stage))
+
+        # Ability power, with the HP dependent ones split in a pinch axis
+        power = [move[Move.POWER]]
+        if attacker[Pok.AB_WHEN] == AbilityActivation.ON_DAMAGE:
+            healthy = np.copy(attacker)
+            healthy[Pok.CURRENT_HP] = healthy[Pok.MAX_HP]
+            pinched = np.copy(attacker)
+            pinched[Pok.CURRENT_HP] = 1
+            power = [
+                move[Move.POWER] * damaging_ability(healthy, defender, move),
+                move[Move.POWER] * damaging_ability(pinched, defender, move)
+            ]
+            if power[0] == power[1]:
+                power = power[:1]
+        power = np.array(power).reshape(1, 1, 1, 1, len(power), 1)
+
+        damage = np.floor((((2 * attacker[Pok.LEVEL] / 5) + 2) * power * (attack / defense)) / 50)
+
+        # Burn only matters for physical moves, the rest of the chain is multipliers without it
+        if physical:
+            burn = np.array([False, True]).reshape(1, 1, 1, 2, 1, 1)
+            damage = np.where(burn, np.floor(0.5 * damage), damage)
+        not_burned = np.copy(attacker)
+        not_burned[Pok.STATUS] = 0
+        damage, effectiveness = multipliers(move, not_burned, defender, crit, DAMAGE_ROLLS, damage)
+        table = damage.astype(np.float32)
+        return (table, effectiveness, atk_field, def_field, table.shape[3] == 2, table.shape[4] == 2)
+
+    def damage(
+            self, att_slot, move_idx, def_slot, attacker, defender, crit=False, roll_multiplier=None, rng=None
+    ):
+        """Same contract as calculate_damage, giving back the damage and its effectiveness"""
+        table, effectiveness, atk_field, def_field, has_burn, has_pinch = self.block(
+            att_slot, move_idx, def_slot, attacker, defender
+        )
+        if table is None:
+            return 0, 0
+        atk_stage = attacker[atk_field]
+        def_stage = defender[def_field]
+        if roll_multiplier is None:
+            roll = get_rng(rng).randint(0, 15)
+        else:
+            roll = round(roll_multiplier * 100) - 85
+        if not (-6 <= atk_stage <= 6 and -6 <= def_stage <= 6 and 0 <= roll <= 15):
+            # Out of the table (stages aren't clamped by the engine), do it the slow way
+            start = OFFSET_MOVE + move_idx * MOVE_STRIDE
+            return calculate_damage(
+                attacker, defender, attacker[start:start + MOVE_STRIDE], crit, roll_multiplier, rng
+            )
+        burn = has_burn and attacker[Pok.STATUS] == Status.BURN
+        pinch = has_pinch and attacker[Pok.CURRENT_HP] / attacker[Pok.MAX_HP] <= 1 / 3
+        return float(table[int(atk_stage) + 6, int(def_stage) + 6, int(crit), int(burn), int(pinch), roll]), effectiveness
+
+
+    def rolls(self, att_slot, move_idx, def_slot, attacker, defender, crit=False) -> np.ndarray:
+        """Damage of every roll (DAMAGE_ROLLS order) of the move as damage would give it, zeros for status moves"""
+        table, _, atk_field, def_field, has_burn, has_pinch = self.block(
+            att_slot, move_idx, def_slot, attacker, defender
+        )
+        if table is None:
+            return np.zeros(len(DAMAGE_ROLLS))
+        atk_stage = attacker[atk_field]
+        def_stage = defender[def_field]
+        if not (-6 <= atk_stage <= 6 and -6 <= def_stage <= 6):
+            start = OFFSET_MOVE + move_idx * MOVE_STRIDE
+            damage, _ = calculate_damage(attacker, defender, attacker[start:start + MOVE_STRIDE], crit, DAMAGE_ROLLS)
+            return np.broadcast_to(damage, DAMAGE_ROLLS.shape)
+        burn = has_burn and attacker[Pok.STATUS] == Status.BURN
+        pinch = has_pinch and attacker[Pok.CURRENT_HP] / attacker[Pok.MAX_HP] <= 1 / 3
+        return table[int(atk_stage) + 6, int(def_stage) + 6, int(crit), int(burn), int(pinch)]
+
+
 def calculate_damage_confusion(pok):
     """Calculate the damage for Confusion self hit"""
     raw_attack = pok[Pok.ATTACK]
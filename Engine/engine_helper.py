@@ -1,12 +1,11 @@
 """Helpers that are only needed in the engine directory"""
-import random
 from enum import Enum, auto
 import numpy as np
 from Utils.helper import stage_to_multiplier, get_type_effectiveness
 from Engine.damage_calc import calculate_damage_confusion
 from Models.idx_const import Pok, POK_LEN, FIELD_LEN, Move, Sec
 from Models.helper import Status, VolStatus, Types
-from DataBase.PkDB import PokemonName
+from Utils.rng import get_rng
 
 
 def to_battle_array(my_pty, opp_pty, battlefield=None):
@@ -84,9 +83,9 @@ def check_speed(p1, p2):
     return p1_speed, p2_speed
 
 
-def move_speed_tie(p1, m1, p2, m2):
+def move_speed_tie(p1, m1, p2, m2, rng=None):
     """Get at random the order"""
-    speedtie = random.randint(1, 2)
+    speedtie = get_rng(rng).randint(1, 2)
     if speedtie == 1:
         order = [(p1, m1, p2), (p2, m2, p1)]
     else:
@@ -94,7 +93,7 @@ def move_speed_tie(p1, m1, p2, m2):
     return order
 
 
-def move_order(p1, move1, p2, move2, p1_switch, p2_switch):
+def move_order(p1, move1, p2, move2, p1_switch, p2_switch, rng=None):
     """Calculates the order which the what move should be played
     Returns:
 
@@ -125,7 +124,7 @@ def move_order(p1, move1, p2, move2, p1_switch, p2_switch):
         elif p2_speed > p1_speed:
             order = [(p2, move2, p1), (p1, move1, p2)]
         else:
-            order = move_speed_tie(p1, move1, p2, move2)
+            order = move_speed_tie(p1, move1, p2, move2, rng)
     return order
 
 
@@ -137,7 +136,7 @@ class MoveOutcome(Enum):
     SEMI_INVULNERABLE = auto()
 
 
-def calculate_hit_miss(move, attacker, defender):
+def calculate_hit_miss(move, attacker, defender, rng=None):
     '''Returns a boolean if the move passed the accuracy check'''
     # TODO: Semi invulnerable states, like Fly, dig etc.
     # TODO: Invulnerability like Eletric Ground, Poison Steel.
@@ -153,16 +152,14 @@ def calculate_hit_miss(move, attacker, defender):
     # Checking if it's an always hit move, if so it won't have an number on accuracy so it will always be 100 to hit
     accuracy = move[Move.ACCURACY] * stage_to_multiplier(acc_stage, acc=True)
 
-    if random.randint(1, 100) <= accuracy:
+    if get_rng(rng).below(100, accuracy):
         return MoveOutcome.HIT
     return MoveOutcome.MISS
 
 
-def calculate_crit():
+def calculate_crit(rng=None):
     """Returns a boolean if the move passed the crit check"""
-    crit_roll = random.randint(1, 16)  # 1/16 chance of a crit
-    iscrit = crit_roll == 1
-    return iscrit
+    return get_rng(rng).below(16, 1)  # 1/16 chance of a crit
 
 
 def get_non_fainted_pokemon(party):
@@ -184,24 +181,24 @@ def reset_switch_out(pok):
     pok[Pok.BADLY_POISON] = 1
 
 
-def flinch_checker(move):
+def flinch_checker(move, rng=None):
     """Returns true or false if move has a flinch percent and it should flinch"""
     flinch = move[Sec.VOL_STATUS]
     chance = move[Sec.CHANCE]
     if flinch != 0 and flinch & VolStatus.FLINCH:
-        if random.randint(1, 100) <= chance:
+        if get_rng(rng).below(100, chance):
             return True
 
     return False
 
 
-def confusion(attacker, my_pok):
+def confusion(attacker, my_pok, rng=None):
     """Calculates confusion turn"""
     if attacker == my_pok:
         print(f"{attacker.name} is confused!")
     else:
         print(f'Enemy {attacker.name} is confused!')
-    if random.randint(1, 100) <= 50:
+    if get_rng(rng).below(100, 50):
         print('it hurt itself in its confusion!')
         dmg = calculate_damage_confusion(attacker)
         attacker.current_hp -= dmg
@@ -235,9 +232,8 @@ def vol_early_returns(attacker, my_pok):
 
 
 def thaw(move, defender):
-    """Check if a move thaws"""
+    """Check if a move thaws, the caller emits the thaw event"""
     if move[Move.TYPE] == Types['FIRE']:
         defender[Pok.STATUS] = 0
-        print(f"{PokemonName(defender[Pok.ID]).name.capitalize()} has thawed out!")
         return True
     return False
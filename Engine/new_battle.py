@@ -1,6 +1,5 @@
 """Battle class where it follows battle flow, doing the sequence selection, start of turn, actions,
 end of turn and repeat"""
-import random
 import numpy as np
 from Engine.engine_helper import (
     check_speed,
@@ -14,12 +13,15 @@ from Engine.engine_helper import (
     to_battle_array
 )
 from Engine.status_calc import paralysis, sec_effects, calculate_effects, after_turn_status, freeze
-from Engine.damage_calc import calculate_damage
+from Engine.damage_calc import calculate_damage, DamageMatrix
+from Engine.battle_events import Event, BattleEvent, ConsoleSink, NULL_SINK, MY_SIDE, OPP_SIDE
 from Models.trainer_ai import TrainerAI
 from Models.idx_const import (
     Pok, Field, Move, Sec, POK_LEN, MOVE_STRIDE, OFFSET_MOVE
 )
-from Models.helper import count_party, Status, VolStatus, MoveCategory
+from Models.helper import count_party, Status, VolStatus, MoveCategory, BattlePhase, SWITCH_OFFSET
+from Models.battle_table import DYN_IDX
+from Utils.rng import get_rng, ReplayRNG
 from DataBase.PkDB import PokIdToName
 from DataBase.MoveDB import MoveIdToName
 
@@ -115,14 +117,21 @@ def battle_menu(current_pokemon, my_pty):
 
 class Battle():
     """Battle class, where i calculate all the battle, following the flow of battle"""
-    def __init__(self, my_pty=None, opp_pty=None, battle_array=None):
+    def __init__(self, my_pty=None, opp_pty=None, battle_array=None, dmg_matrix=None, sink=None, rng=None):
         # Make the normalized battle array
         self.battle_array = to_battle_array(my_pty, opp_pty) if battle_array is None else battle_array
         self.pok_features = POK_LEN
         self.my_pty = self.battle_array[0:(6 * self.pok_features)]
         self.opp_pty = self.battle_array[(6 * self.pok_features):(12 * self.pok_features)]
-        self.opp_ai = TrainerAI()
+        # The damage matrix is per battle, so the search can share one between all the states it sims
+        self.dmg_matrix = DamageMatrix() if dmg_matrix is None else dmg_matrix
+        # Every random draw of the battle (and its trainer AI) comes from this stream
+        self.rng = get_rng(rng)
+        self.opp_ai = TrainerAI(dmg_matrix=self.dmg_matrix, rng=self.rng)
+        # Where the battle events go, the interactive battle prints them
+        self.sink = ConsoleSink() if sink is None else sink
         self.turn = self.battle_array[Field.TURN]
+        self.move_idx = (0, 0)
 
         # current active Pokémon
         opp_active = int(self.battle_array[Field.OPP_POK])
@@ -142,16 +151,16 @@ class Battle():
         speed_tie_1 = False
         speed_tie_2 = False
         if p1_speed == p2_speed:
-            if random.randint(1, 2) == 1:
+            if self.rng.below(2, 1):
                 speed_tie_1 = True
             else:
                 speed_tie_2 = True
         if p1_speed > p2_speed or speed_tie_1:
-            print(f"You sent out {PokIdToName[self.current_pokemon[Pok.ID]].capitalize()}!")
-            print(f"The opponent sent out {PokIdToName[self.current_opp[Pok.ID]].capitalize()}!")
+            self.emit(Event.SEND_OUT, MY_SIDE, self.current_pokemon)
+            self.emit(Event.SEND_OUT, OPP_SIDE, self.current_opp)
         elif p2_speed > p1_speed or speed_tie_2:
-            print(f"The opponent sent out {PokIdToName[self.current_pokemon[Pok.ID]].capitalize()}!")
-            print(f"You sent out {PokIdToName[self.current_opp[Pok.ID]].capitalize()}!")
+            self.emit(Event.SEND_OUT, OPP_SIDE, self.current_opp)
+            self.emit(Event.SEND_OUT, MY_SIDE, self.current_pokemon)
         self.current_pokemon[Pok.TURNS] = 1
         self.current_opp[Pok.TURNS] = 1
 
@@ -162,7 +171,8 @@ class Battle():
             self.current_pokemon,
             self.my_pty,
             self.opp_pty,
-            self.turn
+            self.turn,
+            self.slots()[::-1]
         )
 
 
@@ -175,7 +185,7 @@ class Battle():
         opp_switch = None
         if opp_move == 's':
             i = self.opp_ai.sub_after_death(
-                self.opp_pty, self.current_pokemon, self.current_opp
+                self.opp_pty, self.current_pokemon, self.current_opp, self.slots()[0]
             )
             opp_switch = self.opp_pty[(i * self.pok_features):((i+1) * self.pok_features)]
 
@@ -184,55 +194,55 @@ class Battle():
             speed_tie_1 = False
             speed_tie_2 = False
             if my_s == opp_s:
-                if random.randint(1, 2) == 1:
+                if self.rng.below(2, 1):
                     speed_tie_1 = True
                 else:
                     speed_tie_2 = True
             if my_s > opp_s or speed_tie_1:
                 # TODO: Switch in abilities and terrain hazards
-                print(f'You switched {PokIdToName[self.current_pokemon[Pok.ID]].capitalize()} out.')
+                self.emit(Event.SWITCH_OUT, MY_SIDE, self.current_pokemon)
                 reset_switch_out(self.current_pokemon)
                 self.battle_array[Field.MY_POK] = switch_idx
                 self.current_pokemon = self.my_pty[(switch_idx * self.pok_features):((switch_idx+1) * self.pok_features)]
-                print(f'You switched {PokIdToName[self.current_pokemon[Pok.ID]].capitalize()} in.')
+                self.emit(Event.SWITCH_IN, MY_SIDE, self.current_pokemon)
 
-                print(f'Opponent has switched {PokIdToName[self.current_opp[Pok.ID]].capitalize()} out.')
+                self.emit(Event.SWITCH_OUT, OPP_SIDE, self.current_opp)
                 reset_switch_out(self.current_opp)
                 self.current_opp = opp_switch
                 self.battle_array[Field.OPP_POK] = opp_switch
-                print(f'Opponent has switched {PokIdToName[self.current_opp[Pok.ID]].capitalize()} in.')
+                self.emit(Event.SWITCH_IN, OPP_SIDE, self.current_opp)
             elif my_s < opp_s or speed_tie_2:
                 # TODO: Switch in abilities and terrain hazards
-                print(f'Opponent has switched {PokIdToName[self.current_opp[Pok.ID]].capitalize()} out.')
+                self.emit(Event.SWITCH_OUT, OPP_SIDE, self.current_opp)
                 reset_switch_out(self.current_opp)
                 self.battle_array[Field.OPP_POK] = opp_switch
                 self.current_opp = opp_switch
-                print(f'Opponent has switched {PokIdToName[self.current_opp[Pok.ID]].capitalize()} in.')
+                self.emit(Event.SWITCH_IN, OPP_SIDE, self.current_opp)
 
-                print(f'You switched {PokIdToName[self.current_pokemon[Pok.ID]].capitalize()} out.')
+                self.emit(Event.SWITCH_OUT, MY_SIDE, self.current_pokemon)
                 reset_switch_out(self.current_pokemon)
                 self.battle_array[Field.MY_POK] = switch_idx
                 self.current_pokemon = self.my_pty[(switch_idx * self.pok_features):((switch_idx+1) * self.pok_features)]
-                print(f'You switched {PokIdToName[self.current_pokemon[Pok.ID]].capitalize()} in.')
+                self.emit(Event.SWITCH_IN, MY_SIDE, self.current_pokemon)
             return
 
         if opp_switch:
             # TODO: Switch in abilities and terrain hazards
-            print(f'Opponent has switched {PokIdToName[self.current_opp[Pok.ID]].capitalize()} out.')
+            self.emit(Event.SWITCH_OUT, OPP_SIDE, self.current_opp)
             reset_switch_out(self.current_opp)
             self.current_opp = opp_switch
             self.battle_array[Field.OPP_POK] = opp_switch
-            print(f'Opponent has switched {PokIdToName[self.current_opp[Pok.ID]].capitalize()} in.')
+            self.emit(Event.SWITCH_IN, OPP_SIDE, self.current_opp)
 
         if switch_idx >= 0:
             # TODO: Switch in abilities and terrain hazards
-            print(f'You switched {PokIdToName[self.current_pokemon[Pok.ID]].capitalize()} out.')
+            self.emit(Event.SWITCH_OUT, MY_SIDE, self.current_pokemon)
             reset_switch_out(self.current_pokemon)
             self.battle_array[Field.MY_POK] = switch_idx
             self.current_pokemon = self.my_pty[(switch_idx * self.pok_features):((switch_idx+1) * self.pok_features)]
-            print(f'You switched {PokIdToName[self.current_pokemon[Pok.ID]].capitalize()} in.')
+            self.emit(Event.SWITCH_IN, MY_SIDE, self.current_pokemon)
 
-    def action(self, current_move, opp_move, search=False):
+    def action(self, current_move, opp_move):
         """Where the moves are calculated"""
         p1_switch = False
         p2_switch = False
@@ -248,6 +258,7 @@ class Battle():
 
         move_offset = MOVE_STRIDE
         base_offset = OFFSET_MOVE
+        self.move_idx = (current_move, opp_move)
 
         order = move_order(
             self.current_pokemon,
@@ -261,148 +272,75 @@ class Battle():
                 base_offset + (move_offset * (opp_move + 1))
             ],
             p1_switch,
-            p2_switch
+            p2_switch,
+            self.rng
         )
 
-        if search:
-            for idx, (attacker, move, defender) in enumerate(order, start=1):
-                # If attacker slower and died before could attack
-                if attacker[Pok.CURRENT_HP] <= 0:
-                    continue
-                # Check for Sleep and if the attacker wakes up, TODO: Sleep Talk and Snore
-                if attacker[Pok.STATUS] == Status.SLEEP:
-                    if attacker[Pok.SLEEP_COUNTER] > 0:
-                        attacker[Pok.SLEEP_COUNTER] -= 1
-                        continue
-                    attacker[Pok.STATUS] = 0
-                # Check for Paralysis
-                if attacker[Pok.STATUS] == Status.PARALYSIS and paralysis():
-                    continue
-                # Freeze
-                if attacker[Pok.STATUS] == Status.FREEZE:
-                    early_return = freeze()
-                    if early_return:
-                        continue
-                    attacker[Pok.STATUS] = 0
-                # Flinch
-                if idx >= 2 and flinch is True:
-                    continue
-                # Volatile Status early returns, only confusion for now
-                if attacker[Pok.VOL_STATUS] != 0 and attacker[Pok.VOL_STATUS] & VolStatus.CONFUSION:
-                    early_return = random.randint(1,2) == 1
-                    if early_return:
-                        continue
-                # In cases like after recoil damage, selfdestruct, etc.
-                if defender[Pok.CURRENT_HP] <= 0:
-                    #TODO: Some moves still go through, like self buff, dig, future sight
-                    continue
-
-                move_hit = calculate_hit_miss(move, attacker, defender)
-
-                if move_hit is MoveOutcome.HIT:
-                    if move[Move.CATEGORY] in [MoveCategory.PHYSICAL, MoveCategory.SPECIAL]:
-                        self.ps_moves(attacker, defender, move)
-                        flinch = flinch_checker(move)
-                        if attacker[Pok.STATUS] == Status.FREEZE:
-                            thaw(move, defender)
-                    else:
-                        calculate_effects(attacker, defender, move)
-            return
-
         for idx, (attacker, move, defender) in enumerate(order, start=1):
             # If attacker slower and died before could attack
             if attacker[Pok.CURRENT_HP] <= 0:
                 continue
+            side = MY_SIDE if attacker is self.current_pokemon else OPP_SIDE
             # Check for Sleep and if the attacker wakes up, TODO: Sleep Talk and Snore
             if attacker[Pok.STATUS] == Status.SLEEP:
                 if attacker[Pok.SLEEP_COUNTER] > 0:
-                    print(f"{PokIdToName[attacker[Pok.ID]].capitalize()} is fast asleep!")
+                    self.emit(Event.ASLEEP, side, attacker)
                     attacker[Pok.SLEEP_COUNTER] -= 1
                     continue
                 attacker[Pok.STATUS] = 0
-                print(f"{PokIdToName[attacker[Pok.ID]].capitalize()} has woken up!")
+                self.emit(Event.WOKE_UP, side, attacker)
             # Check for Paralysis
-            if attacker[Pok.STATUS] == Status.PARALYSIS and paralysis():
-                print(f"{PokIdToName[attacker[Pok.ID]].capitalize()} is fully paralysed!")
+            if attacker[Pok.STATUS] == Status.PARALYSIS and paralysis(self.rng):
+                self.emit(Event.FULLY_PARALYSED, side, attacker)
                 continue
             # Freeze
             if attacker[Pok.STATUS] == Status.FREEZE:
-                early_return = freeze()
+                early_return = freeze(self.rng)
                 if early_return:
-                    print(f'{PokIdToName[attacker[Pok.ID]].capitalize()} is frozen solid!')
+                    self.emit(Event.FROZEN, side, attacker)
                     continue
                 attacker[Pok.STATUS] = 0
-                print(f"{PokIdToName[attacker[Pok.ID]].capitalize()} has thawed out!")
+                self.emit(Event.THAWED, side, attacker)
             # Flinch
             if idx >= 2 and flinch is True:
-                print(f"{PokIdToName[attacker[Pok.ID]].capitalize()} flinched and couldn\'t move!")
+                self.emit(Event.FLINCHED, side, attacker)
                 continue
             # Volatile Status early returns, only confusion for now
             if attacker[Pok.VOL_STATUS] != 0 and attacker[Pok.VOL_STATUS] & VolStatus.CONFUSION:
-                early_return = random.randint(1,2) == 1
+                early_return = self.rng.below(2, 1)
                 if early_return:
                     continue
             # In cases like after recoil damage, selfdestruct, etc.
             if defender[Pok.CURRENT_HP] <= 0:
-                print(
-                    f"{PokIdToName[attacker[Pok.ID]].capitalize()}"
-                    f"used {MoveIdToName[move[Move.ID]].capitalize()} "
-                    f"on {PokIdToName[defender[Pok.ID]].capitalize()}!"
-                )
-                print("But it failed.")
+                #TODO: Some moves still go through, like self buff, dig, future sight
+                self.emit(Event.MOVE_USED, side, attacker, move, defender)
+                self.emit(Event.FAILED)
                 continue
 
-            move_hit = calculate_hit_miss(move, attacker, defender)
+            move_hit = calculate_hit_miss(move, attacker, defender, self.rng)
 
             if move_hit is MoveOutcome.HIT:
                 if move[Move.CATEGORY] in [MoveCategory.PHYSICAL, MoveCategory.SPECIAL]:
                     self.ps_moves(attacker, defender, move)
-                    flinch = flinch_checker(move)
-                    if attacker[Pok.STATUS] == Status.FREEZE:
-                        thaw(move, defender)
+                    flinch = flinch_checker(move, self.rng)
+                    if attacker[Pok.STATUS] == Status.FREEZE and thaw(move, defender):
+                        self.emit(Event.THAWED, 1 - side, defender)
                 else:
-                    if attacker[Pok.ID] == self.current_pokemon[Pok.ID]:
-                        print(
-                            f"{PokIdToName[attacker[Pok.ID]].capitalize()}"
-                            f"used {MoveIdToName[move[Move.ID]].capitalize()}!"
-                        )
-                    else:
-                        print(
-                            f"Opponent {PokIdToName[attacker[Pok.ID]].capitalize()}"
-                            f"used {MoveIdToName[move[Move.ID]].capitalize()}!"
-                        )
-                    calculate_effects(attacker, defender, move)
+                    self.emit(Event.MOVE_USED, side, attacker, move)
+                    calculate_effects(attacker, defender, move, self.rng)
 
             if move_hit is MoveOutcome.MISS:
-                if attacker[Pok.ID] == self.current_pokemon[Pok.ID]:
-                    print(
-                        f"{PokIdToName[attacker[Pok.ID]].capitalize()}"
-                        f"used {MoveIdToName[move[Move.ID]].capitalize()}!"
-                    )
-                else:
-                    print(
-                        f"Opponent {PokIdToName[attacker[Pok.ID]].capitalize()}"
-                        f"used {MoveIdToName[move[Move.ID]].capitalize()}!"
-                    )
-                print('But it missed.')
+                self.emit(Event.MOVE_USED, side, attacker, move)
+                self.emit(Event.MISSED)
 
             if move_hit is MoveOutcome.INVULNERABLE:
-                if attacker[Pok.ID] == self.current_pokemon[Pok.ID]:
-                    print(
-                        f"{PokIdToName[attacker[Pok.ID]].capitalize()}"
-                        f"used {MoveIdToName[move[Move.ID]].capitalize()}!"
-                    )
-                else:
-                    print(
-                        f"Opponent {PokIdToName[attacker[Pok.ID]].capitalize()}"
-                        f"used {MoveIdToName[move[Move.ID]].capitalize()}!"
-                    )
-                print('But it had no effect.')
+                self.emit(Event.MOVE_USED, side, attacker, move)
+                self.emit(Event.NO_EFFECT)
 
     def ps_moves(self, attacker, defender, move):
         """Physical or Special moves, where I need to calculate damage and secondary effects"""
-        crit = calculate_crit()
-        damage, effectivness = calculate_damage(attacker, defender, move, crit)
+        crit = calculate_crit(self.rng)
+        damage, effectivness = self.calculate_damage(attacker, defender, move, crit)
         if damage <= defender[Pok.CURRENT_HP]:
             defender[Pok.CURRENT_HP] -= damage
             dead = False
@@ -410,45 +348,52 @@ class Battle():
             defender[Pok.CURRENT_HP] = 0
             dead = True
 
-        # Check to see which side is attacking and represent accordingly
-        if attacker[Pok.ID] == self.current_pokemon[Pok.ID]:
-            print(
-                    f"{PokIdToName[attacker[Pok.ID]].capitalize()} "
-                    f"used {MoveIdToName[move[Move.ID]].capitalize()} "
-                    f"on {PokIdToName[defender[Pok.ID]].capitalize()}!"
-                )
-        else:
-            print(
-                    f"Opponent {PokIdToName[attacker[Pok.ID]].capitalize()} "
-                    f"used {MoveIdToName[move[Move.ID]].capitalize()} "
-                    f"on {PokIdToName[defender[Pok.ID]].capitalize()}!"
-                )
-
-        # Text to show crit
+        side = MY_SIDE if attacker is self.current_pokemon else OPP_SIDE
+        self.emit(Event.MOVE_USED, side, attacker, move, defender)
         if crit is True:
-            print("\033[91mIt's a critical hit! \033[0m")
-
-        # Since i don't have the hp bars for either side print out how much damage
-        print(f"It dealt {damage} damage.")
-
-        # If the move is supper effective or not much effective
-        if effectivness >= 2:
-            print("\033[92mIt's super effective! \033[0m")
-        elif 0 < effectivness < 1:
-            print("\033[94mIt's not very effective... \033[0m")
+            self.emit(Event.CRIT)
+        self.emit(Event.DAMAGE, value=damage)
+        if effectivness >= 2 or 0 < effectivness < 1:
+            self.emit(Event.EFFECTIVENESS, value=effectivness)
 
         # Check for secondary effects and apply them
         if move[Sec.CHANCE]:
-            sec_effects(move, attacker, defender, damage)
+            sec_effects(move, attacker, defender, damage, self.rng)
 
-        # Text of how much hp left, or if dead
         if dead:
-            print(f"\033[91m{PokIdToName[defender[Pok.ID]].capitalize()} has fainted! \033[0m")
+            self.emit(Event.FAINT, 1 - side, defender)
         else:
-            print(
-                f"{PokIdToName[defender[Pok.ID]].capitalize()} "
-                f"has {int(defender[Pok.CURRENT_HP])} HP left."
+            self.emit(Event.HP_LEFT, 1 - side, defender, value=defender[Pok.CURRENT_HP])
+
+    def emit(self, kind, side=MY_SIDE, pok=None, move=None, target=None, value=0):
+        """Send an event to the sink, when the sink is disabled (search) nothing is built"""
+        if not self.sink.enabled:
+            return
+        self.sink.emit(BattleEvent(
+            kind,
+            side,
+            int(pok[Pok.ID]) if pok is not None else 0,
+            int(move[Move.ID]) if move is not None else 0,
+            int(target[Pok.ID]) if target is not None else 0,
+            float(value)
+        ))
+
+    def slots(self):
+        """Party slots (0..11) of my active and the opponent active, as used by the damage matrix"""
+        return int(self.battle_array[Field.MY_POK]), int(self.battle_array[Field.OPP_POK]) + 6
+
+    def calculate_damage(self, attacker, defender, move, crit=False):
+        """calculate_damage through the damage matrix, for the two active Pokemon"""
+        my_slot, opp_slot = self.slots()
+        if attacker is self.current_pokemon and defender is self.current_opp:
+            return self.dmg_matrix.damage(
+                my_slot, self.move_idx[0], opp_slot, attacker, defender, crit, rng=self.rng
             )
+        if attacker is self.current_opp and defender is self.current_pokemon:
+            return self.dmg_matrix.damage(
+                opp_slot, self.move_idx[1], my_slot, attacker, defender, crit, rng=self.rng
+            )
+        return calculate_damage(attacker, defender, move, crit, rng=self.rng)
 
     def end_of_turn(self, search=False):
         """Does end of turn calculations like switch if dead, burn, poison, leech seed, ...,\n
@@ -477,12 +422,11 @@ class Battle():
             if count_party(self.opp_pty) == 0:
                 return
             i = self.opp_ai.sub_after_death(
-                self.opp_pty, self.current_pokemon, self.current_opp
+                self.opp_pty, self.current_pokemon, self.current_opp, self.slots()[0]
             )
             self.battle_array[Field.OPP_POK] = i
             self.current_opp = self.opp_pty[(i * self.pok_features):((i+1) * self.pok_features)]
-            print(f'the opponent has sent '
-                  f'{PokIdToName[self.current_opp[Pok.ID]].capitalize()} out')
+            self.emit(Event.SEND_OUT, OPP_SIDE, self.current_opp)
             if search:
                 return i
         if search is False:
@@ -512,23 +456,22 @@ class Battle():
             self.current_pokemon[Pok.TURNS] += 1
 
         if count_party(self.my_pty) == 0:
-            print("You Lost!")
+            self.emit(Event.LOSE)
         if count_party(self.opp_pty) == 0:
-            print("You Won!")
+            self.emit(Event.WIN)
 
     def turn_sim(self, opp_move, current_action):
-        """One turn"""
-        from SearchEngine.my_mcts import BattlePhase  # pylint:disable=C0415
-        if current_action[0] == 'move':
+        """One turn, current_action being an action code (see Models.helper.SWITCH_OFFSET)"""
+        if current_action < SWITCH_OFFSET:
             switch_idx = -1
-            current_move = current_action[1]
+            current_move = current_action
         else:
             current_move = -1
-            switch_idx = current_action[1]
+            switch_idx = current_action - SWITCH_OFFSET
         if self.current_opp[0] == 0 or self.current_pokemon[0] == 0:
             pass
         self.start_of_turn(opp_move, switch_idx)
-        self.action(current_move, opp_move, search=True)
+        self.action(current_move, opp_move)
         opp_idx = self.end_of_turn(search=True)
         self.battle_array[Field.TURN] += 1
         self.turn += 1
@@ -542,6 +485,68 @@ class Battle():
         return BattlePhase.TURN_START, opp_idx
 
 
+def apply_turn(battle_array, my_action, opp_move, dmg_matrix=None, sink=None, rng=None):
+    """
+    Play one turn in place on battle_array, my_action being an action code (move 0..3 or switch 4..9, see
+    Models.helper.SWITCH_OFFSET) and opp_move the opponent move index (unused on the DEATH_END_OF_TURN phase, where only my switch happens).
+    Returns the undo log of the turn, the (battle array index, old value) of every cell it changed,
+    only dynamic fields are ever written so the log is a diff of those
+    """
+    before = battle_array[DYN_IDX]
+    battle_sim = Battle(
+        battle_array=battle_array,
+        dmg_matrix=dmg_matrix,
+        sink=NULL_SINK if sink is None else sink,
+        rng=rng
+    )
+    if battle_array[Field.PHASE] == BattlePhase.DEATH_END_OF_TURN:
+        battle_sim.end_of_turn(search=int(my_action) - SWITCH_OFFSET)
+        battle_array[Field.PHASE] = BattlePhase.TURN_START
+    else:
+        battle_array[Field.PHASE], _ = battle_sim.turn_sim(opp_move, int(my_action))
+    if my_action >= SWITCH_OFFSET:
+        battle_array[Field.MY_POK] = my_action - SWITCH_OFFSET
+    changed = np.flatnonzero(battle_array[DYN_IDX] != before)
+    return DYN_IDX[changed], before[changed]
+
+
+def undo(battle_array, log):
+    """Restore battle_array to before the turn of log, logs have to be undone newest first"""
+    idx, old = log
+    battle_array[idx] = old
+
+
+def turn_outcomes(battle_array, my_action, opp_move, dmg_matrix=None) -> list:
+    """
+    Every battle array the turn can end on with its exact probability, as (probability, battle_array) pairs.
+    The turn is replayed once per chance path (speed tie, hit/miss, crit, damage roll, full paralysis, thaw,
+    confusion, secondary effects, flinch) and the paths ending on the same array are merged.
+    battle_array is left as it was
+    """
+    outcomes = {}
+    for probability, outcome in iter_turn_paths(battle_array, my_action, opp_move, dmg_matrix):
+        key = outcome[DYN_IDX].tobytes()
+        if key in outcomes:
+            outcomes[key][0] += probability
+        else:
+            outcomes[key] = [probability, outcome.copy()]
+    return [(probability, outcome) for probability, outcome in outcomes.values()]
+
+
+def iter_turn_paths(battle_array, my_action, opp_move, dmg_matrix=None):
+    """
+    Chance paths of turn_outcomes one at a time (depth first), as (probability, battle_array after the path).
+    battle_array is restored before the next path, so it can be stopped and resumed later. Paths aren't merged
+    """
+    script = []
+    while script is not None:
+        rng = ReplayRNG(script)
+        log = apply_turn(battle_array, my_action, opp_move, dmg_matrix, rng=rng)
+        yield rng.probability, battle_array
+        undo(battle_array, log)
+        script = rng.next_script()
+
+
 def battle(my_pty, opp_pty):
     """Just so it's easier to call on main"""
     b = Battle(my_pty, opp_pty)
@@ -1,11 +1,11 @@
 """Calculate Status effects moves"""
-import random
 import numpy as np
 from Models.idx_const import Pok, Move, Sec
 from Models.helper import Status, MoveCategory, Target
+from Utils.rng import get_rng
 
 
-def apply_status(move, pok, sec=False):
+def apply_status(move, pok, sec=False, rng=None):
     """Apply status effects"""
     if sec:
         if move[Sec.STATUS] != Status.SLEEP:
@@ -18,7 +18,7 @@ def apply_status(move, pok, sec=False):
         if pok[Pok.STATUS] == Status.SLEEP:
             return
         pok[Pok.STATUS] = move[Sec.STATUS]
-        pok[Pok.SLEEP_COUNTER] = np.random.randint(1,5)  # End not inclusive thats why to 5
+        pok[Pok.SLEEP_COUNTER] = get_rng(rng).randint(1, 4)
         return
     if move[Move.STATUS] != Status.SLEEP:
         if pok[Pok.STATUS] == 0:
@@ -30,7 +30,7 @@ def apply_status(move, pok, sec=False):
     if pok[Pok.STATUS] == Status.SLEEP:
         return
     pok[Pok.STATUS] = move[Move.STATUS]
-    pok[Pok.SLEEP_COUNTER] = np.random.randint(1,5)  # End not inclusive thats why to 5
+    pok[Pok.SLEEP_COUNTER] = get_rng(rng).randint(1, 4)
     return
 
 
@@ -46,7 +46,7 @@ def drain_effect(attacker, dmg, drain_amount):
     attacker[Pok.CURRENT_HP] += drain_hp
 
 
-def calculate_effects(attacker, defender, move):
+def calculate_effects(attacker, defender, move, rng=None):
     """Calculate the effect parts of the moves"""
     if move[Move.CATEGORY] != MoveCategory.STATUS:
         return
@@ -109,16 +109,15 @@ def calculate_effects(attacker, defender, move):
             Target.RANDOM_NORMAL,
             Target.SCRIPTED
         ):
-            apply_status(move, defender)
+            apply_status(move, defender, rng=rng)
         raise ValueError("Shouldn't have self status change")
 
 
-def sec_effects(move, attacker, defender, dmg):
+def sec_effects(move, attacker, defender, dmg, rng=None):
     """Calculate the secondary effects, like 10% of burning,
     30% of increasing attacking, Drain moves etc."""
     chance = move[Sec.CHANCE]
-    roll = random.randint(1, 100) if chance < 100 else 0
-    if roll <= chance:
+    if chance >= 100 or get_rng(rng).below(100, chance):
         if move[Move.TARGET] in (
             Target.NORMAL,
             Target.ADJACENT_FOE,
@@ -130,7 +129,7 @@ def sec_effects(move, attacker, defender, dmg):
         ):
             a = move[Sec.STATUS]
             if a != 0:
-                apply_status(move, defender, sec=True)
+                apply_status(move, defender, sec=True, rng=rng)
         if move[Move.TARGET] in (
             Target.ADJACENT_ALLY,
             Target.ADJACENT_ALLY_OR_SELF,
@@ -172,15 +171,15 @@ def after_turn_status(pok):
                 pok[Pok.CURRENT_HP] = 0
 
 
-def paralysis():
+def paralysis(rng=None):
     """Check if Pokemon is fully paralysed"""
-    if random.randint(1, 4) <= 1:
+    if get_rng(rng).below(4, 1):
         return True
     return False
 
 
-def freeze():
+def freeze(rng=None):
     """Check if it thaws"""
-    if random.randint(1, 5) <= 1:
+    if get_rng(rng).below(5, 1):
         return False
     return True
@@ -0,0 +1,100 @@
+"""Static/dynamic split of the battle array, so search states only carry the fields a battle writes to"""
+import numpy as np
+from Models.idx_const import Dyn, Field, POK_LEN, FIELD_LEN, DYN_POK_FIELDS, DYN_POK_LEN, DYN_LEN
+
+# Battle array index of every dynamic field, in dynamic array order
+DYN_POK_IDX = np.array(DYN_POK_FIELDS)
+DYN_IDX = np.concatenate((
+    (np.arange(12)[:, None] * POK_LEN + DYN_POK_IDX).ravel(),
+    np.arange(Field.MY_POK, Field.MY_POK + FIELD_LEN)
+))
+# A state is 13 blocks of its dynamic array: one per party slot (0..11) then the field
+FIELD_BLOCK = 12
+BLOCK_BOUNDS = tuple(
+    (slot * DYN_POK_LEN, (slot + 1) * DYN_POK_LEN) for slot in range(12)
+) + ((Dyn.MY_POK, DYN_LEN),)
+BLOCK_STARTS = np.array([start for start, _ in BLOCK_BOUNDS])
+# Zobrist key of every battle array cell, a state hash is the xor of mix(key ^ value bits) over its dynamic fields
+# so a turn updates it from the cells it changed alone
+ZOBRIST = np.random.default_rng(0x2B0B).integers(
+    0, np.iinfo(np.uint64).max, size=int(DYN_IDX.max()) + 1, dtype=np.uint64, endpoint=True
+)
+
+
+def _mix(idx, values) -> int:
+    """xor of the mixed (splitmix64 finalizer) cells idx holding values"""
+    x = ZOBRIST[idx] ^ (np.asarray(values, dtype=np.float64) + 0.0).view(np.uint64)  # + 0.0 so -0.0 is 0.0
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return int(np.bitwise_xor.reduce(x))
+
+
+def state_key(dyn) -> int:
+    """64 bit hash of a dynamic array (see Dyn), equal states have equal keys"""
+    return _mix(DYN_IDX, dyn)
+
+
+def update_key(key, log, battle_array) -> int:
+    """state_key after a turn, from the key before it and the turn undo log (battle_array being after the turn)"""
+    idx, old = log
+    return key ^ _mix(idx, old) ^ _mix(idx, battle_array[idx])
+
+
+class StaticTable:
+    """
+    Read only battle array of one battle: species, stats, types, abilities, moves and items live here once.
+    A state is then just the blocks of a dynamic array (see Dyn), and the full battle array is rebuilt when the
+    engine needs it.
+    scratch is a reusable battle array for the engine, only the dynamic fields are ever written to it so
+    loading a state is a single scatter.
+    """
+    def __init__(self, battle_array):
+        self.base = np.array(battle_array, dtype=np.float64)
+        self.base.flags.writeable = False
+        self.scratch = np.array(self.base)
+
+    @staticmethod
+    def split(battle_array, parent=None, parent_dyn=None) -> tuple:
+        """
+        Read only blocks of the dynamic part of a battle array. Copy on write: the blocks of parent
+        (with parent_dyn its dynamic array) that the turn didn't change are shared instead of copied
+        """
+        dyn = battle_array[DYN_IDX]
+        if parent is None:
+            blocks = [None] * len(BLOCK_BOUNDS)
+            changed = range(len(BLOCK_BOUNDS))
+        else:
+            blocks = list(parent)
+            diff = dyn != parent_dyn
+            changed = np.flatnonzero(np.add.reduceat(diff, BLOCK_STARTS)).tolist()
+        for slot in changed:
+            start, end = BLOCK_BOUNDS[slot]
+            block = dyn[start:end].copy()
+            block.flags.writeable = False
+            blocks[slot] = block
+        return tuple(blocks)
+
+    @staticmethod
+    def join(blocks) -> np.ndarray:
+        """Dynamic array of the blocks"""
+        return np.concatenate(blocks)
+
+    def materialize(self, dyn) -> np.ndarray:
+        """New battle array of the state"""
+        battle_array = np.array(self.base)
+        battle_array[DYN_IDX] = dyn
+        return battle_array
+
+    def load(self, dyn) -> np.ndarray:
+        """Write the state into scratch and return it, valid until the next load"""
+        self.scratch[DYN_IDX] = dyn
+        return self.scratch
+
+    def pokemon(self, block, slot) -> np.ndarray:
+        """New Pokemon array of slot (0..11), block being the slot dynamic block"""
+        pok = np.array(self.base[slot * POK_LEN:(slot + 1) * POK_LEN])
+        pok[DYN_POK_IDX] = block
+        return pok
@@ -1,7 +1,7 @@
 """Helper for transformation of Names to number, so i can use Numpy efficiently"""
 from types import SimpleNamespace
 import numpy as np
-from Models.idx_const import Pok, POK_LEN
+from Models.idx_const import Pok, Field, POK_LEN, MOVE_STRIDE
 
 
 Types = SimpleNamespace(
@@ -159,6 +159,23 @@ ItemType = SimpleNamespace(
 )
 
 
+BattlePhase = SimpleNamespace(
+    TURN_START = 0,
+    DEATH_END_OF_TURN = 1
+)
+
+# Action codes (search and engines): 0..3 use move i of the active Pokemon, 4..9 switch to party slot
+# code - SWITCH_OFFSET. A set of actions is a bit mask, bit code set for every action in it
+SWITCH_OFFSET = 4
+N_ACTIONS = SWITCH_OFFSET + 6
+# Action codes of every mask, so the legal actions of a position are looked up instead of built
+MASK_ACTIONS = tuple(
+    tuple(code for code in range(N_ACTIONS) if mask >> code & 1) for mask in range(1 << N_ACTIONS)
+)
+# Row mask is the mask as N_ACTIONS 0/1 floats, for vectorized picks over the legal actions
+MASK_BITS = ((np.arange(1 << N_ACTIONS)[:, None] >> np.arange(N_ACTIONS)) & 1).astype(np.float64)
+
+
 class ItemActivation:
     """When will the ability be used"""
     SWITCH_IN = 1
@@ -170,6 +187,32 @@ class ItemActivation:
     ON_SELECTION = 64
 
 
+def action_name(action) -> str:
+    """Readable action code, for the reports"""
+    if action >= SWITCH_OFFSET:
+        return f"switch {action - SWITCH_OFFSET}"
+    return f"move {action}"
+
+
+def legal_mask(battle_array, opponent=False) -> int:
+    """
+    Mask of the legal actions of a side of a battle array: the moves the active has and a switch to every other
+    Pokemon alive, only the switches on the DEATH_END_OF_TURN phase
+    """
+    side = 6 if opponent else 0
+    active = int(battle_array[Field.OPP_POK if opponent else Field.MY_POK])
+    mask = 0
+    if battle_array[Field.PHASE] != BattlePhase.DEATH_END_OF_TURN:
+        start = (side + active) * POK_LEN + Pok.MOVE1_ID
+        for i in range(4):
+            if battle_array[start + i * MOVE_STRIDE] != 0:
+                mask |= 1 << i
+    for i in range(6):
+        if battle_array[(side + i) * POK_LEN + Pok.CURRENT_HP] > 0 and i != active:
+            mask |= 1 << (SWITCH_OFFSET + i)
+    return mask
+
+
 def count_party(pty):
     """How many pok are alive"""
     pok_features = POK_LEN
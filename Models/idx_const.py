@@ -180,6 +180,53 @@ class Field:
     PHASE              = OPP_SCREEN_DURATION + 1
     OPP_MOVE           = PHASE + 1
 
+# === Dynamic state (the only fields a battle writes to) ===
+DYN_POK_FIELDS = (
+    Pok.CURRENT_HP,
+    Pok.ATTACK_STAT_STAGE,
+    Pok.DEFENSE_STAT_STAGE,
+    Pok.SPECIAL_ATTACK_STAT_STAGE,
+    Pok.SPECIAL_DEFENSE_STAT_STAGE,
+    Pok.SPEED_STAT_STAGE,
+    Pok.ACCURACY_STAT_STAGE,
+    Pok.EVASION_STAT_STAGE,
+    Pok.STATUS,
+    Pok.VOL_STATUS,
+    Pok.SLEEP_COUNTER,
+    Pok.BADLY_POISON,
+    Pok.TURNS,
+)
+DYN_POK_LEN = 13                                   # len(DYN_POK_FIELDS)
+DYN_LEN     = 12 * DYN_POK_LEN + FIELD_LEN         # 168 - vs 12 * POK_LEN + FIELD_LEN for the battle array
+
+class Dyn:
+    """Dynamic array indices, a DYN_POK_LEN block per Pokemon (same order as the battle array) then the field"""
+    CURRENT_HP                = 0
+    ATTACK_STAT_STAGE         = CURRENT_HP + 1
+    DEFENSE_STAT_STAGE        = ATTACK_STAT_STAGE + 1
+    SPECIAL_ATTACK_STAT_STAGE = DEFENSE_STAT_STAGE + 1
+    SPECIAL_DEFENSE_STAT_STAGE= SPECIAL_ATTACK_STAT_STAGE + 1
+    SPEED_STAT_STAGE          = SPECIAL_DEFENSE_STAT_STAGE + 1
+    ACCURACY_STAT_STAGE       = SPEED_STAT_STAGE + 1
+    EVASION_STAT_STAGE        = ACCURACY_STAT_STAGE + 1
+    STATUS                    = EVASION_STAT_STAGE + 1
+    VOL_STATUS                = STATUS + 1
+    SLEEP_COUNTER             = VOL_STATUS + 1
+    BADLY_POISON              = SLEEP_COUNTER + 1
+    TURNS                     = BADLY_POISON + 1
+    MY_POK                    = DYN_POK_LEN * 12
+    OPP_POK                   = MY_POK + 1
+    TURN                      = OPP_POK + 1
+    WEATHER                   = TURN + 1
+    WEATHER_DURATION          = WEATHER + 1
+    TRICKROOM                 = WEATHER_DURATION + 1
+    TRICKROOM_DURATION        = TRICKROOM + 1
+    MY_SCREEN                 = TRICKROOM_DURATION + 1
+    MY_SCREEN_DURATION        = MY_SCREEN + 1
+    OPP_SCREEN                = MY_SCREEN_DURATION + 1
+    OPP_SCREEN_DURATION       = OPP_SCREEN + 1
+    PHASE                     = OPP_SCREEN_DURATION + 1
+
 class Item:
     """Index for Items"""
 
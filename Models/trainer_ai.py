@@ -1,8 +1,10 @@
 """Gives the class for the trainer Ai to be what the game would do"""
-import random
+import math
+from bisect import bisect_right
 import numpy as np
-from Engine.damage_calc import calculate_damage
+from Engine.damage_calc import calculate_damage, DamageMatrix
 from Utils.helper import get_type_effectiveness, batch_independent_score_from_rand, stage_to_multiplier
+from Utils.rng import get_rng
 from DataBase.loader import pkDB
 from DataBase.MoveDB import MoveName
 from DataBase.AbilitiesDB import AbilityNames
@@ -11,6 +13,40 @@ from Models.idx_const import (
     Pok, Move, Flags, POK_LEN
 )
 from Models.helper import MoveCategory, Types, Status, VolStatus, Gender, Target, count_party
+from Utils.cache import LRUCache, PerBattle
+
+# Fields of both actives the basic and expert flags read that change during a battle, in the order _flag_bands takes
+FLAG_KEY_FIELDS = np.array([
+    Pok.ATTACK_STAT_STAGE, Pok.DEFENSE_STAT_STAGE, Pok.SPECIAL_ATTACK_STAT_STAGE,
+    Pok.SPECIAL_DEFENSE_STAT_STAGE, Pok.SPEED_STAT_STAGE, Pok.ACCURACY_STAT_STAGE, Pok.EVASION_STAT_STAGE,
+    Pok.STATUS, Pok.VOL_STATUS, Pok.CURRENT_HP, Pok.MAX_HP
+])
+# The thresholds (value >= threshold) the flags compare the stages (attack, defense, special attack, special defense,
+# speed, accuracy, evasion) and the floored HP percents to, the cache key holds the band each value falls in. The
+# speeds are only compared to each other, the speed_order is part of the key. The engine doesn't clamp the stages to
+# [-6, 6], every stat has -6 and 7 so -6 and 6 (what the == -6 / == 6 flags test) are bands of their own
+AI_STAGE_THRESHOLDS = (
+    (-6, 3, 6, 7), (-6, -2, 3, 6, 7), (-6, 3, 6, 7), (-6, -2, 3, 6, 7), (-6, 3, 6, 7), (-6, -4, -2, -1, 0, 1, 3, 6, 7),
+    (-6, 3, 6, 7)
+)
+USER_STAGE_THRESHOLDS = (
+    (-6, -5, -2, 0, 1, 7), (-6, -5, 7), (-6, -5, -2, 0, 1, 7), (-6, -5, 7), (-6, -5, 7), (-6, -5, 7),
+    (-6, -5, 0, 1, 3, 5, 7)
+)
+AI_HP_THRESHOLDS = (40, 41, 50, 51, 70, 71, 90, 91, 100)
+USER_HP_THRESHOLDS = (31, 40, 41, 51, 70, 71)
+# Cached flag scores of each battle, dropped with its damage matrix, the least recently used go past the size
+FLAG_CACHE_SIZE = 1 << 14
+_FLAGS = PerBattle(lambda: LRUCache(FLAG_CACHE_SIZE))
+
+
+def _flag_bands(pok, stage_thresholds, hp_thresholds) -> tuple:
+    """Stage bands, status, volatile status and HP band of an active, its part of the flag cache key"""
+    *stages, status, vol_status, hp, max_hp = pok[FLAG_KEY_FIELDS].tolist()
+    return (
+        *map(bisect_right, stage_thresholds, stages), status, vol_status,
+        bisect_right(hp_thresholds, math.floor(hp / max_hp * 100))
+    )
 
 
 def add_adjustment(arr, move_id, delta, chance):
@@ -26,10 +62,12 @@ class TrainerAI:
     """
     Trainer AI, where it is used by using the def where it returns what the original ai would have done
     """
-    def __init__(self, difficulty=None, gen=4):
+    def __init__(self, difficulty=None, gen=4, dmg_matrix=None, rng=None):
         self.gen = gen
         self.difficulty = difficulty
         self.current_pok_ab = False
+        self.dmg_matrix = DamageMatrix() if dmg_matrix is None else dmg_matrix
+        self.rng = get_rng(rng)
 
     def basic_flag(
             self, move, ability, ai_pok, user_pok, effectiveness, user_party_alive,
@@ -52,7 +90,7 @@ class TrainerAI:
         ):
             move_first = False
         else:
-            move_first = random.choice([True, False])
+            move_first = self.rng.choice([True, False])
         """
         # Check for immunity types
         if move[Move.CATEGORY] != MoveCategory.STATUS and effectiveness == 0:
@@ -338,26 +376,34 @@ class TrainerAI:
             add_adjustment(rand, idx, 2, 176)
         return score, rand
 
-    def expert_flag(self, damage, eff, ai_pok, u_pok, move, ai_pt, u_pt, turn, idx, rand):  # pylint: disable=W0613
+    def speed_order(self, ai_pok, u_pok) -> int:
+        """1 if the AI is faster, -1 if it's slower, 0 on a speed tie"""
+        # TODO add Trick room logic here
+        ai_speed = ai_pok[Pok.SPEED] * stage_to_multiplier(ai_pok[Pok.SPEED_STAT_STAGE])
+        u_speed = u_pok[Pok.SPEED] * stage_to_multiplier(u_pok[Pok.SPEED_STAT_STAGE])
+        return int(ai_speed > u_speed) - int(ai_speed < u_speed)
+
+    def moves_first(self, ai_pok, u_pok, order=None) -> bool:
+        """If the AI thinks it moves first, a speed tie is a coin flip. order is speed_order when already known"""
+        if order is None:
+            order = self.speed_order(ai_pok, u_pok)
+        if order:
+            return order > 0
+        return self.rng.choice([True, False])
+
+    def expert_flag(
+            self, damage, eff, ai_pok, u_pok, move, ai_pt, u_pt, turn, idx, rand, move_first=None  # pylint: disable=W0613
+    ):
         """
         It shows the incentives and disincentives for the best trainer ai out there, for ROM HACKS every trainer has it
+        move_first is the outcome of moves_first when already known
         """
         score = 0
         hp_pct_ai = np.floor(ai_pok[Pok.CURRENT_HP] / ai_pok[Pok.MAX_HP] * 100)
         hp_pct_u = np.floor(u_pok[Pok.CURRENT_HP] / u_pok[Pok.MAX_HP] * 100)
-        # Check if move first (TODO add Trick room logic here)
-        if (
-            ai_pok[Pok.SPEED] * stage_to_multiplier(ai_pok[Pok.SPEED_STAT_STAGE])
-            > u_pok[Pok.SPEED] * stage_to_multiplier(u_pok[Pok.SPEED_STAT_STAGE])
-        ):
-            move_first = True
-        elif (
-            ai_pok[Pok.SPEED] * stage_to_multiplier(ai_pok[Pok.SPEED_STAT_STAGE])
-            < u_pok[Pok.SPEED] * stage_to_multiplier(u_pok[Pok.SPEED_STAT_STAGE])
-        ):
-            move_first = False
-        else:
-            move_first = random.choice([True, False])
+        # Check if move first
+        if move_first is None:
+            move_first = self.moves_first(ai_pok, u_pok)
 
         if move[Move.CATEGORY] == MoveCategory.STATUS:
             if move[Move.STATUS] != 0:
@@ -574,17 +620,63 @@ class TrainerAI:
         """
         return score, rand
 
+    def flag_cache(self, slots, ability, order, ai_pok, user_pok, user_party_alive, turn) -> dict:
+        """
+        Cached flags (see cached_flags) of the moves of ai_pok, shared by every choose_move of this battle with the same
+        ability guess, speed order, first turn or not, user with a Pokemon to switch to or not and bands of both actives
+        (_flag_bands): what the basic and expert flags read
+        """
+        cache = _FLAGS.get(self.dmg_matrix)
+        key = (
+            slots, ability, order, turn == 1, count_party(user_party_alive) > 1,
+            _flag_bands(ai_pok, AI_STAGE_THRESHOLDS, AI_HP_THRESHOLDS),
+            _flag_bands(user_pok, USER_STAGE_THRESHOLDS, USER_HP_THRESHOLDS)
+        )
+        flags = cache.get(key)
+        if flags is None:
+            flags = cache.put(key, {})
+        return flags
+
+    def cached_flags(
+            self, flags, order, move, ability, ai_pok, user_pok, effectiveness, user_party_alive, ai_party_alive,
+            turn, idx, rand
+    ) -> tuple:
+        """
+        basic_flag plus expert_flag of a move, flags being its flag_cache and order the speed_order: the score and the
+        random adjustments (added to rand) are computed once per move order, only the adjustments are rolled again
+        """
+        move_first = self.moves_first(ai_pok, user_pok, order)
+        cached = flags.get((idx, move_first))
+        if cached is not None:
+            score, adjustments = cached
+            for delta, chance in adjustments:
+                add_adjustment(rand, idx, delta, chance)
+            return score, rand
+        # The expert flag adds its adjustments after the ones already there, keep those
+        used = sum(chance == chance for chance in rand[idx, :, 1].tolist())  # Not NaN
+        score = self.basic_flag(move, ability, ai_pok, user_pok, effectiveness, user_party_alive, ai_party_alive, turn)
+        expert, rand = self.expert_flag(
+            None, effectiveness, ai_pok, user_pok, move, ai_party_alive, user_party_alive, turn, idx, rand, move_first
+        )
+        adjustments = tuple(
+            (delta, chance) for delta, chance in rand[idx, used:].tolist() if chance == chance
+        )
+        flags[(idx, move_first)] = (score + expert, adjustments)
+        return score + expert, rand
+
     def choose_move(
             self,
             ai_pok,
             user_pok,
             user_party_alive,
             ai_party_alive,
-            turn
+            turn,
+            slots=None
     ):
         """
         Calculates the score of the moves and sees what has the highest score
         search is used for me to get the raw values of score and rand, so i can see what percentage of chance each move has
+        slots is (ai slot, user slot) in the battle array (0..11), when given the damage comes from the damage matrix
         """
         """The AI always knows what item you're holding. It cheats to see it.
 
@@ -621,11 +713,16 @@ class TrainerAI:
             ability = AbilityNames[user_pok[Pok.AB_ID]]
         else:
             try:
-                ability = random.choice(pkDB[PokIdToName[user_pok[Pok.ID]].capitalize()]['abilities']).upper()
+                ability = self.rng.choice(pkDB[PokIdToName[user_pok[Pok.ID]].capitalize()]['abilities']).upper()
             except Exception:
                 ability = AbilityNames[user_pok[Pok.AB_ID]]
         max_rand = 5
         rand = np.full((4, max_rand, 2), np.nan)
+        # Flag scores of this matchup, shared by every TrainerAI of the battle (its damage matrix)
+        flags = order = None
+        if slots is not None:
+            order = self.speed_order(ai_pok, user_pok)
+            flags = self.flag_cache(slots, ability, order, ai_pok, user_pok, user_party_alive, turn)
         max_damage = 0
         # Moves to not consider in damage calc
         # mov_excep = ['Razor Wind', 'Sky Attack', 'Recharge', 'Hyper Beam', 'Giga Impact',
@@ -639,7 +736,10 @@ class TrainerAI:
             if move[Move.ID] == 0:
                 break
             score = 0
-            final_damage, _ = calculate_damage(ai_pok, user_pok, move)
+            if slots is None:
+                final_damage, _ = calculate_damage(ai_pok, user_pok, move, rng=self.rng)
+            else:
+                final_damage, _ = self.dmg_matrix.damage(slots[0], i, slots[1], ai_pok, user_pok, rng=self.rng)
             effectiveness = get_type_effectiveness(
                 move[Move.TYPE],
                 user_pok[Pok.TYPE1],
@@ -647,12 +747,18 @@ class TrainerAI:
             )
             eval_atk, rand = self.evaluate_attack_flag(final_damage, effectiveness, user_pok, move, i, rand)
             score += eval_atk
-            score += self.basic_flag(
-                move, ability, ai_pok, user_pok, effectiveness, user_party_alive, ai_party_alive, turn
-            )
-            expert, rand = self.expert_flag(
-                final_damage, effectiveness, ai_pok, user_pok, move, ai_party_alive, user_party_alive, turn, i, rand
-            )
+            if flags is None:
+                score += self.basic_flag(
+                    move, ability, ai_pok, user_pok, effectiveness, user_party_alive, ai_party_alive, turn
+                )
+                expert, rand = self.expert_flag(
+                    final_damage, effectiveness, ai_pok, user_pok, move, ai_party_alive, user_party_alive, turn, i, rand
+                )
+            else:
+                expert, rand = self.cached_flags(
+                    flags, order, move, ability, ai_pok, user_pok, effectiveness, user_party_alive, ai_party_alive,
+                    turn, i, rand
+                )
             score += expert
 
             # Find max damage among best moves
@@ -660,7 +766,7 @@ class TrainerAI:
                 max_damage = final_damage
 
             # TODO: Finish expert flag
-            score += batch_independent_score_from_rand(rand, i)
+            score += batch_independent_score_from_rand(rand, i, self.rng)
 
             move_scores[i] = {"score": score, "dmg": final_damage, "idx": i}
 
@@ -675,23 +781,23 @@ class TrainerAI:
 
         return move_scores
 
-    def return_idx(self, ai_pok, user_pok, user_party, ai_party, turn):
+    def return_idx(self, ai_pok, user_pok, user_party, ai_party, turn, slots=None):
         """
         It transform the highest moving score to the index of the move
         """
         move_scores= self.choose_move(
-            ai_pok, user_pok, user_party, ai_party, turn
+            ai_pok, user_pok, user_party, ai_party, turn, slots
         )
         max_score = max(info["score"] for info in move_scores.values())
         best_moves = [info for info in move_scores.values() if info["score"] == max_score]
         if len(best_moves) == 1:
             idx = best_moves[0]['idx']
         else:
-            choice = random.choice(best_moves)
+            choice = self.rng.choice(best_moves)
             idx = choice['idx']
         return idx
 
-    def sub_after_death(self, ai_party, user_pok, deadmon) -> int:
+    def sub_after_death(self, ai_party, user_pok, deadmon, user_slot=None) -> int:  # pylint: disable=W0613
         """
         Implements the switch-in logic
 
@@ -709,6 +815,8 @@ class TrainerAI:
           (use calculate_damage). Apply the "255 overflow" rule: if damage > 255 -> damage = damage - 255.
           * Choose teammate with highest such max move damage. Ties broken by party order.
 
+        user_slot is the slot of user_pok in the battle array (0..5), when given the damage comes from the damage matrix
+
         Returns:
         -------
                 index of chosen teammate in ai_party (int) or None if no valid candidate.
@@ -750,6 +858,7 @@ class TrainerAI:
                 return phase1[0][0]
             scored = []
             for idx, mon in phase1:
+                total = 0
                 type1 = mon[Pok.TYPE1]
                 # single-typed counted twice
                 type2 = mon[Pok.TYPE2] if mon[Pok.TYPE2] != 0 else mon[Pok.TYPE1]
@@ -769,14 +878,17 @@ class TrainerAI:
         for idx in candidates:
             mon = ai_party[(off*idx):(off*(idx + 1))]
             max_move_dmg = 0
-            m1 = pok[Pok.MOVE1_ID:Pok.MOVE2_ID]
-            m2 = pok[Pok.MOVE2_ID:Pok.MOVE3_ID]
-            m3 = pok[Pok.MOVE3_ID:Pok.MOVE4_ID]
-            m4 = pok[Pok.MOVE4_ID:Pok.ITEM_ID]
-            for mv in (m1, m2, m3, m4):
+            m1 = mon[Pok.MOVE1_ID:Pok.MOVE2_ID]
+            m2 = mon[Pok.MOVE2_ID:Pok.MOVE3_ID]
+            m3 = mon[Pok.MOVE3_ID:Pok.MOVE4_ID]
+            m4 = mon[Pok.MOVE4_ID:Pok.ITEM_ID]
+            for i, mv in enumerate((m1, m2, m3, m4)):
                 # build move object shape expected by calculate_damage
                 try:
-                    raw_dmg, _ = calculate_damage(deadmon, user_pok, mv, roll_multiplier=1)
+                    if user_slot is None:
+                        raw_dmg, _ = calculate_damage(mon, user_pok, mv, roll_multiplier=1)
+                    else:
+                        raw_dmg, _ = self.dmg_matrix.damage(idx + 6, i, user_slot, mon, user_pok, roll_multiplier=1)
                 except Exception:
                     # if damage calc fails, skip move
                     continue
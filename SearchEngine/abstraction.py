@@ -0,0 +1,45 @@
+"""
+State abstractions of the search: a function of a GameState to the key of its bucket, the states of a bucket share
+one node (transposition table and the outcomes of an action). A coarser key makes a smaller tree that is less
+precise. Every key keeps what the legal actions depend on (actives, phase and who is alive), so the actions of a
+node hold for every state in its bucket.
+An abstraction has to be picklable for parallel_mcts, so parameters go in a class (see HpBuckets)
+"""
+import numpy as np
+from Models.idx_const import Dyn, Pok, POK_LEN, DYN_POK_LEN
+from Models.battle_table import state_key
+
+# Dynamic array index of the current HP of every slot, battle array index of its max HP
+HP_IDX = np.arange(12) * DYN_POK_LEN + Dyn.CURRENT_HP
+MAX_HP_IDX = np.arange(12) * POK_LEN + Pok.MAX_HP
+
+
+def exact_key(state) -> int:
+    """Exact state, the default: only the same position shares a node"""
+    return state.key
+
+
+class HpBuckets:
+    """Exact state but the HP rounded up to percent% of max HP (a fainted Pokemon stays at 0)"""
+    def __init__(self, percent=10):
+        self.percent = percent
+
+    def __call__(self, state) -> int:
+        dyn = state.dyn
+        dyn[HP_IDX] = np.ceil(dyn[HP_IDX] / np.maximum(state.table.base[MAX_HP_IDX], 1) * 100 / self.percent)
+        return state_key(dyn)
+
+
+def status_key(state) -> tuple:
+    """
+    Turn and phase (so a bucket is never its own descendant), actives and their status and volatile status, and who
+    is alive: HP, stages and the field are ignored
+    """
+    my_slot, opp_slot = state.slots()
+    my_block, opp_block = state.get_dyn(my_slot), state.get_dyn(opp_slot)
+    return (
+        float(state.turn), float(state.phase), my_slot, opp_slot,
+        float(my_block[Dyn.STATUS]), float(my_block[Dyn.VOL_STATUS]),
+        float(opp_block[Dyn.STATUS]), float(opp_block[Dyn.VOL_STATUS]),
+        tuple(bool(state.hp(slot) > 0) for slot in range(12))
+    )
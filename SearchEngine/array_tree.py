@@ -0,0 +1,159 @@
+"""
+Struct of arrays MCTS tree for the open loop mode: one row per node in growable NumPy buffers
+(statistics, parent, action code and the child row of every action code), freed rows are reused through a free list.
+A node is a few dozen bytes and the whole tree is a handful of arrays, so it can be saved or sent as is
+"""
+import math
+import numpy as np
+from Models.helper import N_ACTIONS
+
+NO_NODE = -1
+
+
+def wilson_lower_bounds(wins, total, z=1.96) -> np.ndarray:
+    """Wilson score interval lower bound of every wins / total (total > 0)"""
+    phat = wins / total
+    denominator = 1 + z**2 / total
+    center = phat + z**2 / (2 * total)
+    spread = z * np.sqrt((phat * (1 - phat) + z**2 / (4 * total)) / total)
+    return (center - spread) / denominator
+
+
+class ArrayTree():
+    """
+    Open loop tree (statistics of action sequences, see OpenNode) stored as columns, action holds action codes and
+    child_rows[node, code] the child of node for an action code (NO_NODE if never expanded), so the children of a
+    node are read with a single index. win_chance and dead_avg hold the Wilson best child values, kept up to date by
+    backpropagate
+    """
+    FIELDS = (  # (name, dtype, fill, shape of a row)
+        ('visits', np.int64, 0, ()),
+        ('total_value', np.float64, 0, ()),
+        ('wins', np.int64, 0, ()),
+        ('dead', np.int64, 0, ()),
+        ('win_chance', np.float64, 0, ()),
+        ('dead_avg', np.float64, 0, ()),
+        ('parent', np.int32, NO_NODE, ()),
+        ('action', np.int8, NO_NODE, ()),
+        ('child_rows', np.int32, NO_NODE, (N_ACTIONS,)),
+    )
+
+    def __init__(self, capacity=1024):
+        for name, dtype, fill, shape in self.FIELDS:
+            setattr(self, name, np.full((capacity, *shape), fill, dtype=dtype))
+        self.size = 0  # Rows ever used, free ones included
+        self.free = []
+        self.root = self.new_node(NO_NODE, NO_NODE)
+
+    def _grow(self):
+        capacity = 2 * len(self.visits)
+        for name, dtype, fill, shape in self.FIELDS:
+            column = np.full((capacity, *shape), fill, dtype=dtype)
+            column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+
+    def new_node(self, parent, code) -> int:
+        """Row of a new node, a free one if there's any"""
+        if self.free:
+            node = self.free.pop()
+        else:
+            if self.size == len(self.visits):
+                self._grow()
+            node = self.size
+            self.size += 1
+        for name, _, fill, _ in self.FIELDS:
+            getattr(self, name)[node] = fill
+        self.parent[node] = parent
+        self.action[node] = code
+        return node
+
+    def add_child(self, node, code) -> int:
+        """New child of node for the action code"""
+        child = self.new_node(node, code)
+        self.child_rows[node, code] = child
+        return child
+
+    def children(self, node) -> list:
+        """Rows of the children of node, by action code"""
+        rows = self.child_rows[node]
+        return rows[rows != NO_NODE].tolist()
+
+    def child(self, node, code) -> int:
+        """Child of node for the action code, NO_NODE if it was never expanded"""
+        return int(self.child_rows[node, code])
+
+    def select(self, node, codes, rng, c=0.4) -> tuple:
+        """
+        (best child by UCB, []) among the children of the legal action codes, or (NO_NODE, untried codes) when
+        some legal action has no child yet
+        """
+        rows = self.child_rows[node, codes]
+        if not codes or NO_NODE in rows:
+            return NO_NODE, [code for code, row in zip(codes, rows.tolist()) if row == NO_NODE]
+        visits = self.visits[rows]
+        parent_visits = self.visits[node]
+        log_parent_visits = math.log(parent_visits) if parent_visits > 1 else 0.0
+        ucb = self.total_value[rows] / visits + c * np.sqrt(2 * log_parent_visits / visits)
+        best = np.flatnonzero(ucb == ucb.max())
+        return int(rows[best[0] if len(best) == 1 else rng.choice(best)]), []
+
+    def propagate(self, node, min_visits=70):
+        """propagate_stable_values of node, for every child at once"""
+        if self.visits[node] < min_visits:  # None of its children has more visits than it
+            return
+        rows = self.child_rows[node]
+        rows = rows[(rows != NO_NODE) & (self.visits[rows] >= min_visits)]
+        if not len(rows):
+            return
+        visits = self.visits[rows]
+        wins = self.wins[rows]
+        avg_dead = np.where(wins > 0, self.dead_avg[rows], np.inf)
+        score = wilson_lower_bounds(wins, visits) - np.where(wins > 0, 0.01 * avg_dead, 0)
+        best = int(np.argmax(score))
+        self.win_chance[node] = self.win_chance[rows[best]]
+        self.dead_avg[node] = avg_dead[best]
+
+    def backpropagate(self, path, samples, value, win, dead):
+        """Add the rollout result to the nodes of path (root first), then propagate them leaf first"""
+        rows = np.array(path, dtype=np.intp)
+        self.visits[rows] += samples
+        self.total_value[rows] += value
+        self.wins[rows] += win
+        self.dead[rows] += dead if win else 0
+        wins = self.wins[rows]
+        self.dead_avg[rows] = np.where(wins > 0, self.dead[rows] / np.maximum(wins, 1), 0)
+        self.win_chance[rows] = wins / self.visits[rows]
+        for node in reversed(path):
+            self.propagate(node)
+
+    def reroot(self, node):
+        """Make node the root, every row out of its subtree goes to the free list"""
+        keep = np.zeros(self.size, dtype=bool)
+        level = np.array([node])
+        while len(level):
+            keep[level] = True
+            level = self.child_rows[level].ravel()
+            level = level[level != NO_NODE]
+        keep[self.free] = True  # Already free
+        self.free.extend(np.flatnonzero(~keep).tolist())
+        self.parent[node] = NO_NODE
+        self.root = node
+        return self
+
+    def buffers(self) -> dict:
+        """The tree as raw arrays (np.savez or send them), see from_buffers"""
+        out = {name: getattr(self, name)[:self.size] for name, _, _, _ in self.FIELDS}
+        out['root'] = np.array(self.root)
+        out['free'] = np.array(self.free, dtype=np.int64)
+        return out
+
+    @classmethod
+    def from_buffers(cls, buffers):
+        """Tree of buffers"""
+        tree = cls.__new__(cls)
+        for name, dtype, _, _ in cls.FIELDS:
+            setattr(tree, name, np.array(buffers[name], dtype=dtype))
+        tree.size = len(tree.visits)
+        tree.free = [int(i) for i in buffers['free']]
+        tree.root = int(buffers['root'])
+        return tree
@@ -8,9 +8,11 @@ from datetime import datetime
 from pathlib import Path
 from collections import deque
 from dataclasses import dataclass
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Optional
 import numpy as np
 import h5py
+from Models.helper import N_ACTIONS
+from Utils.rng import get_rng
 from SearchEngine.helper import create_random_initial_state
 
 
@@ -18,8 +20,8 @@ from SearchEngine.helper import create_random_initial_state
 class GamePosition:
     """Single position from a game"""
     state: np.ndarray  # Battle array
-    valid_actions: List[Tuple[str, int]]  # Legal moves
-    action_probs: Dict[Tuple[str, int], float]  # MCTS visit distribution
+    valid_actions: List[int]  # Legal action codes
+    action_probs: Dict[int, float]  # MCTS visit distribution by action code
     mcts_value: float  # MCTS evaluation (-1 to 1)
     turn: int
     phase: int
@@ -159,7 +161,7 @@ class SelfPlayDataCollector:
     def add_position(
             self,
             state: np.ndarray,
-            valid_actions: List[Tuple[str, int]],
+            valid_actions: List[int],
             action_probs: Dict,
             mcts_value: float,
             mcts_iterations: int,
@@ -172,7 +174,7 @@ class SelfPlayDataCollector:
         # Create position
         position = GamePosition(
             state=state.copy(),
-            valid_actions=valid_actions.copy(),
+            valid_actions=list(valid_actions),
             action_probs=action_probs.copy(),
             mcts_value=mcts_value,
             turn=turn,
@@ -291,27 +293,29 @@ class SelfPlayDataCollector:
             with open(stats_file, 'r') as f:
                 self.stats = json.load(f)
 
-    def get_training_batch(self, batch_size: int = 512) -> Dict[str, np.ndarray]:
-        """Sample a training batch from buffer"""
+    def get_training_batch(self, batch_size: int = 512, rng=None) -> Dict[str, np.ndarray]:
+        """Sample a training batch from buffer, drawn from rng (a BattleRNG, the default stream when None)"""
 
         if len(self.position_buffer) < batch_size:
             return None
 
         # Random sample from buffer
-        indices = np.random.choice(len(self.position_buffer), batch_size, replace=False)
+        indices = get_rng(rng).generator.choice(len(self.position_buffer), batch_size, replace=False)
         batch = [self.position_buffer[i] for i in indices]
 
         # Format for neural network training
         states = np.array([p.state for p in batch])
 
-        # Create action probability targets (you'll need to encode these based on your action space)
-        # This is simplified - you'll need to map to your actual action encoding
-        action_targets = np.zeros((batch_size, 10))  # Assuming max 10 possible actions
+        # Action probability targets, indexed by action code
+        action_targets = np.zeros((batch_size, N_ACTIONS))
+        for i, position in enumerate(batch):
+            for action, prob in position.action_probs.items():
+                action_targets[i, action] = prob
         value_targets = np.array([p.discounted_outcome for p in batch])
 
         return {
             'states': states,
-            'action_targets': action_targets,  # You'll need to properly encode these
+            'action_targets': action_targets,
             'value_targets': value_targets,
             'mcts_values': np.array([p.mcts_value for p in batch])  # For comparison
         }
@@ -382,34 +386,31 @@ class IterativeTrainingManager:
 def run_self_play_game(
         collector: SelfPlayDataCollector,
         initial_state,
-        mcts_iterations: int = 800
+        mcts_iterations: int = 800,
+        rng=None
 ):
-    """Run one self-play game with data collection"""
+    """Run one self-play game with data collection, a battle array initial_state is played with rng (a BattleRNG)"""
 
-    from SearchEngine.my_mcts import mcts, GameState, Node  # pylint:disable=(C0415,W0611)
+    from SearchEngine.my_mcts import mcts, GameState, reroot  # pylint:disable=C0415
 
     # Start new game
     collector.start_game()
 
-    state = initial_state
+    state = initial_state if isinstance(initial_state, GameState) else GameState(initial_state, rng=rng)
     turn = 0
+    root = None
 
     while not state.is_terminal():
-        # Run MCTS
-        root = Node(state)
+        # Run MCTS, going on from the subtree of the last search when the position was reached there
+        root = mcts(state, mcts_iterations, training=True, tree=root)
 
-        # Your MCTS implementation
-        for _ in range(mcts_iterations):
-            # ... MCTS iterations
-            pass
-
-        # Collect position data
+        # Collect position data, from the edge visits: the outcome nodes are shared with other parents
         action_probs = {}
-        total_visits = sum(sum(n.visits for n in nodes) for nodes in root.children.values())
+        edges = root.edge_stats()
+        total_visits = sum(edge.visits for edge in edges.values())
 
-        for action, nodes in root.children.items():
-            visits = sum(n.visits for n in nodes)
-            action_probs[action] = visits / total_visits if total_visits > 0 else 0
+        for action, edge in edges.items():
+            action_probs[action] = edge.visits / total_visits if total_visits > 0 else 0
 
         # Add position to collector
         collector.add_position(
@@ -423,12 +424,13 @@ def run_self_play_game(
             phase=state.phase
         )
 
-        # Select action (sample from distribution for training diversity)
+        # Select action (sample from distribution for training diversity), from the game's own stream so a seeded
+        # game is played again the same
         if action_probs:
-            actions = list(action_probs.keys())
-            probs = list(action_probs.values())
-            selected_action = np.random.choice(len(actions), p=probs)
-            state = state.step(actions[selected_action-1])
+            selected_action = state.rng.choices(list(action_probs), list(action_probs.values()))
+            next_state = state.step(selected_action)
+            root = reroot(root, selected_action, next_state)
+            state = next_state
         else:
             break
 
@@ -4,7 +4,7 @@ import copy
 import numpy as np
 from DataBase.pok_sets import charmander, squirtle, bulbasaur
 from Utils.helper import to_battle_array
-from Models.idx_const import Pok
+from Engine.batch_battle import BatchBattle, damage_tables
 
 
 def create_random_initial_state():
@@ -24,67 +24,16 @@ def create_random_initial_state():
     return battle_array
 
 
-def multiple_nodes(child, new_state):
-    """Check to see if the current state needs to create a new node"""
-    for c in child:
-        c_my_active = c.state.get_my_active()
-        c_opp_active = c.state.get_opp_active()
-        new_my = new_state.get_my_active()
-        new_opp = new_state.get_opp_active()
-        has_phase = False
-        has_same_opp = False
-        my_status = False
-        opp_status = False
-        my_vol = False
-        opp_vol = False
-        # my_stat = False
-        # opp_stat = False
-        # Check to see if already considered that my pok died
-        if c.state.phase == new_state.phase:
-            # c.state = new_state
-            # node = c
-            has_phase = True
-        # Check to see if already considered opp died
-        if c.state.opp_active == new_state.opp_active:
-            has_same_opp = True
-        # Check to see if i got a different status
-        if c_my_active[Pok.STATUS] == new_my[Pok.STATUS]:
-            my_status = True
-        # Check to see if the opp got a different status
-        if c_opp_active[Pok.STATUS] == new_opp[Pok.STATUS]:
-            opp_status = True
-        # Check to see if i got a different vol_status
-        if c_my_active[Pok.VOL_STATUS] == new_my[Pok.VOL_STATUS]:
-            my_vol = True
-        # Check to see if the opp got a different vol_status
-        if c_opp_active[Pok.VOL_STATUS] == new_opp[Pok.VOL_STATUS]:
-            opp_vol = True
-        '''# Check to see if i got a different vol_status
-        if np.array_equal(
-            c_my_active[Pok.ATTACK_STAT_STAGE:Pok.EVASION_STAT_STAGE+1],
-            new_my[Pok.ATTACK_STAT_STAGE:Pok.EVASION_STAT_STAGE+1]
-        ):
-            my_stat = True
-        # Check to see if the opp got a different vol_status
-        if np.array_equal(
-            c_opp_active[Pok.ATTACK_STAT_STAGE:Pok.EVASION_STAT_STAGE+1],
-            new_opp[Pok.ATTACK_STAT_STAGE:Pok.EVASION_STAT_STAGE+1]
-        ):
-            opp_stat = True'''
-
-        # Found Node that fits
-        if all((has_phase, has_same_opp, my_status, opp_status, opp_vol, my_vol)):
-            c.state = new_state
-            node = c
-            return node
-
-    return None
-
-
-def batch_rollouts(sim_state):
-    """Batch rollouts so i can simulate through multiples battles at once"""
-    batch_size = 2
-    batch = np.tile(sim_state.battle_array, (batch_size, 1))
-    hit_rolls = np.random.randint(1, 101, batch_size)
-    crit_rolls = np.random.randint(1, 17, batch_size)
-    return batch, hit_rolls, crit_rolls
+def batch_rollouts(sim_state, batch_size=256, max_depth=100, rng=None, battle_array=None, heuristic_prob=0.0):
+    """Batch rollouts so i can simulate through multiples battles at once,
+    returns the (batch_size, len(battle_array)) batch at the end of the playouts.
+    rng is a NumPy Generator, default is the generator behind the state stream.
+    battle_array is the position to play from, default the state one.
+    heuristic_prob is the share of my turns played with rollout_pref (see BatchBattle.run), 0 is all random.
+    The damage numbers come from the DamageTables of the state damage matrix, built on the first batch of a battle"""
+    start = sim_state.battle_array if battle_array is None else battle_array
+    batch = np.tile(start, (batch_size, 1))
+    engine = BatchBattle(
+        batch, rng=sim_state.rng.generator if rng is None else rng, tables=damage_tables(sim_state.dmg_matrix, start)
+    )
+    return engine.run(max_depth, heuristic_prob)
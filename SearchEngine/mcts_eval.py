@@ -1,10 +1,24 @@
 """Evaluation of terminal and current state"""
-import random
+import math
+import numpy as np
 from Models.idx_const import(
-    Pok, Sec, POK_LEN, OFFSET_MOVE, MOVE_STRIDE
+    Pok, Move, Sec, POK_LEN, OFFSET_MOVE, MOVE_STRIDE
 )
-from Models.helper import count_party, count_Id
-from Engine.damage_calc import calculate_damage
+from Models.helper import count_party, count_Id, SWITCH_OFFSET, N_ACTIONS, MASK_BITS
+from Engine.damage_calc import calculate_damage, DAMAGE_ROLLS
+from Utils.rng import get_rng
+from Utils.cache import LRUCache, PerBattle
+
+# Fields of an active the rollout weights depend on (besides its slot and HP), part of their cache key
+WEIGHT_KEY_FIELDS = np.array([
+    Pok.SPEED, Pok.SPEED_STAT_STAGE, Pok.ATTACK_STAT_STAGE, Pok.DEFENSE_STAT_STAGE, Pok.SPECIAL_ATTACK_STAT_STAGE,
+    Pok.SPECIAL_DEFENSE_STAT_STAGE, Pok.STATUS
+])
+# HP of the rollout weights cache key, in buckets of WEIGHT_HP_BUCKET% of max HP (a fainted Pokemon stays at 0)
+WEIGHT_HP_BUCKET = 10
+# Cached rollout weights of each battle, dropped with its damage matrix, the least recently used go past the size
+WEIGHT_CACHE_SIZE = 1 << 14
+_WEIGHTS = PerBattle(lambda: LRUCache(WEIGHT_CACHE_SIZE))
 
 
 def party_hp_fraction(battle_array, offset, maxp):
@@ -36,11 +50,13 @@ def evaluate_terminal(sim_state) -> tuple[float, int, int]:
     - Win  => +1
     - Loss => 0
     - draw => 0
+    sim_state can also be a battle array
     """
+    battle_array = sim_state if isinstance(sim_state, np.ndarray) else sim_state.battle_array
     # quick terminal check
-    my_pty_count = count_Id(sim_state.battle_array[0:(6 * POK_LEN)])
-    my_alive = count_party(sim_state.battle_array[0:(6 * POK_LEN)])
-    opp_alive = count_party(sim_state.battle_array[(6 * POK_LEN):(12 * POK_LEN)])
+    my_pty_count = count_Id(battle_array[0:(6 * POK_LEN)])
+    my_alive = count_party(battle_array[0:(6 * POK_LEN)])
+    opp_alive = count_party(battle_array[(6 * POK_LEN):(12 * POK_LEN)])
     dead = my_pty_count - my_alive
     if dead:
         win_value = (my_alive / my_pty_count)* 0.8
@@ -54,39 +70,91 @@ def evaluate_terminal(sim_state) -> tuple[float, int, int]:
 
     # Fallback to if the game haven't finished yet, but max depth reached
     return 0.2, 0, dead
+
+
+def evaluate_batch(batch) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """evaluate_terminal of every row of a (n, len(battle_array)) batch, as (values, wins, dead) arrays"""
+    hp = batch[:, Pok.CURRENT_HP:(12 * POK_LEN):POK_LEN]
+    my_pty_count = np.count_nonzero(batch[:, Pok.ID:(6 * POK_LEN):POK_LEN] > 0, axis=1)
+    my_alive = np.count_nonzero(hp[:, :6] > 0, axis=1)
+    opp_alive = np.count_nonzero(hp[:, 6:] > 0, axis=1)
+    dead = my_pty_count - my_alive
+    win_value = np.where(dead > 0, (my_alive / my_pty_count) * 0.8, 1.0)
+    win = (opp_alive == 0) & (my_alive > 0)
+    values = np.where(win, win_value, np.where(my_alive == 0, 0.0, 0.2))
+    return values, win.astype(np.int64), dead
     #  raise ValueError("Shouldn't get here")
 
 
-def rollout_pref(c_pok, o_pok, o_idx, actions) -> tuple:
-    """Prefer certain moves to reduce noise"""
-    ev = []
-
-    for a in actions:
-        o_move = o_pok[OFFSET_MOVE + o_idx * MOVE_STRIDE: OFFSET_MOVE + o_idx * MOVE_STRIDE + MOVE_STRIDE]
-        o_dmg, _ = calculate_damage(o_pok, c_pok, o_move)
-        weight = 1
-        if a[0] == 'move':
-            move = c_pok[OFFSET_MOVE + a[1] * MOVE_STRIDE: OFFSET_MOVE + a[1] * MOVE_STRIDE + MOVE_STRIDE]
-            dmg, _ = calculate_damage(c_pok, o_pok, move)
-            if (
-                dmg >= o_pok[Pok.CURRENT_HP]
-                and (
-                    c_pok[Pok.SPEED] > o_pok[Pok.SPEED]
-                    or o_dmg < c_pok[Pok.CURRENT_HP]
-                )
-            ):
-                weight += 100
-            if move[Sec.CHANCE]:
-                weight += 10
-        else:
-            # Need to work on that, because it needs to be way more complex, maybe??
-            if (
-                o_dmg >= c_pok[Pok.CURRENT_HP]
-                and (
-                    o_pok[Pok.SPEED] >= c_pok[Pok.SPEED]
-                )
-            ):
-                weight += 50
-        ev.append((a, weight))
-
-    return random.choices([e[0] for e in ev], weights=[e[1] for e in ev])[0]
+def rollout_pref(c_pok, o_pok, o_idx, legal, dmg_matrix=None, slots=None, rng=None) -> int:
+    """
+    Prefer certain moves to reduce noise, legal being the mask of the legal actions (see Models.helper.legal_mask).
+    slots is (my slot, opp slot) when using the damage matrix, the weights are then cached (see rollout_weights)
+    """
+    if dmg_matrix is None or slots is None:
+        weights = _rollout_weights(c_pok, o_pok, o_idx)
+    else:
+        weights = rollout_weights(c_pok, o_pok, o_idx, dmg_matrix, slots)
+    return sample_action(weights, legal, rng)
+
+
+def sample_action(weights, legal, rng=None) -> int:
+    """Action code drawn with weights (N_ACTIONS of them) among the actions of the legal mask"""
+    cumulative = np.cumsum(weights * MASK_BITS[legal])
+    return int(np.searchsorted(cumulative, get_rng(rng).random() * cumulative[-1], side='right'))
+
+
+def rollout_weights(c_pok, o_pok, o_idx, dmg_matrix, slots) -> np.ndarray:
+    """
+    rollout_pref weights of every action code, cached per battle (damage matrix) by active pair, opponent move, the
+    HP bucket (WEIGHT_HP_BUCKET) and the speed, stages and status of both actives: the states of a bucket share the
+    weights of the first one of them that got here
+    """
+    cache = _WEIGHTS.get(dmg_matrix)
+    key = (
+        slots, o_idx, _hp_bucket(c_pok), _hp_bucket(o_pok),
+        c_pok[WEIGHT_KEY_FIELDS].tobytes(), o_pok[WEIGHT_KEY_FIELDS].tobytes()
+    )
+    weights = cache.get(key)
+    if weights is None:
+        weights = cache.put(key, _rollout_weights(c_pok, o_pok, o_idx, dmg_matrix, slots))
+    return weights
+
+
+def _hp_bucket(pok) -> int:
+    """HP rounded up to WEIGHT_HP_BUCKET% of max HP, 0 only when fainted"""
+    return math.ceil(pok[Pok.CURRENT_HP] * 100 / (WEIGHT_HP_BUCKET * max(pok[Pok.MAX_HP], 1)))
+
+
+def _rollout_weights(c_pok, o_pok, o_idx, dmg_matrix=None, slots=None) -> np.ndarray:
+    """
+    Weight of each action: a move that knocks the opponent out before it can answer gets +100 (times the chance
+    of it over the damage rolls), one with a secondary effect +10, and a switch +50 times the chance the faster
+    opponent knocks my active out. Empty move slots are left to the legal mask
+    """
+    o_ko = _ko_chance(o_pok, c_pok, o_idx, dmg_matrix, None if slots is None else (slots[1], slots[0]))
+    faster = c_pok[Pok.SPEED] > o_pok[Pok.SPEED]
+    weights = np.ones(N_ACTIONS)
+    for i in range(4):
+        move = c_pok[OFFSET_MOVE + i * MOVE_STRIDE: OFFSET_MOVE + i * MOVE_STRIDE + MOVE_STRIDE]
+        if not move[Move.ID]:
+            continue
+        ko = _ko_chance(c_pok, o_pok, i, dmg_matrix, slots)
+        weights[i] += 100 * ko * (1 if faster else 1 - o_ko)
+        if move[Sec.CHANCE]:
+            weights[i] += 10
+    # Need to work on that, because it needs to be way more complex, maybe??
+    if o_pok[Pok.SPEED] >= c_pok[Pok.SPEED]:
+        weights[SWITCH_OFFSET:] += 50 * o_ko
+    return weights
+
+
+def _ko_chance(attacker, defender, move_idx, dmg_matrix=None, slots=None) -> float:
+    """Chance a non crit hit of the move knocks the defender out, over the damage rolls"""
+    if dmg_matrix is None:
+        start = OFFSET_MOVE + move_idx * MOVE_STRIDE
+        damage, _ = calculate_damage(attacker, defender, attacker[start:start + MOVE_STRIDE], False, DAMAGE_ROLLS)
+        damage = np.broadcast_to(damage, DAMAGE_ROLLS.shape)
+    else:
+        damage = dmg_matrix.rolls(slots[0], move_idx, slots[1], attacker, defender)
+    return np.count_nonzero(damage >= defender[Pok.CURRENT_HP]) / len(DAMAGE_ROLLS)
@@ -8,65 +8,126 @@ MCTS expands the tree by adding child nodes representing possible future actions
 estimating its potential value.
 4. Backpropagation: The results of the simulation are then propagated up the tree…"""
 import math
-import builtins
-import random
+import os
+import time
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List, Tuple
 from types import SimpleNamespace
 import numpy as np
 from Models.idx_const import (
-    Pok, Field, POK_LEN, MOVE_STRIDE
+    Pok, Field, Dyn, POK_LEN, MOVE_STRIDE
 )
-from Models.helper import count_party
+from Models.helper import BattlePhase, SWITCH_OFFSET, MASK_ACTIONS, legal_mask, action_name
+from Models.battle_table import StaticTable, FIELD_BLOCK, state_key, update_key
 from Models.trainer_ai import TrainerAI
-from Engine.new_battle import Battle
-from SearchEngine.mcts_eval import evaluate_terminal, rollout_pref
-from SearchEngine.helper import multiple_nodes
+from Utils.rng import get_rng
+from Engine.damage_calc import DamageMatrix
+from Engine.new_battle import apply_turn, undo, turn_outcomes, iter_turn_paths
+from SearchEngine.mcts_eval import evaluate_terminal, evaluate_batch, rollout_pref
+from SearchEngine.helper import batch_rollouts
+from SearchEngine.abstraction import exact_key
+from SearchEngine.array_tree import ArrayTree, NO_NODE
+
+
+# Visits put on a path while a thread plays it (threaded_mcts), it reads as a loss until the result is in
+VIRTUAL_LOSS = 1
+# Share of my rollout turns played with rollout_pref from a leaf, the same for one rollout or a batch of them
+LEAF_HEURISTIC_PROB = 0.3
+
+# Solver flag of a node or an edge: its result is known whatever the chance and the moves below it
+Proof = SimpleNamespace(
+    UNKNOWN = 0,
+    WIN = 1,
+    LOSS = -1
+)
 
 
-ActionType = SimpleNamespace(
-    MOVE = "move",
-    SWITCH = "switch"
-)
 
+def battle_over(battle_array) -> bool:
+    """is_terminal of a battle array"""
+    hp = battle_array[Pok.CURRENT_HP:(12 * POK_LEN):POK_LEN]
+    return not (hp[:6] > 0).any() or not (hp[6:] > 0).any()
 
-BattlePhase = SimpleNamespace(
-    TURN_START = 0,
-    DEATH_END_OF_TURN = 1
-)
 
+def legal_actions(battle_array) -> Tuple[int, ...]:
+    """get_valid_actions of a battle array, for my side"""
+    return MASK_ACTIONS[legal_mask(battle_array)]
+
+
+def trainer_move(opp_ai, battle_array) -> int:
+    """Move the trainer AI picks for the opponent active of a battle array"""
+    my_slot = int(battle_array[Field.MY_POK])
+    opp_slot = int(battle_array[Field.OPP_POK]) + 6
+    return opp_ai.return_idx(
+        battle_array[(opp_slot * POK_LEN):((opp_slot + 1) * POK_LEN)],
+        battle_array[(my_slot * POK_LEN):((my_slot + 1) * POK_LEN)],
+        battle_array[0:(6 * POK_LEN)],
+        battle_array[(6 * POK_LEN):(12 * POK_LEN)],
+        battle_array[Field.TURN],
+        (opp_slot, my_slot)
+    )
 
 
 class GameState():
-    """Screenshot of the current gamestate"""
+    """
+    Screenshot of the current gamestate, only the dynamic fields (see Dyn), the static table is shared.
+    The dynamic fields are kept as read only blocks (one per party slot, then the field), so a state
+    shares with its parent every block the turn didn't write to.
+    rng is the random stream of the search, shared like the damage matrix so a seeded search is reproducible.
+    key is the hash of the dynamic fields (see state_key), kept up to date turn by turn from the undo logs.
+    A state never changes, so its legal action masks and alive counts are computed once and kept
+    """
     __slots__ = (
-        'battle_array', 'my_active', 'opp_active', 'turn', 'phase', '_opp_ai', '_opp_move'
+        'table', 'blocks', 'my_active', 'opp_active', 'turn', 'phase', '_opp_ai', '_opp_move', 'dmg_matrix', 'rng', 'key',
+        '_masks', '_alive'
     )
-    def __init__(self, battle_array, share_array=False):
-        if share_array:
-            self.battle_array = battle_array
-        else:
-            self.battle_array = np.copy(battle_array)
-        self.my_active = int(self.battle_array[Field.MY_POK])  # Index of 0..5
-        self.opp_active = int(self.battle_array[Field.OPP_POK])  # Index of 0..5
-        self.turn = self.battle_array[Field.TURN]
-        self.phase = self.battle_array[Field.PHASE]
+    def __init__(self, battle_array=None, dmg_matrix=None, table=None, blocks=None, rng=None, key=None):
+        # Same battle, same static data and damage numbers, so every state of a search shares them
+        self.table = StaticTable(battle_array) if table is None else table
+        self.blocks = self.table.split(battle_array) if blocks is None else blocks
+        field = self.blocks[FIELD_BLOCK]  # Indexed by Dyn - Dyn.MY_POK
+        self.my_active = int(field[0])  # Index of 0..5
+        self.opp_active = int(field[Dyn.OPP_POK - Dyn.MY_POK])  # Index of 0..5
+        self.turn = field[Dyn.TURN - Dyn.MY_POK]
+        self.phase = field[Dyn.PHASE - Dyn.MY_POK]
         self._opp_ai = None
         self._opp_move = None
+        self.dmg_matrix = DamageMatrix() if dmg_matrix is None else dmg_matrix
+        self.rng = get_rng(rng)
+        self.key = state_key(self.dyn) if key is None else key
+        self._masks = [None, None]  # Mine, opponent
+        self._alive = None
 
     @property
     def opp_ai(self):
         """Only apply Trainer AI to states that are necessary"""
         if self._opp_ai is None:
-            self._opp_ai = TrainerAI()
+            self._opp_ai = TrainerAI(dmg_matrix=self.dmg_matrix, rng=self.rng)
         return self._opp_ai
 
     @property
     def opp_move(self):
         """Only do opp ai moves when necessary"""
+        return self.get_opp_move()
+
+    def get_opp_move(self, battle_array=None):
+        """opp_move, battle_array being an array already holding this state (so it isn't loaded again)"""
         if self._opp_move is None and self.phase != BattlePhase.DEATH_END_OF_TURN:
-            self._opp_move = self.opp_move_choice()
+            self._opp_move = self.opp_move_choice(battle_array)
         return self._opp_move
 
+    @property
+    def dyn(self):
+        """Dynamic array of the state (see Dyn), a new array"""
+        return self.table.join(self.blocks)
+
+    @property
+    def battle_array(self):
+        """Full battle array of the state, it's a new array so writing to it doesn't change the state"""
+        return self.table.materialize(self.dyn)
+
     @property
     def my_pty(self):
         """My party"""
@@ -77,21 +138,35 @@ class GameState():
         """Opp party"""
         return self.battle_array[(6 * POK_LEN):(12 * POK_LEN)]
 
-    def clone(self):
-        """Clone"""
-        return GameState(self.battle_array)
+    def clone(self, rng=None):
+        """Clone, rng gives the clone (and the states after it) another random stream"""
+        clone = GameState(
+            table=self.table, blocks=self.blocks, dmg_matrix=self.dmg_matrix, rng=self.rng if rng is None else rng,
+            key=self.key
+        )
+        clone._masks = list(self._masks)  # pylint: disable=W0212
+        clone._alive = self._alive  # pylint: disable=W0212
+        return clone
+
+    def slots(self) -> Tuple[int, int]:
+        """My active and opponent active as slots of the battle array (0..11)"""
+        return self.my_active, self.opp_active + 6
+
+    def hp(self, slot: int) -> float:
+        """Current HP of slot (0..11)"""
+        return self.blocks[slot][Dyn.CURRENT_HP]
+
+    def get_dyn(self, slot: int) -> np.ndarray:
+        """Dynamic fields of slot (0..11), a read only block indexed by Dyn"""
+        return self.blocks[slot]
 
     def get_my_pokemon(self, idx: int) -> np.ndarray:
-        """Get pokemon from my party by index (0-5)"""
-        start = idx * POK_LEN
-        end = (idx + 1) * POK_LEN
-        return self.battle_array[int(start):int(end)]
+        """Get pokemon from my party by index (0-5), as a new array"""
+        return self.table.pokemon(self.blocks[int(idx)], int(idx))
 
     def get_opp_pokemon(self, idx: int) -> np.ndarray:
-        """Get pokemon from opponent party by index (0-5)"""
-        start = (6 + idx) * POK_LEN
-        end = (7 + idx) * POK_LEN
-        return self.battle_array[int(start):int(end)]
+        """Get pokemon from opponent party by index (0-5), as a new array"""
+        return self.table.pokemon(self.blocks[6 + int(idx)], 6 + int(idx))
 
     def get_my_active(self) -> np.ndarray:
         """Get my active pokemon"""
@@ -101,114 +176,234 @@ class GameState():
         """Get opponent's active pokemon"""
         return self.get_opp_pokemon(self.opp_active)
 
+    def alive(self) -> Tuple[int, int]:
+        """(my, opponent) Pokemon still standing"""
+        if self._alive is None:
+            self._alive = (
+                sum(self.hp(slot) > 0 for slot in range(6)), sum(self.hp(slot) > 0 for slot in range(6, 12))
+            )
+        return self._alive
+
     def is_terminal(self) -> bool:
         """Check if battle is over"""
-        my_alive = count_party(self.my_pty)
-        opp_alive = count_party(self.opp_pty)
-        return my_alive == 0 or opp_alive == 0
-
-    def get_valid_actions(self, is_player: bool = True) -> List[Tuple[str, int]]:
-        """Get all valid actions for current player"""
-        actions = []
-
-        # Handle death phase first and return immediately
-        if self.phase == BattlePhase.DEATH_END_OF_TURN:
-            for i in range(6):
-                pokemon = self.get_my_pokemon(i) if is_player else self.get_opp_pokemon(i)
-                if pokemon[Pok.CURRENT_HP] > 0 and i != (self.my_active if is_player else self.opp_active):
-                    actions.append((ActionType.SWITCH, i))
-            return actions  # Return here to prevent adding move actions
-
-        # Normal turn phase - get active pokemon
-        if is_player:
-            active = self.get_my_active()
-        else:
-            active = self.get_opp_active()
-
-        # Check each move slot
-        for i in range(4):
-            move_id_idx = Pok.MOVE1_ID + (i * MOVE_STRIDE)
-            if active[move_id_idx] != 0:  # Move exists
-                actions.append((ActionType.MOVE, i))
+        my_alive, opp_alive = self.alive()
+        return not my_alive or not opp_alive
+
+    def get_valid_actions(self, is_player: bool = True) -> Tuple[int, ...]:
+        """Get all valid action codes for current player"""
+        return MASK_ACTIONS[self.legal_mask(is_player)]
+
+    def legal_mask(self, is_player: bool = True) -> int:
+        """Mask of the valid actions for current player (see Models.helper.legal_mask)"""
+        mask = self._masks[0 if is_player else 1]
+        if mask is None:
+            mask = self._masks[0 if is_player else 1] = self._legal_mask(is_player)
+        return mask
+
+    def _legal_mask(self, is_player: bool) -> int:
+        mask = 0
+        side = 0 if is_player else 6
+        active = self.my_active if is_player else self.opp_active
+
+        # Moves of the active pokemon, none on the death phase
+        if self.phase != BattlePhase.DEATH_END_OF_TURN:
+            start = (side + active) * POK_LEN
+            for i in range(4):
+                move_id_idx = start + Pok.MOVE1_ID + (i * MOVE_STRIDE)
+                if self.table.base[move_id_idx] != 0:  # Move exists
+                    mask |= 1 << i
 
-        # Add switch actions for normal turn
         for i in range(6):
-            pokemon = self.get_my_pokemon(i) if is_player else self.get_opp_pokemon(i)
             # Can switch if pokemon is alive and not currently active
-            if pokemon[Pok.CURRENT_HP] > 0 and i != (self.my_active if is_player else self.opp_active):
-                actions.append((ActionType.SWITCH, i))
+            if self.hp(side + i) > 0 and i != active:
+                mask |= 1 << (SWITCH_OFFSET + i)
 
-        return actions
+        return mask
 
-    def opp_move_choice(self) -> int:
+    def opp_move_choice(self, battle_array=None) -> int:
         """Uses the trainer AI to choose the move"""
-        opp_idx = self.opp_ai.return_idx(
-            self.get_opp_active(),
-            self.get_my_active(),
-            self.battle_array[0:(6 * POK_LEN)],
-            self.battle_array[(6 * POK_LEN):(12 * POK_LEN)],
-            self.turn
+        if battle_array is None:
+            battle_array = self.table.load(self.dyn)
+        return trainer_move(self.opp_ai, battle_array)
+
+    def apply(self, battle_array, my_move_idx):
+        """Play the turn in place on battle_array, which has to hold this state, and return its undo log"""
+        opp_move_idx = self.get_opp_move(battle_array)
+        return apply_turn(battle_array, my_move_idx, opp_move_idx, self.dmg_matrix, rng=self.rng)
+
+    def child(self, battle_array, log=None):
+        """
+        State of battle_array after a turn from this state, sharing the blocks the turn didn't change.
+        log is the undo log of the turn, when given the key is updated from it instead of hashed again
+        """
+        return GameState(
+            table=self.table, blocks=self.table.split(battle_array, self.blocks, self.dyn), dmg_matrix=self.dmg_matrix,
+            rng=self.rng, key=None if log is None else update_key(self.key, log, battle_array)
         )
-        return opp_idx
 
     def step(self, my_move_idx):
-        """Simulate the entire turn"""
-        new = self.clone()
-        battle = Battle(
-            battle_array=new.battle_array
-        )
-        if new.phase == BattlePhase.DEATH_END_OF_TURN:
-            battle.end_of_turn(search=my_move_idx[1])
-            if my_move_idx[0] == "switch":
-                new.my_active = my_move_idx[1]
-                new.battle_array[Field.MY_POK] = my_move_idx[1]
-            new.phase = int(BattlePhase.TURN_START)
-            new.battle_array[Field.PHASE] = BattlePhase.TURN_START
-            return new
-        opp_move_idx = self.opp_move
-        orig_print = builtins.print
-        try:
-            builtins.print = lambda *a, **k: None
-            new.phase, opp_idx = battle.turn_sim(opp_move_idx, my_move_idx)
-            new.battle_array[Field.PHASE] = new.phase
-            if opp_idx:
-                new.opp_active = opp_idx
-            if my_move_idx[0] == 'switch':
-                new.my_active = my_move_idx[1]
-                new.battle_array[Field.MY_POK] = my_move_idx[1]
-            if new.my_active != new.battle_array[Field.MY_POK] or new.my_active >= 2:
-                pass
-        finally:
-            builtins.print = orig_print
-
-        return new
+        """Simulate the entire turn on the table scratch array, the new state only copies the blocks that changed"""
+        battle_array = self.table.load(self.dyn)
+        log = self.apply(battle_array, my_move_idx)
+        return self.child(battle_array, log)
+
+
+def enumerate_turn(state: GameState, my_action, opp_action=None) -> List[Tuple[float, GameState]]:
+    """
+    Distinct states the turn can lead to, with their exact probabilities (they add up to 1).
+    opp_action is the opponent move index, default is the one the trainer AI picks
+    """
+    battle_array = state.table.load(state.dyn)
+    if opp_action is None:
+        opp_action = state.get_opp_move(battle_array)
+    return [
+        (probability, state.child(outcome))
+        for probability, outcome in turn_outcomes(battle_array, my_action, opp_action, state.dmg_matrix)
+    ]
+
+
+def iter_turn_ends(state: GameState, my_action):
+    """
+    Battle array at the end of every chance path of the turn, against any move of the opponent active (the trainer
+    AI picks one of them) so a proof over them holds whatever the AI does. Lazy, each array only holds its path until
+    the next one
+    """
+    battle_array = state.battle_array  # Its own array, the scan can be resumed any time later
+    if state.phase == BattlePhase.DEATH_END_OF_TURN:
+        opp_moves = (None,)
+    else:
+        opp_moves = [code for code in state.get_valid_actions(is_player=False) if code < SWITCH_OFFSET]
+    for opp_move in opp_moves:
+        for _, outcome in iter_turn_paths(battle_array, my_action, opp_move, state.dmg_matrix):
+            yield outcome
+
+
+def iter_outcomes(state: GameState, my_action, abstraction=exact_key):
+    """(bucket key, state) at the end of every chance path of the turn (see iter_turn_ends), keys can repeat"""
+    for outcome in iter_turn_ends(state, my_action):
+        child = state.child(outcome)
+        yield abstraction(child), child
+
+
+def terminal_proof(state: GameState) -> int:
+    """Proof of a state, WIN or LOSS once the battle is over"""
+    if not state.is_terminal():
+        return Proof.UNKNOWN
+    return Proof.WIN if state.alive()[0] else Proof.LOSS
+
+
+def turn_proof(state: GameState, my_action) -> int:
+    """WIN or LOSS when every end of the turn (see iter_turn_ends) is a battle over the same way, else UNKNOWN"""
+    proof = Proof.UNKNOWN
+    for outcome in iter_turn_ends(state, my_action):
+        if not battle_over(outcome):
+            return Proof.UNKNOWN
+        result = Proof.WIN if evaluate_terminal(outcome)[1] else Proof.LOSS
+        if proof not in (Proof.UNKNOWN, result):
+            return Proof.UNKNOWN
+        proof = result
+    return proof
+
+
+def unreached_proof(state: GameState) -> int:
+    """
+    Proof of a state the search didn't reach: terminal_proof, else a win when one of my actions wins the battle this
+    turn whatever happens (turn_proof), a loss when all of them lose it
+    """
+    proof = terminal_proof(state)
+    if proof != Proof.UNKNOWN:
+        return proof
+    lost = True
+    for action in state.get_valid_actions(is_player=True):
+        proof = turn_proof(state, action)
+        if proof == Proof.WIN:
+            return Proof.WIN
+        lost = lost and proof == Proof.LOSS
+    return Proof.LOSS if lost else Proof.UNKNOWN
+
+
+class Edge():
+    """
+    Statistics of one action of a node, summed over its outcome nodes as the backpropagation goes through it:
+    visits, total value, wins and dead, plus win_sum (sum of win_chance * visits) and dead_sum (sum of
+    dead_avg * wins) of the outcomes, so the Wilson backup doesn't have to sum the outcome list either.
+    proven is its solver flag, scan and pending the outcome enumeration of solve (iter_outcomes) where it stopped
+    """
+    __slots__ = ('visits', 'total_value', 'wins', 'dead', 'win_sum', 'dead_sum', 'proven', 'scan', 'pending')
+    def __init__(self):
+        self.visits = 0
+        self.total_value = 0
+        self.wins = 0
+        self.dead = 0
+        self.win_sum = 0.0
+        self.dead_sum = 0.0
+        self.proven = Proof.UNKNOWN
+        self.scan = None
+        self.pending = None
+
+    @staticmethod
+    def from_outcomes(outcomes):
+        """Edge of an outcome list, summing it (trees without kept edges)"""
+        edge = Edge()
+        for node in outcomes:
+            edge.visits += node.visits
+            edge.total_value += node.total_value
+            edge.wins += node.wins
+            edge.dead += node.dead
+            edge.win_sum += node.win_chance * node.visits
+            edge.dead_sum += node.dead_avg * node.wins
+        return edge
+
+
+class Outcomes(list):
+    """Outcome nodes of an action in the order they were reached, by_key finds one from its bucket key"""
+    __slots__ = ('by_key',)
+    def __init__(self):
+        super().__init__()
+        self.by_key = {}
+
+    def add(self, key, node):
+        """List node as the outcome of bucket key"""
+        self.by_key[key] = node
+        self.append(node)
 
 
 class Node():
     """
-    - Store: state, parent, children, visit count, total value, untried actions
+    - Store: state, parent, children, edges, visit count, total value, untried actions
     - Key: nodes represent decision points, not chance outcomes
+    - children maps an action to its outcome nodes, edges to its Edge statistics
+    - proven is the solver flag (see Proof), known from the start on terminal states
     """
     __slots__ = (
-        'state', 'parent', 'move', 'children', 'visits', 'total_value', 'legal_moves', 'wins', 'dead',
-        'depth', 'win_chance', 'dead_avg'
+        'state', 'parent', 'move', 'children', 'edges', 'visits', 'total_value', 'wins', 'dead',
+        'depth', 'win_chance', 'dead_avg', 'proven'
     )
     def __init__(self, state, parent=None, move=None):
         self.state = state
         self.parent = parent
         self.move = move
         self.children = {}
+        self.edges = {}
         self.visits = 0
         self.total_value = 0
-        self.legal_moves = state.get_valid_actions(is_player=True)
         self.wins = 0
         self.dead = 0
         self.depth = 0
         self.win_chance = 0.0
         self.dead_avg = 0
+        self.proven = terminal_proof(state)
 
-    def best_action(self, c=0.4):
-        """Best outcome using UCB; break ties and unvisited bias fairly."""
+    @property
+    def legal_moves(self):
+        """My legal actions in the node state"""
+        return self.state.get_valid_actions(is_player=True)
+
+    def best_action(self, c=0.4, rng=None):
+        """
+        Best outcome using UCB; break ties and unvisited bias fairly. rng breaks the ties, default the state one.
+        Proven losses are skipped, (None, None) when every action is one
+        """
         # prefer a random unvisited child to avoid insertion-order bias
 
         best_key, best_node = None, None
@@ -217,64 +412,114 @@ class Node():
         # guard: if parent visits is 0/1, exploration term becomes 0
         log_parent_visits = math.log(self.visits) if self.visits > 1 else 0.0
 
-        for key, child in self.children.items():
+        for key, edge in self.edges.items():
+            if edge.proven == Proof.LOSS:
+                continue
             # average value
-            c_total_value = 0
-            c_visits = 0
-            for chi in child:
-                c_total_value += chi.total_value
-                c_visits += chi.visits
-            avg = c_total_value / c_visits
+            avg = edge.total_value / edge.visits
             # UCB: avg + c * sqrt(2 * ln(N) / n)
-            ucb_val = avg + c * math.sqrt(2 * (log_parent_visits) / c_visits)
-            if ucb_val > best_val or (ucb_val == best_val and random.random() < 0.5):
-                best_val, best_key, best_node = ucb_val, key, child
+            ucb_val = avg + c * math.sqrt(2 * (log_parent_visits) / edge.visits)
+            if ucb_val > best_val or (ucb_val == best_val and (self.state.rng if rng is None else rng).random() < 0.5):
+                best_val, best_key, best_node = ucb_val, key, self.children[key]
 
         return best_key, best_node
 
+    def expand(self, action):
+        """Outcome list of action, made (with its edge) the first time"""
+        if action not in self.children:
+            self.children[action] = Outcomes()
+            self.edges[action] = Edge()
+        return self.children[action]
 
-def mixed_rollout(state: GameState, max_depth=100, heuristic_prob=0.15) -> float:
+    def edge_stats(self):
+        """Edge statistics of every action"""
+        return self.edges
+
+
+def mixed_rollout(state: GameState, max_depth=100, heuristic_prob=0.15, battle_array=None) -> list:
     """
     Mixed rollout: sometimes use heuristics, sometimes pure random
     This reduces bias while still getting some benefit from domain knowledge
+    It's played in place on battle_array (has to hold state, default is the table scratch), which is left on
+    the final position, and gives back the undo logs of its turns
     """
-    sim_state = state.clone()
+    if battle_array is None:
+        battle_array = state.table.load(state.dyn)
+    journal = []
     depth = 0
 
-    while not sim_state.is_terminal() and depth < max_depth:
-        valid_actions = sim_state.get_valid_actions()
+    while not battle_over(battle_array) and depth < max_depth:
+        legal = legal_mask(battle_array)
+        valid_actions = MASK_ACTIONS[legal]
         if not valid_actions:
             break
 
-        if random.random() < heuristic_prob and sim_state.phase != BattlePhase.DEATH_END_OF_TURN:
+        opp_move = None
+        death = battle_array[Field.PHASE] == BattlePhase.DEATH_END_OF_TURN
+        if state.rng.random() < heuristic_prob and not death:
             # Use heuristic occasionally
+            my_slot = int(battle_array[Field.MY_POK])
+            opp_slot = int(battle_array[Field.OPP_POK]) + 6
+            opp_move = trainer_move(state.opp_ai, battle_array)
             action = rollout_pref(
-                sim_state.get_my_active(),
-                sim_state.get_opp_active(),
-                sim_state.opp_move,
-                valid_actions
+                battle_array[(my_slot * POK_LEN):((my_slot + 1) * POK_LEN)],
+                battle_array[(opp_slot * POK_LEN):((opp_slot + 1) * POK_LEN)],
+                opp_move,
+                legal,
+                state.dmg_matrix,
+                (my_slot, opp_slot),
+                state.rng
             )
         else:
             # Pure random most of the time
-            action = random.choice(valid_actions)
+            action = state.rng.choice(valid_actions)
+        if opp_move is None and not death:
+            opp_move = trainer_move(state.opp_ai, battle_array)
 
-        sim_state = sim_state.step(action)
+        journal.append(apply_turn(battle_array, action, opp_move, state.dmg_matrix, rng=state.rng))
         depth += 1
-    return sim_state
-
+    return journal
 
 
-def mcts(root_state: GameState, iterations: int, training: bool=False):
-    """MCTS"""
-    root = Node(root_state)
-
-    for _ in range(iterations):
-        node = root
-        state = root_state.clone()
-        path = [node]
-
-        # 1) Selection
-        while not state.is_terminal():
+def transposition(table, outcomes, state, parent, move, abstraction=exact_key):
+    """
+    Node of the bucket of state (see SearchEngine.abstraction), the outcome of the move already in it, else the
+    one in the transposition table if the bucket was already reached (any move order), a new one otherwise.
+    It's listed in outcomes, the outcome nodes of the move
+    """
+    key = abstraction(state)
+    node = outcomes.by_key.get(key)
+    if node is None:
+        node = table.get(key)
+        if node is None:
+            node = Node(state, parent=parent, move=move)
+            table[key] = node
+        outcomes.add(key, node)
+    return node
+
+
+def playout(root, root_state: GameState, battle_array, table, lock=None, rollouts_per_leaf=1, abstraction=exact_key):
+    """
+    One MCTS iteration from root, battle_array holds root_state before and after it (undo journal).
+    With lock (tree parallel mode) the tree is only read or written holding it, the engine and the rollout
+    run outside of it, and a virtual loss sits on the path until the backpropagation.
+    rollouts_per_leaf > 1 plays that many batched playouts (BatchBattle) from the leaf instead of one
+    mixed_rollout, the path then gets all of them as visits.
+    abstraction gives the bucket key of a state (see SearchEngine.abstraction), the descent goes on with the
+    real state of this iteration whatever the state of the node it shares
+    """
+    guard = nullcontext() if lock is None else lock
+    virtual = 0 if lock is None else VIRTUAL_LOSS
+    node = root
+    state = root_state.clone()
+    path = [node]
+    actions = []
+    journal = []
+    untried_actions = []
+
+    # 1) Selection, down to an unexpanded or a proven node
+    while not state.is_terminal() and node.proven == Proof.UNKNOWN:
+        with guard:
             untried_actions = [
                 a for a in state.get_valid_actions() if a not in node.children
             ]
@@ -282,197 +527,701 @@ def mcts(root_state: GameState, iterations: int, training: bool=False):
             if untried_actions:
                 # We have unexplored actions, time to expand
                 break
-            if node.children:
-                action_key, child = node.best_action()  # Pick action with best UCB
-                new_state = state.step(action_key)
-                new_node = multiple_nodes(child, new_state)
-                if not new_node:
-                    new_child = Node(new_state, parent=node, move=action_key)
-                    child.append(new_child)
-                    node = new_child
-                else:
-                    node = new_node
-                state = new_state
-                path.append(node)
-            else:
+            if not node.children:
                 raise ValueError("MCTS Selection")
-
-        # 2) Expansion (if not terminal)
-        if not state.is_terminal() and untried_actions:
-            action = random.choice(untried_actions)
-            state = state.step(action)
-            child = Node(state, parent=node, move=action)
-            if action not in node.children:
-                node.children[action] = []
-                node.children[action].append(child)
-            path.append(child)
-            node = child
-
-        # 3) Rollout
-        if not state.is_terminal():
-            sim_state = mixed_rollout(state, heuristic_prob=0.3)
-            value, win, dead = evaluate_terminal(sim_state)
+            action_key, child = node.best_action(rng=state.rng)  # Pick action with best UCB
+            if action_key is None:
+                break  # Proven by another thread meanwhile
+        journal.append(state.apply(battle_array, action_key))
+        state = state.child(battle_array, journal[-1])
+        with guard:
+            node.edges[action_key].visits += virtual
+            node = transposition(table, child, state, node, action_key, abstraction)
+        path.append(node)
+        actions.append(action_key)
+
+    # 2) Expansion (if not terminal)
+    if not state.is_terminal() and untried_actions:
+        action = state.rng.choice(untried_actions)
+        journal.append(state.apply(battle_array, action))
+        state = state.child(battle_array, journal[-1])
+        with guard:
+            outcomes = node.expand(action)
+            node.edges[action].visits += virtual
+            node = transposition(table, outcomes, state, node, action, abstraction)
+        path.append(node)
+        actions.append(action)
+
+    # 3) Rollout, a proven node result is already known, unless solve proved it before any visit (no statistics)
+    if node.proven != Proof.UNKNOWN and node.visits and not state.is_terminal():
+        samples, value, win, dead = proven_value(node)
+    else:
+        samples, value, win, dead = rollout_value(state, battle_array, journal, rollouts_per_leaf)
+
+    # 4) Backpropagation, the virtual loss visit becomes the real one
+    with guard:
+        backpropagate(path, samples, value, win, dead, virtual, actions, table, abstraction)
+
+    # Back to the root position for the next iteration
+    for log in reversed(journal):
+        undo(battle_array, log)
+
+
+def rollout_value(state: GameState, battle_array, journal, rollouts_per_leaf=1) -> tuple:
+    """
+    (samples, value, wins, dead) of the position on battle_array, state giving the battle (AI, damage matrix and
+    random stream). The mixed_rollout turns go to journal, batched playouts (rollouts_per_leaf > 1) don't touch
+    battle_array. Both play my side with rollout_pref on LEAF_HEURISTIC_PROB of the turns, the batched opponent is
+    the greedy part of the trainer AI scoring (BatchBattle.greedy_opp_actions) instead of the whole TrainerAI
+    """
+    if battle_over(battle_array):
         # If state is terminal there's no need to rollout
-        else:
-            value, win, dead = evaluate_terminal(state)
+        return (1, *evaluate_terminal(battle_array))
+    if rollouts_per_leaf > 1:
+        values, wins, deads = evaluate_batch(batch_rollouts(
+            state, rollouts_per_leaf, battle_array=battle_array, heuristic_prob=LEAF_HEURISTIC_PROB
+        ))
+        return rollouts_per_leaf, values.sum(), int(wins.sum()), int(deads[wins == 1].sum())
+    journal.extend(mixed_rollout(state, heuristic_prob=LEAF_HEURISTIC_PROB, battle_array=battle_array))
+    return (1, *evaluate_terminal(battle_array))
 
-        # 4) Backpropagation
-        for depth, node in enumerate(reversed(path)):
-            node.visits += 1
-            node.total_value += value
-            node.wins += win
-            node.dead += dead if win else 0
-            node.dead_avg = node.dead / node.wins if node.wins else 0
-            node.win_chance = node.wins/ node.visits
 
-            if not hasattr(node, 'depth'):
-                node.depth = depth
+def proven_value(node) -> tuple:
+    """(samples, value, wins, dead) of a proven node without a rollout: one sample with its averages"""
+    if node.proven == Proof.WIN:
+        return 1, node.total_value / node.visits, 1, node.dead / node.wins if node.wins else 0
+    return 1, node.total_value / node.visits, 0, 0
 
-    def propagate_stable_values(node, min_visits=70):
-        """
-        Choose it's child best node and propagate as that being the outcome of the parent
-        """
-        def wilson_lower_bound(wins, total, confidence=0.95):
-            """
-            Calculate Wilson score interval lower bound.
-            This gives a conservative estimate that accounts for sample size.
-            """
-            if total == 0:
-                return 0
 
-            z = 1.96 if confidence == 0.95 else 1.645  # z-score for confidence level
-            phat = wins / total
+def solve(node, action, table):
+    """
+    Solver backup of node once an outcome of action got proven. The edge is proven when every outcome the turn
+    can lead to (see iter_outcomes) is proven the same way, then node is a proven win with one winning action, a
+    proven loss when all its actions are proven losses.
+    An outcome the search never reached (a move the trainer AI doesn't pick, a rare chance path) gets its node from
+    the enumeration, through the transposition table, proven by unreached_proof when it's a new one.
+    The enumeration stops at the first outcome that isn't proven yet and goes on from it the next time, so a
+    chance path is never replayed twice. Exact state keys only, a bucket of states can't be proven from one of them
+    """
+    edge = node.edges[action]
+    if edge.proven == Proof.UNKNOWN:
+        outcomes = node.children[action]
+        proof = outcomes[0].proven
+        if proof == Proof.UNKNOWN or any(outcome.proven != proof for outcome in outcomes):
+            return
+        if edge.scan is None:
+            edge.scan = iter_outcomes(node.state, action)
+            edge.pending = next(edge.scan, None)
+        while edge.pending is not None:
+            key, state = edge.pending
+            outcome = outcomes.by_key.get(key)
+            if outcome is None:
+                new = key not in table
+                outcome = transposition(table, outcomes, state, node, action)
+                if new:
+                    outcome.proven = unreached_proof(state)
+            if outcome.proven != proof:
+                return
+            edge.pending = next(edge.scan, None)
+        edge.proven = proof
+        edge.scan = None
+    if edge.proven == Proof.WIN:
+        node.proven = Proof.WIN
+    elif all(a in node.edges and node.edges[a].proven == Proof.LOSS for a in node.legal_moves):
+        node.proven = Proof.LOSS
+
+
+def backpropagate(path, samples, value, win, dead, virtual=0, actions=None, table=None, abstraction=exact_key):
+    """
+    Add the rollout result to every node of path and, with actions (the action taken out of each node but the
+    last), to the Edge of those actions, virtual being the virtual loss already on the edges.
+    Leaf first, so each node then takes the Wilson best child values (propagate_stable_values) of children that
+    are already up to date, the tree never needs a full backup pass. Proofs go up the same way (see solve), with
+    the transposition table and the exact_key abstraction only
+    """
+    for i in range(len(path) - 1, -1, -1):
+        node = path[i]
+        old_win = node.win_chance * node.visits
+        old_dead = node.dead_avg * node.wins
+        node.visits += samples
+        node.total_value += value
+        node.wins += win
+        node.dead += dead if win else 0
+        node.dead_avg = node.dead / node.wins if node.wins else 0
+        node.win_chance = node.wins/ node.visits
+        propagate_stable_values(node)
+        if actions is not None and i > 0:
+            edge = path[i - 1].edges[actions[i - 1]]
+            edge.visits += samples - virtual
+            edge.total_value += value
+            edge.wins += win
+            edge.dead += dead if win else 0
+            edge.win_sum += node.win_chance * node.visits - old_win
+            edge.dead_sum += node.dead_avg * node.wins - old_dead
+            if node.proven != Proof.UNKNOWN and table is not None and abstraction is exact_key:
+                solve(path[i - 1], actions[i - 1], table)
+
+
+class OpenNode():
+    """
+    Node of the open loop mode: only the statistics of an action sequence from the root, no state.
+    The position is replayed from the root on every descent with fresh randomness, so one node stands for
+    every outcome of the sequence. edges maps an action to its node (None until the first one)
+    """
+    __slots__ = ('edges', 'visits', 'total_value', 'wins', 'dead', 'win_chance', 'dead_avg')
+    def __init__(self):
+        self.edges = None
+        self.visits = 0
+        self.total_value = 0
+        self.wins = 0
+        self.dead = 0
+        self.win_chance = 0.0
+        self.dead_avg = 0
 
-            denominator = 1 + z**2 / total
-            center = phat + z**2 / (2 * total)
-            spread = z * math.sqrt((phat * (1 - phat) + z**2 / (4 * total)) / total)
+    @property
+    def children(self):
+        """edges in the shape of Node.children (action to outcome nodes), for the backup and the report"""
+        return {action: (child,) for action, child in (self.edges or {}).items()}
 
-            return (center - spread) / denominator
+    def edge_stats(self):
+        """Edge statistics of every action, the child node itself holds them"""
+        return {action: Edge.from_outcomes((child,)) for action, child in (self.edges or {}).items()}
 
-        if not node.children:
-            return node.win_chance, node.dead_avg
+    def best_action(self, legal, rng, c=0.4):
+        """Best legal action (of this replay) using UCB"""
+        best_key, best_node = None, None
+        best_val = -float("inf")
+        log_parent_visits = math.log(self.visits) if self.visits > 1 else 0.0
 
-        best_score = -1
-        best_win = node.win_chance
-        best_dead = node.dead_avg
+        for key in legal:
+            child = self.edges[key]
+            ucb_val = child.total_value / child.visits + c * math.sqrt(2 * (log_parent_visits) / child.visits)
+            if ucb_val > best_val or (ucb_val == best_val and rng.random() < 0.5):
+                best_val, best_key, best_node = ucb_val, key, child
 
-        for _, node_list in node.children.items():
-            total_visits = sum(c.visits for c in node_list if hasattr(c, "visits"))
+        return best_key, best_node
 
-            if total_visits < min_visits:
-                continue
 
-            total_wins = sum(c.wins for c in node_list)
-            avg_win = sum(c.win_chance * c.visits for c in node_list) / total_visits
+def open_loop_playout(root: OpenNode, root_state: GameState, battle_array, rollouts_per_leaf=1):
+    """
+    One open loop iteration: the actions down the tree are replayed on battle_array (holding root_state before
+    and after it), the legal actions and the opponent moves come from this replay
+    """
+    node = root
+    path = [node]
+    journal = []
+    untried_actions = []
+
+    # 1) Selection
+    while not battle_over(battle_array):
+        legal = legal_actions(battle_array)
+        untried_actions = [a for a in legal if node.edges is None or a not in node.edges]
+        if untried_actions or not legal:
+            break
+        action, node = node.best_action(legal, root_state.rng)
+        journal.append(replay_turn(root_state, battle_array, action))
+        path.append(node)
+
+    # 2) Expansion (if not terminal)
+    if not battle_over(battle_array) and untried_actions:
+        action = root_state.rng.choice(untried_actions)
+        journal.append(replay_turn(root_state, battle_array, action))
+        if node.edges is None:
+            node.edges = {}
+        child = OpenNode()
+        node.edges[action] = child
+        node = child
+        path.append(node)
+
+    # 3) Rollout
+    samples, value, win, dead = rollout_value(root_state, battle_array, journal, rollouts_per_leaf)
+
+    # 4) Backpropagation
+    backpropagate(path, samples, value, win, dead)
+
+    # Back to the root position for the next iteration
+    for log in reversed(journal):
+        undo(battle_array, log)
+
+
+class ArrayNode():
+    """A node of an ArrayTree read like an OpenNode (statistics, children, edge_stats), for the report and reroot"""
+    __slots__ = ('tree', 'index')
+    def __init__(self, tree: ArrayTree, index):
+        self.tree = tree
+        self.index = index
+
+    visits = property(lambda self: int(self.tree.visits[self.index]))
+    total_value = property(lambda self: float(self.tree.total_value[self.index]))
+    wins = property(lambda self: int(self.tree.wins[self.index]))
+    dead = property(lambda self: int(self.tree.dead[self.index]))
+    win_chance = property(lambda self: float(self.tree.win_chance[self.index]))
+    dead_avg = property(lambda self: float(self.tree.dead_avg[self.index]))
+
+    @property
+    def children(self):
+        """Children in the shape of Node.children (action to outcome nodes)"""
+        return {
+            int(self.tree.action[child]): (ArrayNode(self.tree, child),)
+            for child in self.tree.children(self.index)
+        }
+
+    def edge_stats(self):
+        """Edge statistics of every action, the child node itself holds them"""
+        return {action: Edge.from_outcomes(child) for action, child in self.children.items()}
+
+
+def array_playout(tree: ArrayTree, root_state: GameState, battle_array, rollouts_per_leaf=1):
+    """open_loop_playout on an ArrayTree, the UCB of a node children is one vectorized expression"""
+    node = tree.root
+    path = [node]
+    journal = []
+    untried_codes = []
+
+    # 1) Selection
+    while not battle_over(battle_array):
+        child, untried_codes = tree.select(node, legal_actions(battle_array), root_state.rng)
+        if child == NO_NODE:
+            break
+        journal.append(replay_turn(root_state, battle_array, int(tree.action[child])))
+        node = child
+        path.append(node)
+
+    # 2) Expansion (if not terminal)
+    if not battle_over(battle_array) and untried_codes:
+        code = root_state.rng.choice(untried_codes)
+        journal.append(replay_turn(root_state, battle_array, code))
+        node = tree.add_child(node, code)
+        path.append(node)
+
+    # 3) Rollout
+    samples, value, win, dead = rollout_value(root_state, battle_array, journal, rollouts_per_leaf)
+
+    # 4) Backpropagation
+    tree.backpropagate(path, samples, value, win, dead)
+
+    # Back to the root position for the next iteration
+    for log in reversed(journal):
+        undo(battle_array, log)
+
+
+def replay_turn(state: GameState, battle_array, my_action):
+    """Play my_action on battle_array against the trainer AI move, with state battle and random stream"""
+    opp_move = None
+    if battle_array[Field.PHASE] != BattlePhase.DEATH_END_OF_TURN:
+        opp_move = trainer_move(state.opp_ai, battle_array)
+    return apply_turn(battle_array, my_action, opp_move, state.dmg_matrix, rng=state.rng)
+
+
+def subtree(node):
+    """Every node reachable from node, once each (the tree is a DAG)"""
+    if isinstance(node, ArrayNode):
+        rows = [node.index]
+        while rows:
+            row = rows.pop()
+            yield ArrayNode(node.tree, row)
+            rows.extend(node.tree.children(row))
+        return
+    seen = {id(node)}
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        yield current
+        for outcomes in current.children.values():
+            for child in outcomes:
+                if id(child) not in seen:
+                    seen.add(id(child))
+                    stack.append(child)
+
+
+def reroot(tree, my_action, state, abstraction=exact_key):
+    """
+    Node of the previous search tree to continue from after playing my_action and observing state: the outcome
+    under tree.children[my_action] in the bucket of state (same abstraction as the search), None if the search
+    never reached it.
+    Parent links out of the kept subtree are cut so the rest of the old tree can be freed.
+    An open loop tree has a single node per action, whatever the outcome, the rows of an ArrayTree out of the kept
+    subtree go to its free list
+    """
+    if isinstance(tree, OpenNode):
+        return (tree.edges or {}).get(my_action)
+    if isinstance(tree, ArrayNode):
+        child = tree.tree.child(tree.index, my_action)
+        return None if child == NO_NODE else ArrayNode(tree.tree.reroot(child), child)
+    outcomes = tree.children.get(my_action)
+    node = None if outcomes is None else outcomes.by_key.get(abstraction(state))
+    if node is not None:
+        kept = {id(n) for n in subtree(node)}
+        for n in subtree(node):
+            if n.parent is not None and id(n.parent) not in kept:
+                n.parent = None
+    return node
+
+
+def mcts(
+        root_state: GameState, max_iterations=None, training: bool=False, rollouts_per_leaf=1,
+        time_budget_ms=None, confidence=None, tree=None, open_loop: bool=False, array_tree: bool=False,
+        abstraction=exact_key
+):
+    """
+    MCTS, the tree is a DAG: positions are shared through a transposition table keyed by state key.
+    Anytime: it stops after max_iterations or once time_budget_ms is spent (the clock is checked between
+    iterations), whichever comes first. With confidence (0.95 or 0.90) it also stops as soon as the best
+    root action is settled (see action_separated), so easy positions return early.
+    rollouts_per_leaf is the number of playouts for every expanded leaf (see playout), a batch turn costs about the
+    same for 16 rows or 256 so it pays off from around a hundred.
+    tree is the node of root_state in an earlier search (see reroot), the search goes on from its statistics.
+    open_loop builds OpenNode statistics only, no state is kept (see open_loop_playout).
+    array_tree is open loop on an ArrayTree (NumPy columns instead of objects), the returned root is an ArrayNode.
+    abstraction maps a state to the key of its node (see SearchEngine.abstraction), default is the exact state.
+    Closed loop search on exact keys is also a solver: proven subtrees are skipped and it stops once the root is proven
+    """
+    if max_iterations is None and time_budget_ms is None:
+        raise ValueError("mcts needs max_iterations or time_budget_ms")
+    deadline = None if time_budget_ms is None else time.perf_counter() + time_budget_ms / 1000
+    if array_tree:
+        root = ArrayNode(ArrayTree(), 0) if tree is None else tree  # 0 is the root row of a new tree
+        table = None
+    elif open_loop:
+        root = OpenNode() if tree is None else tree
+        table = None
+    elif tree is None:
+        root = Node(root_state)
+        table = {abstraction(root_state): root}
+    else:
+        root = tree
+        table = {abstraction(node.state): node for node in subtree(root)}
+    # One battle array is walked down the tree and back up (undo journal) every iteration
+    battle_array = root_state.battle_array
+
+    iteration = 0
+    while max_iterations is None or iteration < max_iterations:
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+        if getattr(root, 'proven', Proof.UNKNOWN) != Proof.UNKNOWN:
+            break
+        if array_tree:
+            array_playout(root.tree, root_state, battle_array, rollouts_per_leaf)
+        elif open_loop:
+            open_loop_playout(root, root_state, battle_array, rollouts_per_leaf)
+        else:
+            playout(root, root_state, battle_array, table, rollouts_per_leaf=rollouts_per_leaf, abstraction=abstraction)
+        iteration += 1
+        if confidence is not None and action_separated(root, confidence, len(legal_actions(battle_array))):
+            break
 
-            if total_wins > 0:
-                avg_dead = sum(c.dead_avg * c.wins for c in node_list) / total_wins
-            else:
-                avg_dead = float('inf')
+    if not training:
+        print_best_path(root, max_depth=15)
+    return root
 
-            # Use Wilson score: conservative win estimate accounting for sample size
-            # This naturally prefers "9000 visits at 97%" over "40 visits at 100%"
-            wilson_score = wilson_lower_bound(total_wins, total_visits)
 
-            # Add small penalty for deaths (but don't let it dominate)
-            score = wilson_score - (0.01 * avg_dead if avg_dead != float('inf') else 0)
+def threaded_mcts(
+        root_state: GameState, iterations: int, threads=None, training: bool=False, rollouts_per_leaf=1,
+        abstraction=exact_key
+):
+    """
+    Tree parallel MCTS: threads descend one shared tree, each with its own battle array and random stream
+    (spawned from the root state one). The virtual loss on the paths being played spreads them over different
+    branches. Under the GIL only the tree updates are serialized by the lock, the turns and rollouts are
+    what runs in parallel on free threaded builds
+    """
+    threads = os.cpu_count() if threads is None else threads
+    root = Node(root_state)
+    table = {abstraction(root_state): root}
+    lock = threading.Lock()
+    shares = [iterations // threads + (i < iterations % threads) for i in range(threads)]
+
+    def work(rng, share):
+        state = root_state.clone(rng=rng)
+        battle_array = state.battle_array
+        for _ in range(share):
+            if root.proven != Proof.UNKNOWN:
+                break
+            playout(root, state, battle_array, table, lock, rollouts_per_leaf, abstraction)
 
-            if score > best_score:
-                best_score = score
-                best_win = avg_win
-                best_dead = avg_dead
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(work, root_state.rng.spawn(threads), shares))
 
-        node.win_chance = best_win
-        node.dead_avg = best_dead
+    if not training:
+        print_best_path(root, max_depth=15)
+    return root
 
+
+def wilson_interval(wins, total, confidence=0.95) -> Tuple[float, float]:
+    """
+    Calculate Wilson score interval (lower, upper) bounds.
+    This gives a conservative estimate that accounts for sample size.
+    """
+    if total == 0:
+        return 0, 1
+
+    z = 1.96 if confidence == 0.95 else 1.645  # z-score for confidence level
+    phat = wins / total
+
+    denominator = 1 + z**2 / total
+    center = phat + z**2 / (2 * total)
+    spread = z * math.sqrt((phat * (1 - phat) + z**2 / (4 * total)) / total)
+
+    return (center - spread) / denominator, (center + spread) / denominator
+
+
+def wilson_lower_bound(wins, total, confidence=0.95) -> float:
+    """Lower bound of the Wilson score interval"""
+    return wilson_interval(wins, total, confidence)[0]
+
+
+def action_separated(node, confidence=0.95, n_legal=None) -> bool:
+    """
+    True once the best action of node is settled: every legal action (n_legal of them, default the node ones)
+    was tried and the best Wilson lower bound (of the action wins over its visits) is above the Wilson upper
+    bound of every other action
+    """
+    edges = node.edge_stats()
+    if len(edges) < (len(node.legal_moves) if n_legal is None else n_legal):
+        return False
+    bounds = [wilson_interval(edge.wins, edge.visits, confidence) for edge in edges.values()]
+    if len(bounds) < 2:
+        return True
+    best = max(range(len(bounds)), key=lambda i: bounds[i][0])
+    return all(upper < bounds[best][0] for i, (_, upper) in enumerate(bounds) if i != best)
+
+
+def propagate_stable_values(node, min_visits=70):
+    """
+    Choose it's child best node and propagate as that being the outcome of the parent
+    """
+    edges = node.edge_stats()
+    if not edges:
         return node.win_chance, node.dead_avg
 
+    best_score = -1
+    best_win = node.win_chance
+    best_dead = node.dead_avg
 
-    def recursive_backup(node, min_visits=70, use_wilson=True):
-        """
-        Recursively backup values from leaves to root.
-        
-        Args:
-            use_wilson: If True, use Wilson score (v3) which handles sample size naturally.
-                    If False, use simple top-tier selection (v1).
-        """
-        # Base case: terminal node (leaf) - just return its values
-        if not node.children:
-            return node.win_chance, node.dead_avg
-
-        # First, recursively backup all children
-        for node_list in node.children.values():
-            for child in node_list:
-                recursive_backup(child, min_visits=min_visits, use_wilson=use_wilson)
-
-        # Then propagate the best child values to this node
-        # Only do this if node has children (non-terminal)
-        if node.children:
-            if use_wilson:
-                propagate_stable_values(node, min_visits=min_visits)
-            else:
-                propagate_stable_values(node, min_visits=min_visits)
+    for edge in edges.values():
+        total_visits = edge.visits
+
+        if total_visits < min_visits:
+            continue
 
+        total_wins = edge.wins
+        avg_win = edge.win_sum / total_visits
+
+        if total_wins > 0:
+            avg_dead = edge.dead_sum / total_wins
+        else:
+            avg_dead = float('inf')
+
+        # Use Wilson score: conservative win estimate accounting for sample size
+        # This naturally prefers "9000 visits at 97%" over "40 visits at 100%"
+        wilson_score = wilson_lower_bound(total_wins, total_visits)
+
+        # Add small penalty for deaths (but don't let it dominate)
+        score = wilson_score - (0.01 * avg_dead if avg_dead != float('inf') else 0)
+
+        if score > best_score:
+            best_score = score
+            best_win = avg_win
+            best_dead = avg_dead
+
+    node.win_chance = best_win
+    node.dead_avg = best_dead
+
+    return node.win_chance, node.dead_avg
+
+
+def recursive_backup(node, min_visits=70, use_wilson=True, seen=None):
+    """
+    Recursively backup values from leaves to root, for trees whose values weren't kept up to date by
+    backpropagate (the merged trees of parallel_mcts).
+    
+    Args:
+        use_wilson: If True, use Wilson score (v3) which handles sample size naturally.
+                If False, use simple top-tier selection (v1).
+    """
+    # Base case: terminal node (leaf) or a shared node already backed up - just return its values
+    seen = set() if seen is None else seen
+    if not node.children or id(node) in seen:
         return node.win_chance, node.dead_avg
+    seen.add(id(node))
+
+    # First, recursively backup all children
+    for node_list in node.children.values():
+        for child in node_list:
+            recursive_backup(child, min_visits=min_visits, use_wilson=use_wilson, seen=seen)
+
+    # Then propagate the best child values to this node
+    # Only do this if node has children (non-terminal)
+    if node.children:
+        if use_wilson:
+            propagate_stable_values(node, min_visits=min_visits)
+        else:
+            propagate_stable_values(node, min_visits=min_visits)
 
-    recursive_backup(root)
+    return node.win_chance, node.dead_avg
 
-    def print_best_path(root, depth=0, max_depth=5, min_visits=1, choose_by='wilson'):
-        """
-        Print all actions with enhanced metrics including confidence.
-        """
-        if depth > max_depth or not getattr(root, "children", None):
-            return
 
-        indent = "    " * depth
-        print(f"\n{indent}------ Depth {depth} ------")
+def print_best_path(root, depth=0, max_depth=5, min_visits=1, choose_by='wilson'):
+    """
+    Print all actions with enhanced metrics including confidence.
+    """
+    if depth > max_depth or not getattr(root, "children", None):
+        return
+
+    indent = "    " * depth
+    print(f"\n{indent}------ Depth {depth} ------")
+
+    best_action = None
+    best_metric = -float("inf")
+    best_node = None
+
+    children = root.children
+    for action, edge in root.edge_stats().items():
+        nodes = children[action]
+        total_visits = edge.visits
+        if total_visits < min_visits:
+            print(f"{indent}Action: {action_name(action)} (skipped, visits={total_visits})")
+            continue
+
+        total_wins = edge.wins
+        total_dead = edge.dead
+
+        avg_win = edge.win_sum / total_visits
+        avg_dead = edge.dead_sum / total_wins if total_wins > 0 else 0
+        total_value = edge.total_value
+
+        # Calculate Wilson score for display
+        if choose_by == 'wilson':
+            z = 1.96
+            phat = total_wins / total_visits if total_visits > 0 else 0
+            denominator = 1 + z**2 / total_visits if total_visits > 0 else 1
+            center = phat + z**2 / (2 * total_visits) if total_visits > 0 else 0
+            spread = z * math.sqrt((phat * (1 - phat) + z**2 / (4 * total_visits)) / total_visits) if total_visits > 0 else 0
+            wilson = (center - spread) / denominator
+            metric = wilson - (0.01 * avg_dead)
+        else:
+            metric = avg_win
+        if edge.proven == Proof.WIN:
+            metric = float("inf")
+
+        if avg_dead < 0 or avg_dead > 2:
+            pass
+        proven = {Proof.WIN: ", proven win", Proof.LOSS: ", proven loss"}.get(edge.proven, "")
+        print(f"{indent}Action: {action_name(action)}, visits: {total_visits}, "
+            f"total value: {round(total_value,2)}, "
+            f"avg_win: {round(avg_win*100,2)}%, avg_dead: {round(avg_dead,2)}, "
+            f"total win: {total_wins}, total dead: {total_dead}{proven}")
 
-        best_action = None
-        best_metric = -float("inf")
-        best_node = None
+        if metric > best_metric:
+            best_metric = metric
+            best_action = action
+            best_node = max(nodes, key=lambda n: getattr(n, "visits", 0))
+
+    if best_node:
+        print(f"{indent}==> Best action at depth {depth}: {action_name(best_action)}")
+        print_best_path(best_node, depth + 1, max_depth, min_visits, choose_by)
+
+
+class MergedNode():
+    """
+    Statistics of the same position summed over the trees of parallel_mcts, read like a Node. edges are the summed
+    Edge of every action, the outcome nodes of an action can be shared with other actions (transpositions) so
+    their own counts don't add up to it
+    """
+    __slots__ = ('children', 'edges', 'visits', 'total_value', 'wins', 'dead', 'win_chance', 'dead_avg')
+    def __init__(self):
+        self.children = {}
+        self.edges = {}
+        self.visits = 0
+        self.total_value = 0
+        self.wins = 0
+        self.dead = 0
+        self.win_chance = 0.0
+        self.dead_avg = 0
+
+    def edge_stats(self):
+        """Edge statistics of every action, summed over the trees"""
+        return self.edges
 
-        for action, nodes in root.children.items():
-            total_visits = sum(getattr(n, "visits", 0) for n in nodes)
-            if total_visits < min_visits:
-                print(f"{indent}Action: {action} (skipped, visits={total_visits})")
-                continue
 
-            total_wins = sum(getattr(n, "wins", 0) for n in nodes)
-            total_dead = sum(getattr(n, "dead", 0) for n in nodes)
-
-            avg_win = sum(n.win_chance * getattr(n, "visits", 0) for n in nodes) / total_visits
-            avg_dead = sum(n.dead_avg * getattr(n, "wins", 0) for n in nodes) / total_wins if total_wins > 0 else 0
-            total_value = sum(getattr(n, "total_value", 0) for n in nodes)
-
-            # Calculate Wilson score for display
-            if choose_by == 'wilson':
-                z = 1.96
-                phat = total_wins / total_visits if total_visits > 0 else 0
-                denominator = 1 + z**2 / total_visits if total_visits > 0 else 1
-                center = phat + z**2 / (2 * total_visits) if total_visits > 0 else 0
-                spread = z * math.sqrt((phat * (1 - phat) + z**2 / (4 * total_visits)) / total_visits) if total_visits > 0 else 0
-                wilson = (center - spread) / denominator
-                metric = wilson - (0.01 * avg_dead)
-            else:
-                metric = avg_win
-
-            if avg_dead < 0 or avg_dead > 2:
-                pass
-            print(f"{indent}Action: {action}, visits: {total_visits}, "
-                f"total value: {round(total_value,2)}, "
-                f"avg_win: {round(avg_win*100,2)}%, avg_dead: {round(avg_dead,2)}, "
-                f"total win: {total_wins}, total dead: {total_dead}")
-
-            if metric > best_metric:
-                best_metric = metric
-                best_action = action
-                best_node = max(nodes, key=lambda n: getattr(n, "visits", 0))
-
-        if best_node:
-            print(f"{indent}==> Best action at depth {depth}: {best_action}")
-            print_best_path(best_node, depth + 1, max_depth, min_visits, choose_by)
+# Edge fields sent back by the parallel_mcts workers, in this order
+EDGE_SUMMARY = ('visits', 'total_value', 'wins', 'dead', 'win_sum', 'dead_sum')
 
 
+def tree_summary(node, plies, abstraction=exact_key) -> tuple:
+    """
+    (bucket key, visits, total value, wins, dead, {action: edge fields (EDGE_SUMMARY)}, {action: [outcome
+    summaries]}) of node down to plies moves
+    """
+    edges, children = {}, {}
+    if plies > 0:
+        edges = {
+            action: tuple(getattr(edge, name) for name in EDGE_SUMMARY) for action, edge in node.edge_stats().items()
+        }
+        children = {
+            action: [tree_summary(child, plies - 1, abstraction) for child in outcomes]
+            for action, outcomes in node.children.items()
+        }
+    return abstraction(node.state), node.visits, node.total_value, node.wins, node.dead, edges, children
+
+
+def merge_summaries(summaries) -> MergedNode:
+    """One MergedNode of the summaries of a position, edges are summed by action, outcomes matched by bucket key"""
+    merged = MergedNode()
+    grouped = {}
+    for _, visits, total_value, wins, dead, edges, children in summaries:
+        merged.visits += visits
+        merged.total_value += total_value
+        merged.wins += wins
+        merged.dead += dead
+        for action, fields in edges.items():
+            edge = merged.edges.get(action)
+            if edge is None:
+                edge = merged.edges[action] = Edge()
+            for name, value in zip(EDGE_SUMMARY, fields):
+                setattr(edge, name, getattr(edge, name) + value)
+        for action, outcomes in children.items():
+            for outcome in outcomes:
+                grouped.setdefault(action, {}).setdefault(outcome[0], []).append(outcome)
+    merged.win_chance = merged.wins / merged.visits if merged.visits else 0.0
+    merged.dead_avg = merged.dead / merged.wins if merged.wins else 0
+    merged.children = {
+        action: [merge_summaries(same) for same in by_key.values()] for action, by_key in grouped.items()
+    }
+    return merged
+
+
+def _mcts_worker(battle_array, iterations, rng, plies, rollouts_per_leaf, abstraction) -> tuple:
+    """One independent tree of parallel_mcts, only its first plies are sent back"""
+    root = mcts(
+        GameState(battle_array, rng=rng), iterations, training=True, rollouts_per_leaf=rollouts_per_leaf,
+        abstraction=abstraction
+    )
+    return tree_summary(root, plies, abstraction)
+
+
+def parallel_mcts(
+        root_state: GameState, iterations: int, workers=None, plies=2, training: bool=False, rollouts_per_leaf=1,
+        abstraction=exact_key
+):
+    """
+    Root parallel MCTS: the iterations are split over independent trees in a process pool, each with its own
+    random stream (spawned from the root state one). Visit, win and death counts of the first plies are summed
+    by position (bucket key of abstraction, which has to be picklable), then go through the same Wilson backup as
+    mcts
+    """
+    workers = os.cpu_count() if workers is None else workers
+    rngs = root_state.rng.spawn(workers)
+    battle_array = root_state.battle_array
+    shares = [iterations // workers + (i < iterations % workers) for i in range(workers)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        summaries = list(pool.map(
+            _mcts_worker, [battle_array] * workers, shares, rngs, [plies] * workers, [rollouts_per_leaf] * workers,
+            [abstraction] * workers
+        ))
+    root = merge_summaries(summaries)
+    recursive_backup(root)
+
     if not training:
-        print_best_path(root, max_depth=15)
-        
\ No newline at end of file
+        print_best_path(root, max_depth=plies)
+    return root
@@ -4,7 +4,7 @@ Handles both value and policy outputs with nuzlocke death penalties
 """
 import pickle
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -15,6 +15,7 @@ import h5py
 from SearchEngine.my_mcts import GameState
 from SearchEngine.my_mcts import Node
 from Models.idx_const import POK_LEN, FIELD_LEN
+from Models.helper import N_ACTIONS
 
 
 
@@ -23,14 +24,14 @@ class PokemonBattleNet(nn.Module):
     Neural network for Pokemon battles
     Input: Battle state array
     Outputs: 
-        - Policy: Probability distribution over actions (9 possible: 4 moves + 5 switches)
+        - Policy: Probability distribution over the action codes (10: 4 moves + 6 switch slots)
         - Value: Expected outcome (-1 to 1)
     """
 
     def __init__(
             self,
             state_size: int,  # Size of battle array
-            action_size: int = 9,  # 4 moves + 5 switches
+            action_size: int = N_ACTIONS,  # 4 moves + 6 switch slots
             hidden_size: int = 512,
             num_hidden_layers: int = 4,
             dropout_rate: float = 0.1
@@ -126,48 +127,16 @@ class PokemonBattleNet(nn.Module):
         return policy_probs.numpy(), value
 
 
-def encode_action(action: Tuple[str, int]) -> int:
-    """
-    Encode action tuple to index
-    Moves: 0-3 (indices of moves)
-    Switches: 4-8 (indices of pokemon to switch to, minus 1 since can't switch to self)
-    """
-    action_type, action_idx = action
-    if action_type == 'move':
-        return action_idx  # 0-3
-    else:  # switch
-        # Map switch indices 0-5 to positions 4-8
-        # But skip current pokemon's index
-        return 4 + min(action_idx, 4)  # Simple mapping, adjust based on actual logic
-
-
-def decode_action(action_idx: int, current_pokemon_idx: int) -> Tuple[str, int]:
-    """Decode action index back to tuple"""
-    if action_idx < 4:
-        return ('move', action_idx)
-    else:
-        # Adjust for current pokemon
-        switch_idx = action_idx - 4
-        if switch_idx >= current_pokemon_idx:
-            switch_idx += 1  # Skip current pokemon
-        return ('switch', switch_idx)
-
-
-def create_action_mask(valid_actions: List[Tuple[str, int]], action_size: int = 9) -> np.ndarray:
-    """Create binary mask for valid actions"""
-    mask = np.zeros(action_size, dtype=bool)
-    for action in valid_actions:
-        idx = encode_action(action)
-        mask[idx] = True
-    return mask
-
-
-def encode_action_probs(action_probs: Dict[Tuple[str, int], float], action_size: int = 9) -> np.ndarray:
-    """Convert MCTS action probabilities to fixed-size array"""
+def create_action_mask(legal: int, action_size: int = N_ACTIONS) -> np.ndarray:
+    """Binary mask of a legal action bit mask (see Models.helper.legal_mask), policy index is the action code"""
+    return (legal >> np.arange(action_size)) & 1 == 1
+
+
+def encode_action_probs(action_probs: Dict[int, float], action_size: int = N_ACTIONS) -> np.ndarray:
+    """Convert MCTS action probabilities (by action code) to fixed-size array"""
     encoded = np.zeros(action_size)
     for action, prob in action_probs.items():
-        idx = encode_action(action)
-        encoded[idx] = prob
+        encoded[action] = prob
     return encoded
 
 
@@ -467,14 +436,12 @@ def run_mcts_with_nn(state, network: PokemonBattleNet, iterations: int = 100):
 
     # Get NN evaluation for root
     state_array = state.battle_array
-    valid_actions_mask = create_action_mask(state.get_valid_actions())
+    valid_actions_mask = create_action_mask(state.legal_mask())
     policy_probs, value_estimate = network.predict(state_array, valid_actions_mask)
 
     # Use NN policy as priors for root children
     for action in state.get_valid_actions():
-        action_idx = encode_action(action)
-        if action not in root.children:
-            root.children[action] = []
+        root.expand(action)
         # Set prior probability from NN
         # (You'll need to modify Node class to store priors)
 
@@ -0,0 +1,54 @@
+"""Bounded caches for the per battle lookups of the search, safe to share between the threads of threaded_mcts"""
+import threading
+import weakref
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Mapping of at most maxsize entries, the least recently used one is dropped to make room"""
+    __slots__ = ('maxsize', '_data', '_lock')
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """Value of key, now the most recently used, None if it isn't there"""
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """Add (or replace) key and give back value"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+
+class PerBattle:
+    """Value of each battle (damage matrix) built once by factory, dropped with the damage matrix"""
+    __slots__ = ('factory', '_data', '_lock')
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._data = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, dmg_matrix, *args):
+        """Value of dmg_matrix, factory(*args) the first time (by one thread only)"""
+        value = self._data.get(dmg_matrix)
+        if value is None:
+            with self._lock:
+                value = self._data.get(dmg_matrix)
+                if value is None:
+                    value = self._data[dmg_matrix] = self.factory(*args)
+        return value
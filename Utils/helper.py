@@ -3,6 +3,7 @@ import random
 import numpy as np
 from Utils.loader import TYPE_CHART_ARRAY
 from Models.idx_const import POK_LEN, FIELD_LEN
+from Utils.rng import get_rng
 
 
 def round_half_down(value: float) -> int:
@@ -25,6 +26,9 @@ def stage_to_multiplier(stages: np.float32, acc=False) -> float:
     else:
         mult = 2
 
+    if isinstance(stages, np.ndarray):
+        return np.where(stages >= 0, (mult + stages) / mult, mult / (mult - np.minimum(stages, 0)))
+
     if stages >= 0:
         res = (mult + stages) / mult
     else:
@@ -120,7 +124,7 @@ def entries_from_rand(rand_dict, idx):
     return list(zip(scores, chances))
 
 
-def batch_independent_score_from_rand(rand, idx):
+def batch_independent_score_from_rand(rand, idx, rng=None):
     """
     Rand is a three dim array, where i'm getting the index of the move, so i'm checking the 
     x by 2 array where on the 'col' is how much score and the number out of 255 that is the percentage
@@ -131,7 +135,7 @@ def batch_independent_score_from_rand(rand, idx):
     for score, chance in arr:
         if np.isnan(score):
             break
-        if random.randint(0, 255) < chance:
+        if get_rng(rng).below(256, chance):
             total += score
     return total
 
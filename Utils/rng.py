@@ -0,0 +1,123 @@
+"""One random stream for the engine, the trainer AI and the search, so a battle or a search is reproducible
+from its seed and parallel workers can get independent streams"""
+import math
+import numpy as np
+
+
+class BattleRNG:
+    """
+    Backed by a NumPy Generator, uniforms are drawn in bulk (buffer_size at a time) and handed out one by one,
+    every other draw (randint, chance, choice, ...) is built on top of them
+    """
+    def __init__(self, seed=None, buffer_size=4096, generator=None):
+        self.generator = np.random.default_rng(seed) if generator is None else generator
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._pos = 0
+
+    def _refill(self):
+        self._buffer = self.generator.random(self.buffer_size).tolist()
+        self._pos = 0
+
+    def random(self) -> float:
+        """Uniform float in [0, 1)"""
+        if self._pos >= len(self._buffer):
+            self._refill()
+        value = self._buffer[self._pos]
+        self._pos += 1
+        return value
+
+    def randint(self, a, b) -> int:
+        """Integer in [a, b], both inclusive like random.randint"""
+        return a + int(self.random() * (b - a + 1))
+
+    def below(self, n, k) -> bool:
+        """randint(1, n) <= k, the shape of every accuracy, crit and status roll of the engine"""
+        return self.randint(1, n) <= k
+
+    def chance(self, p) -> bool:
+        """True with probability p"""
+        return self.random() < p
+
+    def choice(self, seq):
+        """Random element of a non empty sequence"""
+        return seq[int(self.random() * len(seq))]
+
+    def choices(self, population, weights):
+        """One element of population picked with the given weights, like random.choices(...)[0]"""
+        r = self.random() * sum(weights)
+        cumulative = 0
+        for item, weight in zip(population, weights):
+            cumulative += weight
+            if r < cumulative:
+                return item
+        return population[-1]
+
+    def spawn(self, n) -> list:
+        """n independent child streams, for parallel workers"""
+        return [BattleRNG(buffer_size=self.buffer_size, generator=g) for g in self.generator.spawn(n)]
+
+
+class ReplayRNG(BattleRNG):
+    """
+    Plays a script of outcomes instead of drawing, so every chance path of a turn can be walked (see
+    Engine.new_battle.turn_outcomes). Each draw is a choice point: its outcome is script[i] for the i-th draw
+    and the first possible one once the script runs out.
+    trace keeps (outcome, outcome probabilities) of every draw, probability is the chance of the whole path
+    """
+    def __init__(self, script=()):  # pylint: disable=W0231
+        self.script = script
+        self.trace = []
+        self.probability = 1.0
+
+    def _pick(self, probs) -> int:
+        i = len(self.trace)
+        if i < len(self.script):
+            outcome = self.script[i]
+        else:
+            outcome = next(j for j, p in enumerate(probs) if p > 0)
+        self.trace.append((outcome, probs))
+        self.probability *= probs[outcome]
+        return outcome
+
+    def next_script(self):
+        """Script of the next path (depth first), None when this was the last one"""
+        for i in range(len(self.trace) - 1, -1, -1):
+            outcome, probs = self.trace[i]
+            for j in range(outcome + 1, len(probs)):
+                if probs[j] > 0:
+                    return [o for o, _ in self.trace[:i]] + [j]
+        return None
+
+    def random(self) -> float:
+        raise ValueError("A continuous draw can't be enumerated")
+
+    def randint(self, a, b) -> int:
+        n = b - a + 1
+        return a + self._pick((1 / n,) * n)
+
+    def below(self, n, k) -> bool:
+        p = min(max(math.floor(k), 0), n) / n
+        return self._pick((p, 1 - p)) == 0
+
+    def chance(self, p) -> bool:
+        return self._pick((p, 1 - p)) == 0
+
+    def choice(self, seq):
+        n = len(seq)
+        return seq[self._pick((1 / n,) * n)]
+
+    def choices(self, population, weights):
+        total = sum(weights)
+        return population[self._pick(tuple(w / total for w in weights))]
+
+    def spawn(self, n) -> list:
+        raise ValueError("A replayed stream can't be spawned")
+
+
+DEFAULT_RNG = BattleRNG()
+
+
+def get_rng(rng=None) -> BattleRNG:
+    """rng, or the shared default stream when None"""
+    return DEFAULT_RNG if rng is None else rng
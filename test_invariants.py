@@ -0,0 +1,165 @@
+"""Invariants of the engine and the search, run with python test_invariants.py (or pytest)"""
+import math
+import numpy as np
+from DataBase.pok_sets import charmander, squirtle, bulbasaur
+from Utils.helper import to_battle_array
+from Utils.rng import BattleRNG
+from Models.idx_const import POK_LEN
+from Models.battle_table import DYN_IDX, state_key, update_key
+from Models import trainer_ai
+from Engine.new_battle import undo, turn_outcomes, iter_turn_paths
+from Engine.batch_battle import BatchBattle, HP_COLS, damage_tables
+from Engine.damage_calc import DamageMatrix
+from SearchEngine import mcts_eval
+from SearchEngine.my_mcts import (
+    GameState, battle_over, legal_actions, trainer_move, mcts, threaded_mcts, reroot, subtree
+)
+from SearchEngine.array_tree import ArrayTree, NO_NODE
+
+
+def new_state(seed=0):
+    """3v3 battle with its own random stream"""
+    battle_array = to_battle_array([squirtle, charmander, bulbasaur], [bulbasaur, charmander, squirtle])
+    return GameState(battle_array, rng=BattleRNG(seed))
+
+
+def test_apply_turn_undo():
+    """A whole random battle played in place and undone newest first gives back the starting array"""
+    for seed in range(5):
+        state = new_state(seed)
+        battle_array = state.battle_array
+        start = battle_array.copy()
+        journal = []
+        while not battle_over(battle_array) and len(journal) < 200:
+            journal.append(state.apply(battle_array, state.rng.choice(legal_actions(battle_array))))
+        assert journal and not np.array_equal(battle_array, start)
+        for log in reversed(journal):
+            undo(battle_array, log)
+        assert np.array_equal(battle_array, start)
+
+
+def test_turn_outcome_probabilities():
+    """The chance paths of a turn, and the outcomes they merge into, add up to probability 1"""
+    state = new_state()
+    battle_array = state.battle_array
+    start = battle_array.copy()
+    opp_move = trainer_move(state.opp_ai, battle_array)
+    for action in legal_actions(battle_array):
+        paths = [probability for probability, _ in iter_turn_paths(battle_array, action, opp_move, state.dmg_matrix)]
+        outcomes = turn_outcomes(battle_array, action, opp_move, state.dmg_matrix)
+        assert len(outcomes) <= len(paths)
+        assert abs(sum(paths) - 1) < 1e-9
+        assert abs(sum(probability for probability, _ in outcomes) - 1) < 1e-9
+        assert np.array_equal(battle_array, start)
+
+
+def test_update_key():
+    """The key updated from each turn undo log is the key of the array hashed from scratch, step after step"""
+    state = new_state(1)
+    battle_array = state.battle_array
+    key = state_key(battle_array[DYN_IDX])
+    assert key == state.key
+    while not battle_over(battle_array):
+        log = state.apply(battle_array, state.rng.choice(legal_actions(battle_array)))
+        key = update_key(key, log, battle_array)
+        assert key == state_key(battle_array[DYN_IDX])
+    child = state.step(legal_actions(state.battle_array)[0])
+    assert child.key == state_key(child.dyn)
+
+
+def test_reroot():
+    """The rerooted node keeps its subtree and statistics, nothing in it points back to the old tree"""
+    root = mcts(new_state(2), 300, training=True)
+    action, outcomes = max(root.children.items(), key=lambda item: root.edges[item[0]].visits)
+    node = max(outcomes, key=lambda outcome: outcome.visits)
+    visits = node.visits
+    kept = list(subtree(node))
+    assert reroot(root, action, node.state) is node
+    assert node.parent is None
+    ids = {id(n) for n in kept}
+    assert all(n.parent is None or id(n.parent) in ids for n in kept)
+    assert mcts(node.state.clone(rng=BattleRNG(3)), 50, training=True, tree=node).visits == visits + 50
+
+
+def test_array_tree_buffers_reroot():
+    """ArrayTree buffers load back as the same tree, a reroot frees every row out of the kept subtree"""
+    state = new_state(4)
+    root = mcts(state, 300, training=True, array_tree=True)
+    tree = root.tree
+    copy = ArrayTree.from_buffers(tree.buffers())
+    for name, _, _, _ in ArrayTree.FIELDS:
+        assert np.array_equal(getattr(copy, name)[:copy.size], getattr(tree, name)[:tree.size])
+    assert (copy.root, copy.free) == (tree.root, tree.free)
+
+    action = max(root.children, key=lambda code: root.children[code][0].visits)
+    child = tree.child(tree.root, action)
+    kept = {node.index for node in subtree(root.children[action][0])}
+    node = reroot(root, action, None)
+    assert node.index == child and tree.root == child and tree.parent[child] == NO_NODE
+    assert sorted(tree.free) == sorted(set(range(tree.size)) - kept)
+    size = tree.size
+    node = mcts(state.step(action), 50, training=True, array_tree=True, tree=node)
+    assert tree.size == size or not tree.free  # Freed rows are used before the tree grows
+    assert not {n.index for n in subtree(node)} & set(tree.free)
+
+
+def test_threaded_small_caches():
+    """Threads sharing rollout weight and flag caches small enough to evict all the time still finish the search"""
+    sizes = mcts_eval.WEIGHT_CACHE_SIZE, trainer_ai.FLAG_CACHE_SIZE
+    mcts_eval.WEIGHT_CACHE_SIZE = trainer_ai.FLAG_CACHE_SIZE = 4
+    try:
+        state = new_state(6)  # Its own damage matrix, so caches of the small size
+        root = threaded_mcts(state, 400, threads=8, training=True)
+    finally:
+        mcts_eval.WEIGHT_CACHE_SIZE, trainer_ai.FLAG_CACHE_SIZE = sizes
+    assert root.visits == 400
+    assert len(mcts_eval._WEIGHTS.get(state.dmg_matrix)) == 4  # pylint: disable=W0212
+    assert len(trainer_ai._FLAGS.get(state.dmg_matrix)) == 4  # pylint: disable=W0212
+
+
+def test_flag_bands_stage_edges():
+    """Unclamped stages past +-6 (the engine lets them reach 7) don't share the flag cache key band of 6 / -6"""
+    pok = new_state().battle_array[:POK_LEN].copy()
+    flag_bands = trainer_ai._flag_bands  # pylint: disable=W0212
+    for field in trainer_ai.FLAG_KEY_FIELDS[:7]:
+        for thresholds in (trainer_ai.AI_STAGE_THRESHOLDS, trainer_ai.USER_STAGE_THRESHOLDS):
+            bands = []
+            for stage in (-7, -6, 6, 7):
+                pok[field] = stage
+                bands.append(flag_bands(pok, thresholds, trainer_ai.AI_HP_THRESHOLDS))
+            pok[field] = 0
+            assert len(set(bands)) == 4, (field, bands)
+
+
+def test_batch_turn_distribution():
+    """
+    One BatchBattle turn over many copies of a position ends on each HP of every Pokemon as often as the exact chance
+    paths of the scalar turn (turn_outcomes) say, within 3 binomial standard errors
+    """
+    start = new_state().battle_array
+    dmg_matrix = DamageMatrix()
+    n = 20000
+    for my_action in legal_actions(start):
+        for opp_move in range(3):
+            exact = [{} for _ in HP_COLS]
+            for probability, outcome in turn_outcomes(start, my_action, opp_move, dmg_matrix):
+                for counts, hp in zip(exact, outcome[HP_COLS].tolist()):
+                    counts[hp] = counts.get(hp, 0) + probability
+            batch = np.tile(start, (n, 1))
+            BatchBattle(batch, np.random.default_rng(7), damage_tables(dmg_matrix, start)).turn(
+                np.full(n, my_action), np.full(n, opp_move)
+            )
+            for counts, column in zip(exact, batch[:, HP_COLS].T):
+                hps, seen = np.unique(column, return_counts=True)
+                assert set(hps.tolist()) <= set(counts), (my_action, opp_move, hps, counts)
+                for hp, probability in counts.items():
+                    error = 3 * math.sqrt(probability * (1 - probability) / n)
+                    frequency = seen[hps == hp].sum() / n
+                    assert abs(frequency - probability) <= error + 1e-12, (my_action, opp_move, hp, frequency)
+
+
+if __name__ == '__main__':
+    for name, check in list(globals().items()):
+        if name.startswith('test_'):
+            check()
+            print(name, "ok")